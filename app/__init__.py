@@ -4,6 +4,7 @@ from flask_login import LoginManager
 from dotenv import load_dotenv
 from apscheduler.schedulers.background import BackgroundScheduler
 import atexit
+import os
 
 # Load environment variables from a .env file before importing Config
 load_dotenv()
@@ -16,49 +17,22 @@ login_manager.login_view = 'main.login'
 scheduler = None
 
 def check_expired_vouchers():
-    """Background job to disconnect expired vouchers."""
-    from .models import Voucher
-    from .utils import mikrotik_revoke_mac
-    from datetime import datetime, timezone
+    """Background job to disconnect expired vouchers.
+    Returns False if some expired vouchers could not be disconnected yet.
+    """
+    from .sessions import sweep_expired_vouchers
     
     try:
-        # Query activated vouchers that are expired and still have a user MAC assigned
-        expired_vouchers = Voucher.query.filter(
-            Voucher.activated_at != None,
-            Voucher.expires_at != None,
-            Voucher.user_mac_address != None,  # Only process if user_mac is still set
-            Voucher.is_developer == False
-        ).all()
-        
-        now = datetime.now(timezone.utc)
-        disconnected_count = 0
-        
-        for voucher in expired_vouchers:
-            # Check if actually expired
-            expires_at = voucher.expires_at
-            if expires_at.tzinfo is None:
-                expires_at = expires_at.replace(tzinfo=timezone.utc)
-            
-            remaining = (expires_at - now).total_seconds()
-            
-            if remaining <= 0:  # Expired
-                mac_address = voucher.user_mac_address
-                # Voucher has expired, revoke access
-                if mikrotik_revoke_mac(mac_address):
-                    # Clear user_mac to mark as disconnected (prevent reprocessing)
-                    voucher.user_mac_address = None
-                    db.session.commit()
-                    print(f"[SCHEDULER] Disconnected expired voucher: {voucher.code} (MAC: {mac_address}, expired {abs(remaining):.0f}s ago)")
-                    disconnected_count += 1
-            else:
-                # Log active vouchers with time remaining (optional, helpful for debugging)
-                if remaining < 30:  # Only log if less than 30 seconds remaining
-                    print(f"[SCHEDULER] Voucher {voucher.code} expiring in {remaining:.0f}s")
-        
+        disconnected_count, pending_count = sweep_expired_vouchers()
         if disconnected_count > 0:
             print(f"[SCHEDULER] Disconnected {disconnected_count} expired voucher(s)")
+        if pending_count > 0:
+            print(f"[SCHEDULER] {pending_count} expired voucher(s) still connected, will retry")
+        return pending_count == 0
     except Exception as e:
+        db.session.rollback()
         print(f"[SCHEDULER] Error checking expired vouchers: {str(e)}")
+        return False
 
 def create_app(config_class=Config):
     app = Flask(__name__)
@@ -72,21 +46,64 @@ def create_app(config_class=Config):
     login_manager.init_app(app)
 
     with app.app_context():
-        from .models import Admin, Voucher  # Import models so db.create_all() works
-        db.create_all()
+        # Create missing tables, then bring existing ones up to the current schema
+        from .migrations import migrate
+        migrate(db.engine)
         
         # Initialize scheduler for automatic voucher expiration
         global scheduler
         if scheduler is None:
+            from .sessions import expiry_scheduler, pending_deadlines
+
+            # Wake exactly at the next voucher deadline; seed with sessions that are
+            # already running (overdue ones are swept right away)
+            expiry_scheduler.start(job=lambda: check_expired_vouchers_with_context(app),
+                                   deadlines=pending_deadlines())
+            atexit.register(expiry_scheduler.stop)
+
+            # Keep a local copy of the router tables so page loads never query the router
+            from .mirror import router_mirror
+            router_mirror.start()
+            atexit.register(router_mirror.stop)
+
+            # Sample server CPU/memory/temperature off the request path
+            from .server_stats import server_sampler
+            try:
+                server_sampler.start()
+                atexit.register(server_sampler.stop)
+            except Exception as e:
+                print(f"[ERROR] Server stats sampler not started: {str(e)}")
+
+            # WAN and per-queue bandwidth history for the admin charts
+            from .timeseries import traffic_store
+            traffic_store.start(app)
+            atexit.register(traffic_store.stop)
+
+            # Per-voucher data usage and data-cap cutoff
+            from .accounting import usage_meter
+            usage_meter.start(app)
+            atexit.register(usage_meter.stop)
+
+            # Workers that push queued activations to the router (with retries)
+            from .jobs import activation_queue
+            activation_queue.start(app)
+            atexit.register(activation_queue.stop)
+
+            # Repair bindings/queues that drifted while we were down (crash, router reset, Winbox edits)
+            if os.environ.get('RECONCILE_ON_STARTUP', 'true').lower() == 'true':
+                from .reconcile import reconcile_in_background
+                reconcile_in_background(app)
+
             scheduler = BackgroundScheduler(daemon=True)
-            # Check for expired vouchers every 15 seconds
+            # Slow safety-net sweep for vouchers changed outside this process
+            safety_interval = int(os.environ.get('EXPIRY_SAFETY_SWEEP_SECONDS', 300))
             scheduler.add_job(func=lambda: check_expired_vouchers_with_context(app), 
                             trigger="interval", 
-                            seconds=15,
+                            seconds=safety_interval,
                             id='check_expired_vouchers',
                             replace_existing=True)
             scheduler.start()
-            print("[SCHEDULER] Started automatic voucher expiration monitor (every 30 seconds)")
+            print(f"[SCHEDULER] Started voucher expiration scheduler (deadline-driven, safety sweep every {safety_interval}s)")
             
             # Shutdown scheduler when app exits
             atexit.register(lambda: scheduler.shutdown())
@@ -104,4 +121,4 @@ def create_app(config_class=Config):
 def check_expired_vouchers_with_context(app):
     """Wrapper to run check_expired_vouchers with Flask app context."""
     with app.app_context():
-        check_expired_vouchers()
+        return check_expired_vouchers()
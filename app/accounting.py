@@ -0,0 +1,191 @@
+# app/accounting.py
+"""Per-voucher data usage, accumulated from the users' simple queue byte counters."""
+import os
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import or_, text
+
+from . import db
+from .models import Voucher
+from .utils import get_pooled_api, _row_id, _split_pair, counter_delta, to_int
+
+_ADD_USAGE = text(
+    "UPDATE vouchers SET bytes_up = bytes_up + :up, bytes_down = bytes_down + :down WHERE id = :id"
+)
+
+
+class UsageMeter:
+    """Adds queue traffic to the voucher that owns the queue.
+
+    Each pass reads the pisonet-* queue counters (from the router mirror when
+    it is fresh), diffs them against the previous pass and writes the deltas
+    with one SELECT of running vouchers and one executemany UPDATE, so a pass
+    costs the same two statements however many sessions are running.
+    A counter that went down, or a queue whose id changed, was reset (queue
+    re-created, router reboot) and counts from zero.
+
+    Vouchers with a data cap that is used up are expired and revoked in the
+    same pass. Traffic after the last pass of a session (at most `interval`
+    seconds) is not counted.
+    """
+    def __init__(self, interval=15, name_prefix="pisonet"):
+        self.interval = interval
+        self.name_prefix = name_prefix
+        self._last = {}  # queue name -> (queue id, upload total, download total)
+        self._primed = False
+        self._thread = None
+        self._stopped = threading.Event()
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def deltas(self, queues):
+        """{MAC (upper case): (upload, download)} bytes moved since the previous call."""
+        prefix = f"{self.name_prefix}-"
+        seen, usage = {}, {}
+        for row in queues:
+            name = row.get('name') or ''
+            if not name.startswith(prefix):
+                continue
+            upload, download = (to_int(v) for v in _split_pair(row, 'bytes'))
+            queue_id = _row_id(row)
+            seen[name] = (queue_id, upload, download)
+
+            previous = self._last.get(name)
+            if previous is None or previous[0] != queue_id:
+                if not self._primed:
+                    # Already running when we started; earlier traffic was counted by the last run
+                    continue
+                # Queue created since the last pass, everything on it is new
+                up, down = upload, download
+            else:
+                up, down = counter_delta(previous[1], upload), counter_delta(previous[2], download)
+            if up or down:
+                usage[name[len(prefix):].replace('-', ':').upper()] = (up, down)
+
+        self._last = seen
+        self._primed = True
+        return usage
+
+    def apply(self, usage, now=None):
+        """Add usage to the running voucher for each MAC and cut off vouchers over their cap.
+
+        Returns (updated, capped) counts.
+        """
+        if not usage:
+            return 0, 0
+        now = now or datetime.now(timezone.utc)
+        running = db.session.query(
+            Voucher.id, Voucher.code, Voucher.user_mac_address, Voucher.bytes_up, Voucher.bytes_down,
+            Voucher.data_limit_bytes, Voucher.expires_at
+        ).filter(
+            Voucher.activated_at != None,
+            Voucher.user_mac_address != None,
+            or_(Voucher.expires_at > now, Voucher.is_developer == True)
+        ).all()
+        # Sorted by expiry so the voucher that runs longest gets the traffic, as in reconcile
+        running.sort(key=lambda row: row.expires_at)
+        by_mac = {row.user_mac_address.upper(): row for row in running}
+
+        updates, capped_ids, codes = [], [], []
+        for mac, (up, down) in usage.items():
+            row = by_mac.get(mac)
+            if row is None:
+                continue
+            updates.append({'id': row.id, 'up': up, 'down': down})
+            codes.append(row.code)
+            if row.data_limit_bytes is not None and \
+                    (row.bytes_up or 0) + (row.bytes_down or 0) + up + down >= row.data_limit_bytes:
+                capped_ids.append(row.id)
+        if not updates:
+            return 0, 0
+
+        db.session.execute(_ADD_USAGE, updates)
+        db.session.commit()
+        # Data used is part of /api/status
+        from .sessions import forget_status
+        forget_status(codes)
+
+        if capped_ids:
+            self._cut_off(capped_ids, now)
+        return len(updates), len(capped_ids)
+
+    def _cut_off(self, voucher_ids, now):
+        from .sessions import revoke_vouchers, expiry_scheduler
+
+        vouchers = Voucher.query.filter(Voucher.id.in_(voucher_ids)).all()
+        for voucher in vouchers:
+            # Expire it so the voucher can't be used again, and move its deadline to now
+            # so the expiry scheduler retries a failed revoke right away
+            voucher.expires_at = now
+            expiry_scheduler.schedule(voucher.id, now)
+        revoked, failed = revoke_vouchers(vouchers, reason='data_limit')
+        print(f"[USAGE] Data limit reached: revoked {len(revoked)} voucher(s)"
+              + (f", {len(failed)} will be retried by the expiry sweep" if failed else ""))
+
+    def sample(self):
+        """One accounting pass: read counters, store deltas. Needs an app context."""
+        queues = read_queue_counters()
+        if queues is None:
+            return 0, 0
+        return self.apply(self.deltas(queues))
+
+    def start(self, app):
+        if not self.enabled or self._thread is not None:
+            return
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name='usage-meter', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            with self._app.app_context():
+                try:
+                    self.sample()
+                except Exception as e:
+                    db.session.rollback()
+                    print(f"[USAGE] Accounting pass failed: {str(e)}")
+                finally:
+                    db.session.remove()
+
+
+def read_queue_counters():
+    """Simple queue rows with id, name and bytes; None if the router can't be read.
+
+    In PCQ bandwidth mode the same shape is built from the hotspot host counters,
+    and the same host read drives the tier pass (users whose IP has turned up
+    since activation are added to their tier).
+    """
+    from .bandwidth import pcq_enabled, counter_rows, read_hosts, sync_tiers
+    from .reconcile import desired_state
+    from .mirror import router_mirror
+
+    snap = router_mirror.fresh_snapshot() if not pcq_enabled() else None
+    if snap is not None:
+        return snap.queues
+    api_pool = get_pooled_api()
+    if not api_pool:
+        return None
+    try:
+        api = api_pool.get_api()
+        if pcq_enabled():
+            hosts = read_hosts(api)
+            try:
+                sync_tiers(api, desired_state(), hosts, usage_meter.name_prefix)
+            except Exception as e:
+                print(f"[USAGE] Tier pass failed: {str(e)}")
+            return counter_rows(api, usage_meter.name_prefix, hosts)
+        return api.get_resource('/queue/simple').call('print', {'.proplist': '.id,name,bytes'})
+    except Exception as e:
+        print(f"[USAGE] Error reading queue counters: {str(e)}")
+        return None
+    finally:
+        api_pool.release()
+
+
+usage_meter = UsageMeter(interval=float(os.environ.get('USAGE_SAMPLE_INTERVAL', 15)))
@@ -2,7 +2,7 @@ from flask import render_template, request, redirect, url_for, flash, current_ap
 from flask_login import login_required, current_user
 from . import admin_bp
 from .. import db
-from ..models import Admin, Voucher
+from ..models import Admin, Voucher, IncomeRollup
 from ..utils import restart_mikrotik, stop_mikrotik
 import string
 import secrets
@@ -10,6 +10,7 @@ import os
 import signal
 import subprocess
 import sys
+import time
 
 
 @admin_bp.before_request
@@ -22,45 +23,41 @@ def check_admin_access():
 
 @admin_bp.route('/')
 def dashboard():
-    from ..utils import (
-        get_mikrotik_api, 
-        get_mikrotik_system_stats, 
-        get_mikrotik_active_hotspot_users, 
-        get_mikrotik_interface_traffic, 
-        get_income_stats,
-        get_mikrotik_health,
-        get_server_stats
-    )
+    from ..dashboard import gather_dashboard
+    from ..utils import get_income_stats, paginate
     
-    api_pool = get_mikrotik_api()
-    try:
-        system_stats = get_mikrotik_system_stats(api_pool)
-        active_users = get_mikrotik_active_hotspot_users(api_pool)
-        traffic = get_mikrotik_interface_traffic(api_pool=api_pool)
-        health = get_mikrotik_health(api_pool)
-        income_stats = get_income_stats()
-        server_stats = get_server_stats()
-    finally:
-        if api_pool:
-            pass
+    # All router and server sources are fetched in parallel, each with its own deadline
+    data, sources = gather_dashboard()
+    system_stats = data['system_stats']
+    active_users = data['active_users']
+    traffic = data['traffic']
+    health = data['health']
+    server_stats = data['server_stats']
+    income_stats = get_income_stats()
 
     # Only show users that are actually active on MikroTik router
     # No database fallback - dashboard should reflect real MikroTik state
     if not active_users:
         active_users = []
+    # First page only; the rest is loaded from /api/active-users
+    active_page = paginate(active_users)
 
-    # Treat mock uptime marker as disconnected
-    connection_ok = system_stats.get('uptime') != 'Offline (Mock)'
+    # Router counts as down when its main source missed the deadline (values shown are cached)
+    connection_ok = sources['system_stats']['ok']
+    stale_sources = {name: meta for name, meta in sources.items() if meta['stale']}
     
     admins = Admin.query.all()
     return render_template('dashboard.html', 
                            system_stats=system_stats,
-                           active_users=active_users,
+                           active_users=active_page['items'],
+                           active_total=active_page['total'],
                            traffic=traffic,
                            income_stats=income_stats,
                            health=health,
                            server_stats=server_stats,
                            connection_ok=connection_ok,
+                           sources=sources,
+                           stale_sources=stale_sources,
                            admins=admins,
                            current_user=current_user)
 
@@ -104,7 +101,15 @@ def change_password():
 def reset_vouchers():
     try:
         num_deleted = db.session.query(Voucher).delete()
+        # Income is derived from the vouchers, so it goes with them
+        db.session.query(IncomeRollup).delete()
         db.session.commit()
+        # Open status pages learn their voucher is gone
+        from ..events import status_events
+        from ..sessions import status_versions
+        status_versions.invalidate()
+        for code in status_events.topics():
+            status_events.publish(code, 'removed', {'active': False, 'remaining_seconds': 0, 'reason': 'removed'})
         flash(f"Reset complete. Deleted {num_deleted} vouchers.", "success")
     except Exception as e:
         db.session.rollback()
@@ -115,25 +120,13 @@ def reset_vouchers():
 @admin_bp.route('/api/profiles', methods=['GET'])
 def get_profiles():
     """Get list of available voucher profiles"""
-    import json
-    profiles_file = 'profiles.json'
-    
-    try:
-        if os.path.exists(profiles_file):
-            with open(profiles_file, 'r') as f:
-                profiles = json.load(f)
-        else:
-            profiles = []
-        return jsonify(profiles)
-    except Exception as e:
-        return jsonify([]), 500
+    from ..profiles import profile_registry
+    return jsonify(profile_registry.entries())
 
 
 @admin_bp.route('/api/generate-vouchers', methods=['POST'])
 def generate_vouchers():
     """Generate vouchers based on selected profile"""
-    import json
-    
     try:
         data = request.get_json()
         profile_name = data.get('profile')
@@ -142,47 +135,25 @@ def generate_vouchers():
         if not profile_name:
             return jsonify({'success': False, 'error': 'Profile name is required'}), 400
             
-        if quantity < 1 or quantity > 100:
-            return jsonify({'success': False, 'error': 'Quantity must be between 1 and 100'}), 400
-        
-        # Load profiles
-        profiles_file = 'profiles.json'
-        if not os.path.exists(profiles_file):
-            return jsonify({'success': False, 'error': 'Profiles file not found'}), 404
-            
-        with open(profiles_file, 'r') as f:
-            profiles = json.load(f)
+        from ..profiles import profile_registry
+        from ..vouchers import create_vouchers, MAX_BATCH
+        if quantity < 1 or quantity > MAX_BATCH:
+            return jsonify({'success': False, 'error': f'Quantity must be between 1 and {MAX_BATCH}'}), 400
         
-        # Find the selected profile
-        profile = next((p for p in profiles if p['name'] == profile_name), None)
+        profile = profile_registry.get(profile_name)
         if not profile:
             return jsonify({'success': False, 'error': 'Profile not found'}), 404
         
-        # Parse validity to seconds
-        validity_str = profile['validity']
-        if validity_str.endswith('m'):
-            duration_seconds = int(validity_str[:-1]) * 60
-        elif validity_str.endswith('h'):
-            duration_seconds = int(validity_str[:-1]) * 3600
-        elif validity_str.endswith('d'):
-            duration_seconds = int(validity_str[:-1]) * 86400
-        else:
-            return jsonify({'success': False, 'error': 'Invalid validity format'}), 400
-        
-        # Generate vouchers
-        voucher_codes = []
-        for _ in range(quantity):
-            code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-            voucher = Voucher(
-                code=code, 
-                duration=duration_seconds,
-                rate_limit_up=profile.get('rate_up', '1M'),
-                rate_limit_down=profile.get('rate_down', '2M')
-            )
-            db.session.add(voucher)
-            voucher_codes.append(code)
+        # Optional data cap, e.g. "500M" or "1G" (request overrides the profile)
+        fields = profile.voucher_fields()
+        if data.get('data_limit'):
+            from ..utils import parse_data_size
+            fields['data_limit_bytes'] = parse_data_size(data['data_limit'])
+            if not fields['data_limit_bytes']:
+                return jsonify({'success': False, 'error': 'Invalid data limit format'}), 400
         
-        db.session.commit()
+        # Generate vouchers (one collision check and one insert for the whole batch)
+        voucher_codes = create_vouchers(quantity, **fields)
         
         return jsonify({
             'success': True,
@@ -196,6 +167,44 @@ def generate_vouchers():
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
+@admin_bp.route('/api/vouchers/export')
+def export_vouchers():
+    """Stream vouchers as CSV (?format=csv) or printable sheets (?format=html).
+
+    Filters: ?profile=, ?status=unused|active|expired, ?since=/?until=YYYY-MM-DD (created, local dates)
+    """
+    from datetime import date
+    from flask import Response, stream_with_context
+    from ..vouchers import export_query, iter_export_records, iter_csv, iter_print_sheets
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'html'):
+        return jsonify({'success': False, 'error': 'format must be csv or html'}), 400
+    try:
+        since = date.fromisoformat(request.args['since']) if request.args.get('since') else None
+        until = date.fromisoformat(request.args['until']) if request.args.get('until') else None
+        query = export_query(
+            profile=request.args.get('profile') or None,
+            since=since,
+            until=until,
+            status=request.args.get('status') or None
+        )
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    # Rows are read in batches while the response is being sent
+    records = iter_export_records(query)
+    filename = f"vouchers-{date.today().isoformat()}"
+    if export_format == 'csv':
+        return Response(
+            stream_with_context(iter_csv(records)),
+            mimetype='text/csv',
+            headers={'Content-Disposition': f'attachment; filename="{filename}.csv"'}
+        )
+    per_page = request.args.get('per_page', 40, type=int)
+    return Response(stream_with_context(iter_print_sheets(records, per_page=max(per_page, 1))), mimetype='text/html')
+
+
 @admin_bp.route('/api/restart-mikrotik', methods=['POST'])
 def api_restart_mikrotik():
     """API endpoint to restart MikroTik router"""
@@ -216,35 +225,127 @@ def api_stop_mikrotik():
         return jsonify({'success': False, 'message': str(e)}), 500
 
 
+@admin_bp.route('/api/reconcile', methods=['POST'])
+def api_reconcile():
+    """Diff active vouchers against router bindings/queues and fix drift (?dry_run=1 to preview)"""
+    from ..reconcile import reconcile_router, format_report
+
+    dry_run = request.args.get('dry_run', '').lower() in ('1', 'true', 'yes')
+    try:
+        report = reconcile_router(apply=not dry_run)
+        if report is None:
+            return jsonify({'success': False, 'message': 'Cannot connect to MikroTik API'}), 500
+        return jsonify({'success': True, 'dry_run': dry_run, 'report': report, 'message': format_report(report)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': str(e)}), 500
+
+
+@admin_bp.route('/api/cache-stats', methods=['GET'])
+def api_cache_stats():
+    """Hit/miss counters of the router read caches and the connection pool size"""
+    from ..cache import cache_stats
+    from ..utils import get_connection_pool
+
+    return jsonify({'success': True, 'caches': cache_stats(), 'pool': get_connection_pool().stats()})
+
+
+@admin_bp.route('/api/active-users', methods=['GET'])
+def api_active_users():
+    """One page of active hotspot users (?offset=0&limit=20)"""
+    from ..utils import get_mikrotik_active_hotspot_users, paginate, ACTIVE_PAGE_SIZE
+
+    try:
+        offset = request.args.get('offset', 0, type=int)
+        limit = min(request.args.get('limit', ACTIVE_PAGE_SIZE, type=int), 200)
+        page = paginate(get_mikrotik_active_hotspot_users(), offset, limit)
+        return jsonify({'success': True, 'users': page.pop('items'), **page})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
 @admin_bp.route('/api/user-traffic', methods=['GET'])
 def api_user_traffic():
     """Get traffic statistics for all active users"""
-    from ..utils import get_mikrotik_active_users_with_traffic, format_bytes
-    
+    from ..utils import get_mikrotik_active_users_with_traffic
+    from ..traffic_feed import traffic_feed, format_user_traffic
+
     try:
-        users = get_mikrotik_active_users_with_traffic()
-        
-        # Format the data for display
-        formatted_users = []
-        for user in users:
-            formatted_users.append({
-                'user': user.get('user', 'Unknown'),
-                'mac': user.get('mac', ''),
-                'uptime': user.get('uptime', '0s'),
-                'bytes_in': user.get('bytes_in', 0),
-                'bytes_out': user.get('bytes_out', 0),
-                'bytes_in_formatted': format_bytes(user.get('bytes_in', 0)),
-                'bytes_out_formatted': format_bytes(user.get('bytes_out', 0)),
-                'queue_bytes_in': user.get('queue_bytes_in', 0),
-                'queue_bytes_out': user.get('queue_bytes_out', 0),
-                'queue_bytes_in_formatted': format_bytes(user.get('queue_bytes_in', 0)),
-                'queue_bytes_out_formatted': format_bytes(user.get('queue_bytes_out', 0)),
-                'rate_in': user.get('rate_in', '0'),
-                'rate_out': user.get('rate_out', '0'),
-                'max_limit': user.get('max_limit', 'Unlimited')
-            })
-        
-        return jsonify({'success': True, 'users': formatted_users})
+        # While the live feed runs its last read is newer than anything cached
+        users = traffic_feed.snapshot()
+        if users is None:
+            users = format_user_traffic(get_mikrotik_active_users_with_traffic())
+        return jsonify({'success': True, 'users': users})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@admin_bp.route('/api/user-traffic/events', methods=['GET'])
+def api_user_traffic_events():
+    """Live traffic table (Server-Sent Events), one shared router poller for every open tab"""
+    from flask import Response
+    from ..events import stream_events
+    from ..traffic_feed import traffic_feed
+
+    subscription = traffic_feed.subscribe(current_app._get_current_object())
+    if subscription is None:
+        # Too many streams open; the page keeps polling /api/user-traffic
+        return Response(status=204)
+    users = traffic_feed.snapshot()
+    first = ('traffic', {'users': users}) if users is not None else None
+    response = Response(stream_events(subscription, first), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    response.call_on_close(subscription.close)
+    return response
+
+
+@admin_bp.route('/api/traffic/history', methods=['GET'])
+def api_traffic_history():
+    """Bandwidth history for one series (?series=wan:ether1&resolution=raw|1m|1h|1d&hours=6)"""
+    from ..timeseries import traffic_store, RESOLUTIONS
+
+    series = request.args.get('series') or f"wan:{os.getenv('MIKROTIK_WAN_INTERFACE', 'ether1')}"
+    resolution = request.args.get('resolution', '1m')
+    if resolution != 'raw' and resolution not in RESOLUTIONS:
+        return jsonify({'success': False, 'error': f'Unknown resolution: {resolution}'}), 400
+    try:
+        hours = request.args.get('hours', type=float)
+        since = time.time() - hours * 3600 if hours else None
+        points = traffic_store.query(series, resolution, since=since)
+        return jsonify({'success': True, 'series': series, 'resolution': resolution, 'points': points})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@admin_bp.route('/api/traffic/top', methods=['GET'])
+def api_traffic_top():
+    """Queues that used the most bandwidth in the last ?minutes=60 (or a ?since=&until= unix window)"""
+    from ..timeseries import traffic_store
+    from ..utils import format_bytes
+
+    try:
+        until = request.args.get('until', type=float) or time.time()
+        since = request.args.get('since', type=float) or until - request.args.get('minutes', 60, type=float) * 60
+        limit = min(request.args.get('limit', 10, type=int), 100)
+        top = [{
+            'series': series,
+            'name': series.split(':', 1)[1],
+            'rx_bytes': rx,
+            'tx_bytes': tx,
+            'rx_formatted': format_bytes(rx),
+            'tx_formatted': format_bytes(tx),
+        } for series, rx, tx in traffic_store.top_series(since, until, limit)]
+        return jsonify({'success': True, 'since': int(since), 'until': int(until), 'top': top})
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+@admin_bp.route('/api/traffic/series', methods=['GET'])
+def api_traffic_series():
+    """Names of every series with recorded history"""
+    from ..timeseries import traffic_store
+
+    try:
+        return jsonify({'success': True, 'series': traffic_store.series_names()})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -266,6 +367,19 @@ def api_set_bandwidth():
         success = mikrotik_add_queue(mac_address, upload_speed, download_speed)
         
         if success:
+            from ..sessions import status_updates, publish_status
+
+            # Keep the voucher in sync so reconciliation doesn't undo the new limit
+            vouchers = Voucher.query.filter(
+                Voucher.user_mac_address == mac_address,
+                Voucher.activated_at != None
+            ).all()
+            for voucher in vouchers:
+                voucher.rate_limit_up = upload_speed
+                voucher.rate_limit_down = download_speed
+            updates = status_updates(vouchers, reason='bandwidth')
+            db.session.commit()
+            publish_status(updates, 'updated')
             return jsonify({'success': True, 'message': f'Bandwidth limit set to {upload_speed}/{download_speed}'})
         else:
             return jsonify({'success': False, 'error': 'Failed to set bandwidth limit'}), 500
@@ -277,7 +391,7 @@ def api_set_bandwidth():
 @admin_bp.route('/api/remove-bandwidth', methods=['POST'])
 def api_remove_bandwidth():
     """Remove bandwidth limit for a user"""
-    from ..utils import mikrotik_remove_queue
+    from ..utils import mikrotik_remove_queue, UNLIMITED
     
     try:
         data = request.get_json()
@@ -289,6 +403,19 @@ def api_remove_bandwidth():
         success = mikrotik_remove_queue(mac_address)
         
         if success:
+            from ..sessions import status_updates, publish_status
+
+            # Mark the voucher unlimited so reconciliation doesn't put the queue back
+            vouchers = Voucher.query.filter(
+                Voucher.user_mac_address == mac_address,
+                Voucher.activated_at != None
+            ).all()
+            for voucher in vouchers:
+                voucher.rate_limit_up = UNLIMITED
+                voucher.rate_limit_down = UNLIMITED
+            updates = status_updates(vouchers, reason='bandwidth')
+            db.session.commit()
+            publish_status(updates, 'updated')
             return jsonify({'success': True, 'message': 'Bandwidth limit removed'})
         else:
             return jsonify({'success': False, 'error': 'Failed to remove bandwidth limit'}), 500
@@ -301,22 +428,12 @@ def api_remove_bandwidth():
 def bandwidth_config():
     """Bandwidth configuration page"""
     from ..utils import get_mikrotik_active_users_with_traffic, format_bytes
-    import json
+    from ..profiles import profile_registry
     
     # Get active users with traffic
     users = get_mikrotik_active_users_with_traffic()
     
-    # Load profiles for speed presets
-    profiles_file = 'profiles.json'
-    profiles = []
-    if os.path.exists(profiles_file):
-        try:
-            with open(profiles_file, 'r') as f:
-                profiles = json.load(f)
-        except Exception as e:
-            print(f"Error loading profiles: {e}")
-    
     return render_template('bandwidth.html', 
                          users=users, 
-                         profiles=profiles,
+                         profiles=profile_registry.all(),
                          format_bytes=format_bytes)
\ No newline at end of file
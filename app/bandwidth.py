@@ -0,0 +1,362 @@
+# app/bandwidth.py
+"""PCQ bandwidth mode: per-profile tiers instead of one simple queue per user.
+
+With BANDWIDTH_MODE=pcq every distinct upload/download pair (normally one per
+profile) becomes a tier, built once on the router:
+
+    /queue/type              <tier>-up, <tier>-down   kind=pcq, pcq-rate = the tier's speed,
+                                                      classified per source / destination address
+    /ip/firewall/mangle      forward, src-address-list=<tier> -> packet mark <tier>-up
+                             forward, dst-address-list=<tier> -> packet mark <tier>-down
+    /queue/tree              pisonet-up / pisonet-down (parent=global), one child per tier and direction
+
+A user is put in a tier by adding their IP to the tier's address list, so
+activation and revocation are a single address-list add/remove and the
+router's per-packet cost no longer grows with the number of users the way a
+long /queue/simple list does. Address lists only hold IPs, so the MAC is kept
+in the entry's comment and its IP is looked up in /ip/hotspot/host.
+
+Per-user byte counters come from /ip/hotspot/host instead of the simple
+queue counters. Note that FastTrack'ed connections bypass the queue tree.
+"""
+import os
+import threading
+import time
+
+from .utils import get_pooled_api, _row_id, _remove_ids, _collect, _router_changed, _queue_name, UNLIMITED
+
+BANDWIDTH_MODE = os.environ.get('BANDWIDTH_MODE', 'simple').strip().lower()
+
+TIER_COMMENT = 'PisoNet bandwidth tier'
+ENTRY_COMMENT_PREFIX = 'PisoNet '  # address-list entry comment: "PisoNet AA:BB:CC:DD:EE:FF"
+
+HOST_PROPS = '.id,mac-address,address,bypassed,bytes-in,bytes-out,packets-in,packets-out'
+ENTRY_PROPS = '.id,list,address,comment'
+
+
+def pcq_enabled():
+    return BANDWIDTH_MODE == 'pcq'
+
+
+def tier_name(upload_speed, download_speed, name_prefix="pisonet"):
+    return f"{name_prefix}-tier-{upload_speed}-{download_speed}"
+
+
+def _entry_mac(row):
+    comment = row.get('comment') or ''
+    if comment.startswith(ENTRY_COMMENT_PREFIX):
+        return comment[len(ENTRY_COMMENT_PREFIX):].strip().upper()
+    return None
+
+
+# ============ TIERS ============
+
+class TierBuilder:
+    """Creates the queue types, mangle rules and queue tree for each tier once.
+
+    Tiers already confirmed on the router are remembered, so activating a
+    user in an existing tier costs no extra reads. forget() (after a router
+    reboot or a reconcile) makes the next call check again.
+    """
+    def __init__(self, name_prefix="pisonet"):
+        self.name_prefix = name_prefix
+        self._ready = set()
+        self._lock = threading.Lock()
+
+    def forget(self):
+        with self._lock:
+            self._ready.clear()
+
+    def ensure(self, api, speeds):
+        """Make sure every (upload, download) pair in `speeds` has its tier. Returns {tier: error or None}."""
+        wanted = {tier_name(up, down, self.name_prefix): (up, down) for up, down in speeds
+                  if UNLIMITED not in (up, down)}
+        with self._lock:
+            missing = {name: pair for name, pair in wanted.items() if name not in self._ready}
+            if not missing:
+                return {name: None for name in wanted}
+
+            queue_types = api.get_resource('/queue/type')
+            mangle = api.get_resource('/ip/firewall/mangle')
+            queue_tree = api.get_resource('/queue/tree')
+            type_names = {row.get('name') for row in queue_types.call('print', {'.proplist': 'name'})}
+            marks = {row.get('new-packet-mark') for row in mangle.call('print', {'.proplist': 'new-packet-mark,comment'})
+                     if row.get('comment') == TIER_COMMENT}
+            tree_names = {row.get('name') for row in queue_tree.call('print', {'.proplist': 'name'})}
+
+            # Parents first: children reference them by name
+            parents = []
+            for direction in ('up', 'down'):
+                parent = f"{self.name_prefix}-{direction}"
+                if parent not in tree_names:
+                    parents.append((parent, queue_tree.call_async('add', {
+                        'name': parent, 'parent': 'global', 'comment': TIER_COMMENT})))
+            errors = _collect(parents)
+            if any(errors.values()):
+                return {name: next(e for e in errors.values() if e) for name in wanted}
+
+            promises = []
+            for name, (up, down) in missing.items():
+                for direction, rate, classifier, match in (
+                        ('up', up, 'src-address', 'src-address-list'),
+                        ('down', down, 'dst-address', 'dst-address-list')):
+                    leaf = f"{name}-{direction}"
+                    if leaf not in type_names:
+                        promises.append((name, queue_types.call_async('add', {
+                            'name': leaf, 'kind': 'pcq', 'pcq-rate': rate, 'pcq-classifier': classifier})))
+                    if leaf not in marks:
+                        promises.append((name, mangle.call_async('add', {
+                            'chain': 'forward', match: name, 'action': 'mark-packet',
+                            'new-packet-mark': leaf, 'passthrough': 'no', 'comment': TIER_COMMENT})))
+            created = {name for name, _ in promises}
+            errors = _collect(promises)
+
+            # Tree leaves need their queue type to exist, so they go in a second round
+            promises = []
+            for name in missing:
+                if errors.get(name):
+                    continue
+                for direction in ('up', 'down'):
+                    leaf = f"{name}-{direction}"
+                    if leaf not in tree_names:
+                        promises.append((name, queue_tree.call_async('add', {
+                            'name': leaf, 'parent': f"{self.name_prefix}-{direction}",
+                            'packet-mark': leaf, 'queue': leaf, 'comment': TIER_COMMENT})))
+            created.update(name for name, _ in promises)
+            for name, error in _collect(promises).items():
+                if error and not errors.get(name):
+                    errors[name] = error
+
+            for name in missing:
+                if errors.get(name):
+                    print(f"[MIKROTIK] Error creating bandwidth tier {name}: {errors[name]}")
+                else:
+                    self._ready.add(name)
+                    if name in created:
+                        print(f"[MIKROTIK] Created bandwidth tier {name}")
+            return {name: errors.get(name) for name in wanted}
+
+
+tier_builder = TierBuilder()
+
+
+# ============ USERS ============
+
+def read_hosts(api):
+    """/ip/hotspot/host rows keyed by upper-case MAC."""
+    hosts = {}
+    for row in api.get_resource('/ip/hotspot/host').call('print', {'.proplist': HOST_PROPS}):
+        if row.get('mac-address'):
+            hosts[row['mac-address'].upper()] = row
+    return hosts
+
+
+def read_entries(api, name_prefix="pisonet"):
+    """Our address-list entries as {MAC: [rows]}."""
+    list_prefix = f"{name_prefix}-tier-"
+    entries = {}
+    for row in api.get_resource('/ip/firewall/address-list').call('print', {'.proplist': ENTRY_PROPS}):
+        mac = _entry_mac(row)
+        if mac and (row.get('list') or '').startswith(list_prefix):
+            entries.setdefault(mac, []).append(row)
+    return entries
+
+
+def plan_tier_changes(desired, entries, hosts, name_prefix="pisonet"):
+    """Diff desired tiers against address-list entries. Pure function.
+
+    desired: {MAC: (mac, upload, download)}; entries: {MAC: [address-list rows]};
+    hosts: {MAC: hotspot host row}. A user whose IP isn't known yet (no host
+    entry) can't be listed; they are reported in 'no_address' and listed by
+    the periodic tier pass (sync_tiers) once the host shows up. Users whose
+    limit was removed (UNLIMITED speeds) are kept out of every tier.
+    """
+    desired = {key: row for key, row in desired.items() if UNLIMITED not in row[1:]}
+    plan = {'add_entries': [], 'remove_entries': [], 'no_address': []}
+    for key, (mac, upload_speed, download_speed) in desired.items():
+        wanted_list = tier_name(upload_speed, download_speed, name_prefix)
+        address = (hosts.get(key) or {}).get('address')
+        rows = entries.get(key, [])
+        keep = next((row for row in rows if row.get('list') == wanted_list
+                     and (address is None or row.get('address') == address)), None)
+        plan['remove_entries'].extend(_row_id(row) for row in rows if row is not keep)
+        if keep is None:
+            if address:
+                plan['add_entries'].append((mac, wanted_list, address))
+            else:
+                plan['no_address'].append(mac)
+    for key, rows in entries.items():
+        if key not in desired:
+            plan['remove_entries'].extend(_row_id(row) for row in rows)
+    return plan
+
+
+def apply_tiers(api, allow=None, revoke=(), name_prefix="pisonet"):
+    """Put MACs into their tier and/or take them out, over an open API session.
+
+    allow: {mac: (upload, download)}; revoke: MACs to remove from every tier.
+    Returns {mac: error message or None} for the allowed MACs. A MAC with no
+    IP address yet is not an error: sync_tiers lists it once its host appears.
+    """
+    allow = allow or {}
+    errors = {mac: None for mac in allow}
+    tier_errors = tier_builder.ensure(api, set(allow.values())) if allow else {}
+
+    address_list = api.get_resource('/ip/firewall/address-list')
+    entries = read_entries(api, name_prefix)
+    hosts = read_hosts(api) if allow else {}
+
+    desired = {mac.upper(): (mac, up, down) for mac, (up, down) in allow.items()}
+    # Only touch the MACs we were asked about; other users' entries stay as they are
+    scoped = {key: rows for key, rows in entries.items() if key in desired or key in {m.upper() for m in revoke}}
+    plan = plan_tier_changes(desired, scoped, hosts, name_prefix)
+
+    failed = _remove_ids(address_list, plan['remove_entries'])
+    promises = []
+    for mac, list_name, address in plan['add_entries']:
+        if tier_errors.get(list_name):
+            errors[mac] = f"bandwidth tier {list_name} unavailable: {tier_errors[list_name]}"
+            continue
+        promises.append((mac, address_list.call_async('add', {
+            'list': list_name, 'address': address, 'comment': f"{ENTRY_COMMENT_PREFIX}{mac.upper()}"})))
+    for mac, error in _collect(promises).items():
+        errors[mac] = error
+    for mac in plan['no_address']:
+        print(f"[MIKROTIK] MAC {mac} has no IP address yet, it is added to its tier once it appears")
+    if failed:
+        print(f"[MIKROTIK] Failed to remove {len(failed)} address-list entr{'y' if len(failed) == 1 else 'ies'}")
+    return errors
+
+
+def assign_tier(mac_address, upload_speed="1M", download_speed="2M", name_prefix="pisonet"):
+    """PCQ counterpart of mikrotik_add_queue: put one MAC in the tier for its speeds."""
+    api_pool = get_pooled_api()
+    if not api_pool:
+        print(f"[MIKROTIK] Failed to connect - cannot set bandwidth tier for MAC {mac_address}")
+        return False
+    try:
+        error = apply_tiers(api_pool.get_api(), allow={mac_address: (upload_speed, download_speed)},
+                            name_prefix=name_prefix)[mac_address]
+        if error:
+            print(f"[MIKROTIK] Error setting bandwidth tier for MAC {mac_address}: {error}")
+            return False
+        print(f"[MIKROTIK] MAC {mac_address} assigned to tier {tier_name(upload_speed, download_speed, name_prefix)}")
+        _router_changed()
+        return True
+    except Exception as e:
+        print(f"[MIKROTIK] Error setting bandwidth tier for MAC {mac_address}: {str(e)}")
+        return False
+    finally:
+        api_pool.release()
+
+
+def remove_from_tiers(mac_address, name_prefix="pisonet"):
+    """PCQ counterpart of mikrotik_remove_queue."""
+    api_pool = get_pooled_api()
+    if not api_pool:
+        print(f"[MIKROTIK] Failed to connect - cannot remove bandwidth tier for MAC {mac_address}")
+        return False
+    try:
+        apply_tiers(api_pool.get_api(), revoke={mac_address}, name_prefix=name_prefix)
+        _router_changed()
+        return True
+    except Exception as e:
+        print(f"[MIKROTIK] Error removing bandwidth tier for MAC {mac_address}: {str(e)}")
+        return False
+    finally:
+        api_pool.release()
+
+
+# ============ TRAFFIC ============
+
+class _RateMeter:
+    """Bits per second per MAC from successive byte counter readings (hosts have no rate column)."""
+    def __init__(self):
+        self._last = {}  # MAC -> (monotonic time, bytes in, bytes out)
+        self._lock = threading.Lock()
+
+    def rates(self, mac, bytes_in, bytes_out, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            previous = self._last.get(mac)
+            self._last[mac] = (now, bytes_in, bytes_out)
+        if previous is None or now - previous[0] < 0.5:
+            return '0', '0'
+        elapsed = now - previous[0]
+        return (str(max(0, int((bytes_in - previous[1]) * 8 / elapsed))),
+                str(max(0, int((bytes_out - previous[2]) * 8 / elapsed))))
+
+
+_rate_meter = _RateMeter()
+
+
+def user_traffic(api, mac_address=None, name_prefix="pisonet"):
+    """Traffic stats in the mikrotik_get_user_traffic() format, from hotspot hosts and tier entries."""
+    from .utils import _queue_stats
+
+    entries = read_entries(api, name_prefix)
+    hosts = read_hosts(api)
+    stats = []
+    for key, rows in entries.items():
+        if mac_address and key != mac_address.upper():
+            continue
+        host = hosts.get(key)
+        if host is None:
+            continue
+        bytes_in, bytes_out = int(host.get('bytes-in') or 0), int(host.get('bytes-out') or 0)
+        rate_in, rate_out = _rate_meter.rates(key, bytes_in, bytes_out)
+        list_name = rows[0].get('list', '')
+        speeds = list_name[len(f"{name_prefix}-tier-"):].replace('-', '/', 1)
+        mac = host.get('mac-address') or key
+        stats.append(_queue_stats({
+            'bytes': f"{bytes_in}/{bytes_out}",
+            'packets': f"{host.get('packets-in') or 0}/{host.get('packets-out') or 0}",
+            'rate': f"{rate_in}/{rate_out}",
+            'max-limit': speeds,
+        }, mac, None if mac_address else list_name))
+    if mac_address:
+        return stats[0] if stats else {}
+    return stats
+
+
+def sync_tiers(api, desired, hosts, name_prefix="pisonet"):
+    """Periodic tier pass: list users whose IP turned up, move or drop stale entries.
+
+    desired as from reconcile.desired_state(); hosts as from read_hosts(), so
+    the caller can share one host read. Reads the address list once and only
+    writes when something changed. Returns the plan.
+    """
+    plan = plan_tier_changes(desired, read_entries(api, name_prefix), hosts, name_prefix)
+    if not plan['add_entries'] and not plan['remove_entries']:
+        return plan
+
+    tier_errors = tier_builder.ensure(api, {(up, down) for _, up, down in desired.values()})
+    address_list = api.get_resource('/ip/firewall/address-list')
+    failed = len(_remove_ids(address_list, plan['remove_entries']))
+    promises = []
+    for mac, list_name, address in plan['add_entries']:
+        if tier_errors.get(list_name):
+            failed += 1
+            continue
+        promises.append((mac, address_list.call_async('add', {
+            'list': list_name, 'address': address, 'comment': f"{ENTRY_COMMENT_PREFIX}{mac.upper()}"})))
+    failed += sum(1 for error in _collect(promises).values() if error)
+    print(f"[MIKROTIK] Tier pass: +{len(plan['add_entries'])} -{len(plan['remove_entries'])} entries"
+          + (f", {failed} failed" if failed else ""))
+    _router_changed()
+    return plan
+
+
+def counter_rows(api, name_prefix="pisonet", hosts=None):
+    """Per-user byte counters shaped like /queue/simple rows (.id, name, bytes=upload/download).
+
+    Lets the usage meter and traffic history read PCQ users the same way as
+    simple queues. The .id is the host entry's, so a host that left and came
+    back counts as a counter reset. Pass hosts to reuse a read_hosts() result.
+    """
+    hosts = read_hosts(api) if hosts is None else hosts
+    return [{
+        '.id': _row_id(row),
+        'name': _queue_name(row['mac-address'], name_prefix),
+        'bytes': f"{row.get('bytes-in') or 0}/{row.get('bytes-out') or 0}",
+    } for row in hosts.values() if row.get('bypassed') == 'true']
@@ -0,0 +1,137 @@
+# app/cache.py
+"""Keyed TTL caches for router reads.
+
+A TTLCache holds one value per key (e.g. per interface or per MAC) and
+loads each key at most once at a time: threads that miss while a load is
+in flight wait for it instead of all querying the router. An entry older
+than `ttl` but younger than `ttl + stale_ttl` is still returned while one
+background refresh replaces it. The least recently used keys are dropped
+beyond `max_entries`. Hits, misses and loads are counted for stats().
+"""
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# Background refreshes for stale entries (shared by every cache)
+_refresher = ThreadPoolExecutor(max_workers=2, thread_name_prefix='cache-refresh')
+
+_caches = {}
+
+
+class TTLCache:
+    """Thread-safe keyed cache with single-flight loading, stale-while-revalidate and an LRU bound."""
+    def __init__(self, name, ttl, stale_ttl=0, max_entries=128):
+        self.name = name
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # key -> (stored at (monotonic), value)
+        # key -> Future of the load in flight; a load only stores its value while it is still
+        # the one registered here, so invalidating a key (or all keys) discards older loads
+        self._loading = {}
+        self._lock = threading.Lock()
+        self._counts = dict.fromkeys(('hits', 'stale_hits', 'misses', 'waits', 'loads', 'errors', 'evictions'), 0)
+        _caches[name] = self
+
+    def get_or_load(self, key, loader):
+        """Cached value for `key`, calling loader() on a miss.
+
+        loader() may raise (nothing is cached and the error reaches every
+        waiting caller) or return None (passed on but not cached).
+        """
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                age = now - entry[0]
+                if age < self.ttl:
+                    self._counts['hits'] += 1
+                    self._entries.move_to_end(key)
+                    return entry[1]
+                if age < self.ttl + self.stale_ttl:
+                    self._counts['stale_hits'] += 1
+                    self._entries.move_to_end(key)
+                    if key not in self._loading:
+                        future = self._loading[key] = Future()
+                        _refresher.submit(self._refresh, key, loader, future)
+                    return entry[1]
+
+            future = self._loading.get(key)
+            owner = future is None
+            if owner:
+                self._counts['misses'] += 1
+                future = self._loading[key] = Future()
+            else:
+                self._counts['waits'] += 1
+        if not owner:
+            return future.result()
+        return self._load(key, loader, future)
+
+    def _load(self, key, loader, future):
+        try:
+            value = loader()
+        except BaseException as e:
+            with self._lock:
+                self._counts['errors'] += 1
+                if self._loading.get(key) is future:
+                    self._loading.pop(key)
+            future.set_exception(e)
+            raise
+        with self._lock:
+            self._counts['loads'] += 1
+            if self._loading.get(key) is future:
+                self._loading.pop(key)
+                if value is not None:
+                    self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _refresh(self, key, loader, future):
+        try:
+            self._load(key, loader, future)
+        except Exception as e:
+            print(f"[CACHE] Refreshing {self.name}[{key}] failed, keeping the old value: {str(e)}")
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counts['evictions'] += 1
+
+    def get(self, key):
+        """Fresh cached value for `key`, or None (never loads)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] < self.ttl:
+                self._counts['hits'] += 1
+                self._entries.move_to_end(key)
+                return entry[1]
+            self._counts['misses'] += 1
+            return None
+
+    def set(self, key, value):
+        with self._lock:
+            self._store(key, value)
+
+    def invalidate(self, key=None):
+        """Drop one key, or every key when called without one (e.g. after the router was changed)."""
+        with self._lock:
+            # Loads already in flight may carry old data: let them finish, but start fresh next time.
+            # Only the invalidated key's load is affected; other keys keep their single flight
+            if key is None:
+                self._loading.clear()
+                self._entries.clear()
+            else:
+                self._loading.pop(key, None)
+                self._entries.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return dict(self._counts, size=len(self._entries), ttl=self.ttl, stale_ttl=self.stale_ttl)
+
+
+def cache_stats():
+    """{cache name: counters} for every cache created in this process."""
+    return {name: cache.stats() for name, cache in _caches.items()}
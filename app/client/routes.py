@@ -1,35 +1,20 @@
-from flask import render_template, request, jsonify, redirect, url_for, flash, session, current_app
+from flask import render_template, request, jsonify, redirect, url_for, flash, session, current_app, Response
 from . import client_bp
 from .. import db
+from ..events import status_events, stream_events
 from ..models import Voucher
+from ..sessions import status_payload, status_versions, status_updates, publish_status
 from ..utils import (
     get_mikrotik_active_hotspot_users,
     mikrotik_allow_mac,
-    get_mac_from_active_session,
-    get_mac_from_arp,
     mikrotik_add_queue
 )
+from ..jobs import activation_queue
+from ..mirror import lookup_mac, remember_mac
 from datetime import datetime, timezone
 import socket
-import threading
 from flask import make_response
 
-def authorize_mikrotik_background(app, code, mac_address, duration, rate_up='1M', rate_down='2M'):
-    """Background thread to authorize MAC with MikroTik and apply bandwidth limits using its own app context"""
-    with app.app_context():
-        try:
-            app.logger.info("[BG] Starting MikroTik authorization for %s (MAC: %s)", code, mac_address)
-            mikrotik_allow_mac(mac_address, duration)
-            app.logger.info("[BG] MikroTik authorization succeeded for %s", code)
-            
-            # Apply bandwidth limit
-            app.logger.info("[BG] Applying bandwidth limit for %s: %s/%s", mac_address, rate_up, rate_down)
-            mikrotik_add_queue(mac_address, rate_up, rate_down)
-            app.logger.info("[BG] Bandwidth limit applied for %s", code)
-        except Exception as e:
-            app.logger.exception("[BG] MikroTik authorization/bandwidth failed for %s: %s", code, str(e))
-
-
 @client_bp.route('/ping')
 def ping():
     """Fast, no-cache ping to detect connectivity after bypass."""
@@ -51,6 +36,9 @@ def index():
         session['hotspot_mac'] = mac_address
         session['hotspot_ip'] = ip_address
         session['hotspot_link_orig'] = link_orig
+        # The hotspot login redirect says which MAC this device is; later visits without params use it.
+        # Keyed on the connection's address only: the ip parameter is whatever the client sent
+        remember_mac(client_ip, mac_address)
     
     # Check if user has an active session in cookies
     if 'active_code' in session:
@@ -65,15 +53,11 @@ def index():
             session.pop('active_code', None)
             session.modified = True  # Ensure session changes are saved
     
-    # If no MAC from hotspot params, try to get from MikroTik
+    # If no MAC from hotspot params, look it up in the router mirror
+    # (active sessions first, then ARP and DHCP leases for unauthenticated devices)
     if not mac_address:
-        # First try active sessions (already authenticated users)
-        mac_address = get_mac_from_active_session(client_ip)
-        
-        # If not found, try ARP table (includes unauthenticated devices)
-        if not mac_address:
-            mac_address = get_mac_from_arp(client_ip)
-            current_app.logger.info("Index: Got MAC from ARP for IP %s: %s", client_ip, mac_address)
+        mac_address = lookup_mac(client_ip)
+        current_app.logger.info("Index: Resolved MAC for IP %s: %s", client_ip, mac_address)
     
     # Check if MAC address has an active voucher
     detected_code = None
@@ -120,9 +104,11 @@ def design_view():
 
 @client_bp.route('/api/activate-quick', methods=['POST'])
 def activate_quick():
-    """Fast activation endpoint - validates and queues MikroTik authorization in background"""
+    """Fast activation endpoint - validates and queues MikroTik authorization as a durable job"""
     code = request.form.get('voucher_code', '').strip().upper()
-    mac_address = session.get('hotspot_mac') or request.form.get('mac_address') or '00:00:00:00:00:00'
+    # Last resort before the placeholder: ask the router (the only page allowed to wait on it for this)
+    mac_address = (session.get('hotspot_mac') or request.form.get('mac_address')
+                   or lookup_mac(request.remote_addr, live=True) or '00:00:00:00:00:00')
     
     current_app.logger.info("[QUICK] Activate attempt: code=%s, mac=%s", code, mac_address)
     
@@ -143,20 +129,14 @@ def activate_quick():
         # Quick database activation (no MikroTik yet)
         current_app.logger.info("[QUICK] Quick-activating voucher %s for MAC %s", code, mac_address)
         voucher.activate(mac_address)
-        db.session.commit()
-        
-        # Get bandwidth limits from voucher
-        rate_up = voucher.rate_limit_up or '1M'
-        rate_down = voucher.rate_limit_down or '2M'
         
-        # Start MikroTik authorization in background thread with app context
-        flask_app = current_app._get_current_object()
-        thread = threading.Thread(
-            target=authorize_mikrotik_background,
-            args=(flask_app, code, mac_address, voucher.duration, rate_up, rate_down),
-            daemon=True
-        )
-        thread.start()
+        # Router authorization + bandwidth limit is committed with the activation
+        # and retried by the activation workers until it succeeds
+        activation_queue.enqueue(voucher, mac_address)
+        updates = status_updates([voucher])
+        db.session.commit()
+        activation_queue.wake()
+        publish_status(updates, 'activated')
         
         session['active_code'] = code
         return jsonify({'success': True, 'message': 'Activation in progress'}), 200
@@ -175,7 +155,8 @@ def activate():
     current_app.logger.info("Activate attempt: code=%s, form_keys=%s, session_has_hotspot=%s", code, list(request.form.keys()), 'hotspot_mac' in session)
 
     # Get MAC address from session (passed by MikroTik hotspot), form, or use default
-    mac_address = session.get('hotspot_mac') or request.form.get('mac_address')
+    mac_address = (session.get('hotspot_mac') or request.form.get('mac_address')
+                   or lookup_mac(request.remote_addr, live=True))
     
     # Ensure MAC is persisted in session so we stay in "hotspot mode" on redirect
     if mac_address:
@@ -235,8 +216,10 @@ def activate():
         # Only activate in database after MikroTik authorization succeeds
         current_app.logger.info("Activating voucher %s for MAC %s", code, mac_address)
         voucher.activate(mac_address)
+        updates = status_updates([voucher])
         db.session.commit()
         db.session.refresh(voucher)  # Refresh to ensure object is synced with database
+        publish_status(updates, 'activated')
         current_app.logger.info("Activated voucher %s (developer=%s): activated_at=%s expires_at=%s remaining=%s", voucher.code, voucher.is_developer, voucher.activated_at, voucher.expires_at, voucher.remaining_seconds)
         
         session['active_code'] = code # Set cookie
@@ -281,9 +264,9 @@ def status_page():
         # Try to get MAC from session or MikroTik
         mac_address = session.get('hotspot_mac') or request.args.get('mac')
         if not mac_address:
-            # Try to get from MikroTik active sessions by IP
+            # Try to resolve from the router mirror by IP
             client_ip = request.remote_addr
-            mac_address = get_mac_from_active_session(client_ip)
+            mac_address = lookup_mac(client_ip)
         
         if mac_address:
             # Find active voucher for this MAC
@@ -301,10 +284,8 @@ def status_page():
         flash("No active session found. Please enter your voucher code.", "error")
         return redirect(url_for('client.index'))
     
-    # Disable query caching to ensure fresh data from database
+    # Each request has its own session, so this is always read fresh from the database
     voucher = Voucher.query.filter_by(code=code).first_or_404()
-    db.session.expunge(voucher)  # Remove from session cache
-    voucher = Voucher.query.filter_by(code=code).first_or_404()  # Re-query fresh
     return render_template('status.html', voucher=voucher, is_developer=voucher.is_developer)
 
 
@@ -312,6 +293,7 @@ def status_page():
 def end_session():
     """End the current session and clear the active code"""
     from ..utils import mikrotik_revoke_mac, mikrotik_remove_queue
+    from ..sessions import expiry_scheduler
     
     code = request.form.get('code')
     voucher = Voucher.query.filter_by(code=code).first()
@@ -337,7 +319,10 @@ def end_session():
             voucher.activated_at = None
             voucher.expires_at = None
             voucher.user_mac_address = None
+            updates = status_updates([voucher], reason='ended')
             db.session.commit()
+            expiry_scheduler.cancel(voucher.id)
+            publish_status(updates, 'ended')
             current_app.logger.info("Developer session ended: code=%s", code)
         else:
             current_app.logger.warning("Attempted to end non-developer voucher: code=%s", code)
@@ -351,9 +336,28 @@ def end_session():
     return redirect(url_for('client.index'))
 
 
+def _status_response(payload):
+    """JSON with a weak ETag: bodies with the same version differ only in remaining_seconds."""
+    response = jsonify(payload)
+    response.set_etag(payload['version'], weak=True)
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
+
+
 @client_bp.route('/api/status/<code_or_mac>')
 def api_status(code_or_mac):
-    """API Generic Endpoint for status check via Ajax"""
+    """API Generic Endpoint for status check via Ajax.
+
+    Clients count down from expiry_time and revalidate with If-None-Match;
+    an unchanged voucher looked up by code is answered 304 without a query.
+    """
+    version = status_versions.get(code_or_mac)
+    if version and request.if_none_match.contains_weak(version):
+        response = Response(status=304)
+        response.set_etag(version, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+
     # Try finding by code first
     voucher = Voucher.query.filter_by(code=code_or_mac).first()
     if not voucher:
@@ -368,13 +372,43 @@ def api_status(code_or_mac):
 
     if not voucher:
         return jsonify({'active': False, 'remaining_seconds': 0})
-        
-    return jsonify({
-        'active': voucher.remaining_seconds > 0,
-        'remaining_seconds': voucher.remaining_seconds,
-        'mac': voucher.user_mac_address,
-        'expiry_time': voucher.expires_at.isoformat() if voucher.expires_at else None
-    })
+
+    payload = status_payload(voucher)
+    if voucher.code == code_or_mac:
+        status_versions.set(voucher.code, payload['version'])
+    return _status_response(payload)
+
+
+@client_bp.route('/api/status/<code>/events')
+def api_status_events(code):
+    """Server-Sent Events for the status page: the current state once, then each change.
+
+    Answers 204 when all stream slots are taken, which tells EventSource to
+    stop; status.js then polls /api/status slowly instead.
+    """
+    subscription = status_events.subscribe(code)
+    if subscription is None:
+        return Response(status=204)
+    # Subscribed before reading, so a change committed in between is not missed
+    voucher = Voucher.query.filter_by(code=code).first()
+    if not voucher:
+        subscription.close()
+        return jsonify({'error': 'Unknown voucher'}), 404
+    first = ('status', status_payload(voucher))
+    response = Response(stream_events(subscription, first), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+    # Frees the slot even if the client left before the stream started
+    response.call_on_close(subscription.close)
+    return response
+
+
+@client_bp.route('/api/activation/<code>')
+def api_activation_status(code):
+    """Progress of the router authorization queued by /api/activate-quick"""
+    job = activation_queue.status(code.strip().upper())
+    if not job:
+        return jsonify({'status': 'none'})
+    return jsonify(job)
 
 
 @client_bp.route('/test', methods=['GET', 'POST'])
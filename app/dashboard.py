@@ -0,0 +1,115 @@
+# app/dashboard.py
+"""Admin dashboard data, gathered from every source at once."""
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from .routeros_async import router_service
+from .utils import (
+    get_server_stats, _system_stats_from_rows, _health_from_rows, _traffic_from_rows, _active_user_row,
+    ACTIVE_USER_PROPS,
+)
+
+SOURCE_TIMEOUT = float(os.environ.get('DASHBOARD_SOURCE_TIMEOUT', 2))
+
+# Shown when a source has never answered
+FALLBACKS = {
+    'system_stats': {
+        "cpu_load": 0, "free_memory": 0, "total_memory": 0,
+        "uptime": "Offline (Mock)", "board_name": "Unknown", "version": "Unknown",
+    },
+    'health': {"temperature": None, "voltage": None},
+    'traffic': {"rx_bps": 0, "tx_bps": 0},
+    'active_users': [],
+    'server_stats': {},
+}
+
+_last_good = {}
+_last_good_lock = threading.Lock()
+
+
+async def _router_sources(client, interface_name, timeout):
+    """All router reads for the dashboard, pipelined on one connection, each with its own deadline."""
+    async def guarded(coro):
+        try:
+            return await asyncio.wait_for(coro, timeout)
+        except Exception as e:
+            return e
+
+    resource, routerboard, health, active, traffic = await asyncio.gather(
+        guarded(client.call('/system/resource/print')),
+        guarded(client.call('/system/routerboard/print')),
+        guarded(client.call('/system/health/print')),
+        guarded(client.call('/ip/hotspot/active/print',
+                            proplist=ACTIVE_USER_PROPS)),
+        guarded(client.call('/interface/monitor-traffic', {'interface': interface_name, 'once': ''})),
+    )
+    # routerboard is optional (CHR/x86 has none); only resource decides success
+    if isinstance(routerboard, Exception):
+        routerboard = []
+    return {
+        'system_stats': resource if isinstance(resource, Exception) else _system_stats_from_rows(resource, routerboard),
+        'health': health if isinstance(health, Exception) else _health_from_rows(health),
+        'active_users': active if isinstance(active, Exception) else [_active_user_row(s) for s in active],
+        'traffic': traffic if isinstance(traffic, Exception) else _traffic_from_rows(traffic),
+    }
+
+
+def _remember(name, value, now):
+    with _last_good_lock:
+        _last_good[name] = (value, now)
+
+
+def _fallback(name, error, now):
+    """Last good value for a failed source, marked with how old it is."""
+    with _last_good_lock:
+        cached = _last_good.get(name)
+    if cached is not None:
+        value, fetched_at = cached
+        return value, {'ok': False, 'stale': True, 'age': int(now - fetched_at), 'error': error}
+    return FALLBACKS[name], {'ok': False, 'stale': True, 'age': None, 'error': error}
+
+
+def gather_dashboard(interface_name=None, timeout=None):
+    """Fetch every dashboard source concurrently.
+
+    Router reads go out together on the async client; server stats come from
+    the background sampler's buffer. Each source has its own deadline, and one
+    that misses it is served from its last good value (or a placeholder).
+    The call takes about as long as the slowest source, capped at the deadline.
+
+    Returns (data, sources): data maps source name to its value; sources maps
+    source name to {'ok', 'stale', 'age', 'error'}.
+    """
+    timeout = timeout or SOURCE_TIMEOUT
+    interface_name = interface_name or os.getenv('MIKROTIK_WAN_INTERFACE', 'ether1')
+
+    router_future = router_service.submit(lambda client: _router_sources(client, interface_name, timeout))
+
+    results = {}
+    try:
+        results.update(router_future.result(timeout))
+    except FutureTimeout:
+        router_future.cancel()
+        for name in ('system_stats', 'health', 'active_users', 'traffic'):
+            results[name] = TimeoutError("router did not answer in time")
+    except Exception as e:
+        for name in ('system_stats', 'health', 'active_users', 'traffic'):
+            results[name] = e
+    try:
+        results['server_stats'] = get_server_stats()
+    except Exception as e:
+        results['server_stats'] = e
+
+    now = time.monotonic()
+    data, sources = {}, {}
+    for name, value in results.items():
+        if isinstance(value, Exception) or value is None:
+            error = str(value) if value is not None else "no data"
+            data[name], sources[name] = _fallback(name, error or type(value).__name__, now)
+        else:
+            _remember(name, value, now)
+            data[name], sources[name] = value, {'ok': True, 'stale': False, 'age': 0, 'error': None}
+    return data, sources
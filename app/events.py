@@ -0,0 +1,137 @@
+# app/events.py
+"""In-process publish/subscribe for pushing changes to browsers (Server-Sent Events).
+
+Publishers (expiry sweep, revokes, admin actions) call publish() after their
+commit; each open stream holds a Subscription and writes what it receives.
+Every stream keeps a waitress worker thread busy, so a hub admits at most
+`limit` subscribers and subscribe() returns None beyond that; the page then
+falls back to slow polling.
+"""
+import json
+import os
+import queue
+import threading
+import time
+
+# Comment line sent when nothing happened, so dead connections are noticed and closed
+HEARTBEAT_SECONDS = 15
+# Streams are closed after this long; the browser reconnects and gets a fresh snapshot
+STREAM_MAX_AGE = 120
+# Reconnect delay the browser is told to use (ms)
+RETRY_MS = 5000
+
+
+class Subscription:
+    """One stream's inbox. Messages beyond `maxsize` are dropped (the stream is far behind)."""
+    def __init__(self, hub, topic, maxsize=100):
+        self.hub = hub
+        self.topic = topic
+        self._queue = queue.Queue(maxsize=maxsize)
+        self.closed = False
+
+    def put(self, message):
+        try:
+            self._queue.put_nowait(message)
+        except queue.Full:
+            pass
+
+    def get(self, timeout):
+        """Next (event, data) or None after `timeout` seconds of quiet."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.hub._unsubscribe(self)
+
+
+class EventHub:
+    """Topic -> subscribers, with a cap on concurrent subscribers."""
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self._topics = {}
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic):
+        """A new Subscription, or None if `limit` streams are already open."""
+        with self._lock:
+            if self._count >= self.limit:
+                return None
+            subscription = Subscription(self, topic)
+            self._topics.setdefault(topic, set()).add(subscription)
+            self._count += 1
+        return subscription
+
+    def _unsubscribe(self, subscription):
+        with self._lock:
+            subscribers = self._topics.get(subscription.topic)
+            if subscribers and subscription in subscribers:
+                subscribers.discard(subscription)
+                self._count -= 1
+                if not subscribers:
+                    del self._topics[subscription.topic]
+
+    def has_subscribers(self, topic):
+        with self._lock:
+            return topic in self._topics
+
+    def topics(self):
+        with self._lock:
+            return list(self._topics)
+
+    def publish(self, topic, event, data):
+        """Send (event, data) to every subscriber of `topic`. Returns how many got it."""
+        with self._lock:
+            subscribers = list(self._topics.get(topic, ()))
+        for subscription in subscribers:
+            subscription.put((event, data))
+        return len(subscribers)
+
+    def stats(self):
+        with self._lock:
+            return {'streams': self._count, 'topics': len(self._topics), 'limit': self.limit}
+
+
+def sse_message(event, data):
+    """One Server-Sent Events frame with a JSON payload."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def stream_events(subscription, first=None, max_age=STREAM_MAX_AGE):
+    """SSE text for a subscription: `first` (event, data) right away, then whatever is published.
+
+    Unsubscribes when the client goes away (the next write fails and the
+    server closes the generator) or after max_age seconds.
+    """
+    try:
+        yield f"retry: {RETRY_MS}\n\n"
+        if first is not None:
+            yield sse_message(*first)
+        deadline = time.monotonic() + max_age
+        while time.monotonic() < deadline:
+            message = subscription.get(timeout=min(HEARTBEAT_SECONDS, max(0.1, deadline - time.monotonic())))
+            if message is None:
+                yield ": keep-alive\n\n"
+            else:
+                yield sse_message(*message)
+    finally:
+        subscription.close()
+
+
+# Every open stream holds a waitress thread. Both hubs share half the threads
+# (STREAM_BUDGET), so streams can never starve ordinary requests: the admin
+# traffic table gets a quarter of the budget and customer status pages the
+# rest. With the default 8 threads that is 1 admin tab and 3 status pages;
+# further pages fall back to polling (STATUS_POLL_MS in status.js, 30s).
+STREAM_BUDGET = max(2, int(os.environ.get('WAITRESS_THREADS', 8)) // 2)
+TRAFFIC_STREAM_LIMIT = int(os.environ.get('TRAFFIC_STREAM_LIMIT', max(1, STREAM_BUDGET // 4)))
+STATUS_STREAM_LIMIT = int(os.environ.get('STATUS_STREAM_LIMIT', max(1, STREAM_BUDGET - TRAFFIC_STREAM_LIMIT)))
+
+status_events = EventHub('status', limit=STATUS_STREAM_LIMIT)
+# Admin bandwidth page streams (app/traffic_feed.py)
+traffic_events = EventHub('traffic', limit=TRAFFIC_STREAM_LIMIT)
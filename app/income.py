@@ -0,0 +1,116 @@
+# app/income.py
+"""Income analytics from voucher sales, kept in per-day and per-month rollups.
+
+A sale is counted when a voucher is activated, at the price copied onto the
+voucher when it was generated. Days and months are local time (the shop's
+business day), not UTC.
+"""
+from datetime import date, datetime, timedelta, timezone
+
+from sqlalchemy import text
+
+from . import db
+from .models import IncomeRollup
+
+_ADD_SALE = text(
+    "INSERT INTO income_rollups (period, bucket, amount, vouchers) VALUES (:period, :bucket, :amount, 1) "
+    "ON CONFLICT (period, bucket) DO UPDATE SET "
+    "amount = amount + excluded.amount, vouchers = vouchers + 1"
+)
+
+# SQLite reads the stored (naive UTC) activation time and converts it to local time
+REBUILD_STATEMENTS = [
+    text("DELETE FROM income_rollups"),
+    text("INSERT INTO income_rollups (period, bucket, amount, vouchers) "
+         "SELECT 'day', date(activated_at, 'localtime'), SUM(price), COUNT(*) FROM vouchers "
+         "WHERE activated_at IS NOT NULL AND price IS NOT NULL AND is_developer = 0 "
+         "GROUP BY date(activated_at, 'localtime')"),
+    text("INSERT INTO income_rollups (period, bucket, amount, vouchers) "
+         "SELECT 'month', strftime('%Y-%m', activated_at, 'localtime'), SUM(price), COUNT(*) FROM vouchers "
+         "WHERE activated_at IS NOT NULL AND price IS NOT NULL AND is_developer = 0 "
+         "GROUP BY strftime('%Y-%m', activated_at, 'localtime')"),
+]
+
+
+def _local(value):
+    # SQLite hands datetimes back naive; they are stored in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone()
+
+
+def record_sale(voucher):
+    """Add an activated voucher's price to its day and month.
+
+    Runs in the caller's transaction, so the rollup is committed (or rolled
+    back) together with the activation.
+    """
+    if voucher.price is None or voucher.activated_at is None:
+        return
+    sold_at = _local(voucher.activated_at)
+    for period, bucket in (('day', sold_at.strftime('%Y-%m-%d')), ('month', sold_at.strftime('%Y-%m'))):
+        db.session.execute(_ADD_SALE, {'period': period, 'bucket': bucket, 'amount': voucher.price})
+
+
+def rebuild_rollups():
+    """Recompute every rollup from the vouchers table (backfill or repair). Returns rows written."""
+    for statement in REBUILD_STATEMENTS:
+        db.session.execute(statement)
+    db.session.commit()
+    return IncomeRollup.query.count()
+
+
+def _money(amount):
+    # Prices are whole pesos almost always; don't show "900.0" on the dashboard
+    amount = round(amount or 0, 2)
+    return int(amount) if amount == int(amount) else amount
+
+
+def _months_back(today, count):
+    """The `count` months up to and including today's, oldest first, as (year, month)."""
+    months = []
+    year, month = today.year, today.month
+    for _ in range(count):
+        months.append((year, month))
+        year, month = (year, month - 1) if month > 1 else (year - 1, 12)
+    return months[::-1]
+
+
+def get_income_stats(today=None):
+    """Dashboard income figures. Reads at most ~30 day rows and 12 month rows."""
+    today = today or datetime.now().astimezone().date()
+    first_day = today - timedelta(days=29)
+
+    days = {row.bucket: row for row in IncomeRollup.query.filter(
+        IncomeRollup.period == 'day',
+        IncomeRollup.bucket >= first_day.isoformat(),
+        IncomeRollup.bucket <= today.isoformat()
+    )}
+    months = {row.bucket: row for row in IncomeRollup.query.filter(
+        IncomeRollup.period == 'month',
+        IncomeRollup.bucket >= f"{today.year - 1}-{today.month:02d}",
+        IncomeRollup.bucket <= f"{today.year}-{today.month:02d}"
+    )}
+
+    def day_amount(d):
+        row = days.get(d.isoformat())
+        return _money(row.amount) if row else 0
+
+    last_7 = [today - timedelta(days=n) for n in range(6, -1, -1)]
+    last_5_months = _months_back(today, 5)
+    this_month = f"{today.year}-{today.month:02d}"
+
+    earned_30 = sum(row.amount for row in days.values())
+    return {
+        "earned_today": day_amount(today),
+        "sales_today": days[today.isoformat()].vouchers if today.isoformat() in days else 0,
+        "weekly": _money(sum(day_amount(d) for d in last_7)),
+        "earned_month": _money(months[this_month].amount) if this_month in months else 0,
+        "earned_year": _money(sum(row.amount for bucket, row in months.items() if bucket.startswith(f"{today.year}-"))),
+        "average_daily": round(earned_30 / 30),
+        "daily": [day_amount(d) for d in last_7],
+        "monthly": [_money(months[f"{y}-{m:02d}"].amount) if f"{y}-{m:02d}" in months else 0
+                    for y, m in last_5_months],
+        "labels_daily": [d.strftime('%a') for d in last_7],
+        "labels_monthly": [date(y, m, 1).strftime('%b') for y, m in last_5_months],
+    }
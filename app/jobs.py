@@ -0,0 +1,195 @@
+# app/jobs.py
+"""Durable activation queue: router authorization retried by a small worker pool."""
+import os
+import threading
+from datetime import datetime, timedelta, timezone
+
+from . import db
+from .models import ActivationJob, Voucher
+from .utils import mikrotik_allow_mac, mikrotik_add_queue
+
+
+class ActivationQueue:
+    """Bounded worker pool fed by the activation_jobs table.
+
+    Jobs are written in the same transaction that activates the voucher, so a
+    crash or router outage never loses one. Workers retry with exponential
+    backoff until max_attempts, and at most `workers` router authorizations
+    run at the same time. With workers=0 nothing is started and jobs stay
+    pending (for tests and scripts that only need the database).
+    """
+    def __init__(self, workers=2, max_attempts=6, base_delay=2, max_delay=60):
+        self.workers = max(0, int(workers))
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._app = None
+        self._threads = []
+        self._claim_lock = threading.Lock()
+        self._wakeup = threading.Condition()
+        self._generation = 0  # bumped by wake() so a worker never sleeps through a new job
+        self._stopped = False
+
+    @property
+    def enabled(self):
+        return self.workers > 0
+
+    def start(self, app):
+        """Requeue jobs interrupted by a previous shutdown and start the workers."""
+        if not self.enabled or self._threads:
+            return
+        self._app = app
+        with app.app_context():
+            interrupted = ActivationJob.query.filter_by(status='running').update(
+                {'status': 'pending'}, synchronize_session=False)
+            db.session.commit()
+            if interrupted:
+                print(f"[JOBS] Requeued {interrupted} interrupted activation job(s)")
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'activation-worker-{n}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.wake()
+
+    def stop(self):
+        with self._wakeup:
+            self._stopped = True
+            self._wakeup.notify_all()
+
+    def wake(self):
+        """Tell idle workers there may be new work (call after committing a job)."""
+        with self._wakeup:
+            self._generation += 1
+            self._wakeup.notify_all()
+
+    def enqueue(self, voucher, mac_address):
+        """Add an authorization job for a voucher to the current DB session.
+
+        Does not commit: the caller commits it together with the voucher
+        activation and then calls wake(). A job still waiting for the same
+        voucher is updated in place; one waiting for the same MAC under
+        another voucher is marked 'superseded', so status() still reports
+        something for the older code.
+        """
+        job = None
+        waiting = ActivationJob.query.filter(
+            ActivationJob.mac_address == mac_address,
+            ActivationJob.status == 'pending'
+        ).all()
+        for other in waiting:
+            if other.voucher_code == voucher.code:
+                job = other
+            else:
+                other.status = 'superseded'
+                other.last_error = f"Superseded by {voucher.code}"
+        if job is None:
+            job = ActivationJob(voucher_code=voucher.code, mac_address=mac_address, status='pending', attempts=0)
+            db.session.add(job)
+        job.duration = voucher.duration
+        job.rate_limit_up = voucher.rate_limit_up or '1M'
+        job.rate_limit_down = voucher.rate_limit_down or '2M'
+        job.next_attempt_at = datetime.now(timezone.utc)
+        job.last_error = None
+        return job
+
+    def status(self, voucher_code):
+        """Latest job for a voucher as a dict, or None if it never had one."""
+        job = ActivationJob.query.filter_by(voucher_code=voucher_code).order_by(ActivationJob.id.desc()).first()
+        return job.to_dict() if job else None
+
+    def _work(self):
+        while not self._stopped:
+            with self._wakeup:
+                generation = self._generation
+            with self._app.app_context():
+                job_id = None
+                try:
+                    job_id, wait = self._claim()
+                    if job_id is not None:
+                        self._run(job_id)
+                        continue
+                except Exception as e:
+                    # e.g. "database is locked": keep the worker alive and the job retryable
+                    db.session.rollback()
+                    print(f"[JOBS] Worker error{f' on job {job_id}' if job_id else ''}: {str(e)}")
+                    if job_id is not None:
+                        self._requeue(job_id, e)
+                    wait = self.base_delay
+                finally:
+                    db.session.remove()
+            with self._wakeup:
+                if not self._stopped and generation == self._generation:
+                    self._wakeup.wait(wait)
+
+    def _claim(self):
+        """Mark the next due job as running. Returns (job_id, None) or (None, seconds to sleep)."""
+        now = datetime.now(timezone.utc)
+        with self._claim_lock:
+            job = ActivationJob.query.filter(
+                ActivationJob.status == 'pending',
+                ActivationJob.next_attempt_at <= now
+            ).order_by(ActivationJob.next_attempt_at).first()
+            if job is None:
+                upcoming = db.session.query(db.func.min(ActivationJob.next_attempt_at)).filter(
+                    ActivationJob.status == 'pending').scalar()
+                db.session.rollback()
+                if upcoming is None:
+                    return None, None
+                if upcoming.tzinfo is None:
+                    upcoming = upcoming.replace(tzinfo=timezone.utc)
+                return None, max(0.1, (upcoming - now).total_seconds())
+            job.status = 'running'
+            job.attempts += 1
+            db.session.commit()
+            return job.id, None
+
+    def _run(self, job_id):
+        job = db.session.get(ActivationJob, job_id)
+
+        # Don't open access for a voucher that expired or moved while we were retrying
+        voucher = Voucher.query.filter_by(code=job.voucher_code).first()
+        if not voucher or voucher.user_mac_address != job.mac_address or voucher.remaining_seconds <= 0:
+            job.status = 'cancelled'
+            db.session.commit()
+            print(f"[JOBS] Cancelled activation for {job.voucher_code}: voucher no longer active on {job.mac_address}")
+            return
+
+        try:
+            mikrotik_allow_mac(job.mac_address, job.duration)
+            if not mikrotik_add_queue(job.mac_address, job.rate_limit_up, job.rate_limit_down):
+                raise Exception("Failed to apply bandwidth limit")
+        except Exception as e:
+            self._retry_later(job, e)
+            db.session.commit()
+            return
+
+        job.status = 'done'
+        job.last_error = None
+        db.session.commit()
+        print(f"[JOBS] Activated {job.voucher_code} on router (MAC: {job.mac_address})")
+
+    def _retry_later(self, job, error):
+        """Back to pending with exponential backoff, or failed after max_attempts (not committed)."""
+        job.last_error = str(error)[:255]
+        if job.attempts >= self.max_attempts:
+            job.status = 'failed'
+            print(f"[JOBS] Activation for {job.voucher_code} failed after {job.attempts} attempt(s): {error}")
+            return
+        delay = min(self.max_delay, self.base_delay * 2 ** (job.attempts - 1))
+        job.status = 'pending'
+        job.next_attempt_at = datetime.now(timezone.utc) + timedelta(seconds=delay)
+        print(f"[JOBS] Activation for {job.voucher_code} failed (attempt {job.attempts}), retrying in {delay}s: {error}")
+
+    def _requeue(self, job_id, error):
+        """Release a claimed job after a worker error so it isn't stuck in 'running'."""
+        try:
+            job = db.session.get(ActivationJob, job_id)
+            if job is not None and job.status == 'running':
+                self._retry_later(job, error)
+                db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[JOBS] Could not requeue job {job_id}, it is requeued on the next start: {str(e)}")
+
+
+activation_queue = ActivationQueue(workers=int(os.environ.get('ACTIVATION_WORKERS', 2)))
@@ -0,0 +1,119 @@
+# app/migrations.py
+"""Schema migrations, tracked with SQLite's PRAGMA user_version.
+
+Tables that don't exist yet are created from the models; MIGRATIONS then
+brings older tables up to date, one numbered step at a time. Every step
+checks before it changes anything, so a fresh database just gets stamped
+with the latest version. Add new steps at the end; never renumber.
+"""
+from sqlalchemy import text
+
+from . import db
+
+
+def _columns(conn, table):
+    return {row[1] for row in conn.exec_driver_sql(f"PRAGMA table_info({table})")}
+
+
+def _add_columns(conn, table, columns):
+    existing = _columns(conn, table)
+    for name, ddl in columns:
+        if name not in existing:
+            conn.exec_driver_sql(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}")
+
+
+def _legacy_voucher_columns(conn):
+    """duration_minutes -> duration, is_developer (was migrate_schema / cleanup_duration_columns)."""
+    columns = _columns(conn, 'vouchers')
+    if 'duration_minutes' in columns:
+        if 'duration' in columns:
+            conn.exec_driver_sql("ALTER TABLE vouchers DROP COLUMN duration_minutes")
+        else:
+            conn.exec_driver_sql("ALTER TABLE vouchers RENAME COLUMN duration_minutes TO duration")
+    _add_columns(conn, 'vouchers', [
+        ('duration', "INTEGER DEFAULT 3600"),
+        ('is_developer', "BOOLEAN DEFAULT 0"),
+    ])
+
+
+def _rate_limit_columns(conn):
+    """Was add_bandwidth_columns."""
+    _add_columns(conn, 'vouchers', [
+        ('rate_limit_up', "VARCHAR(20) DEFAULT '1M'"),
+        ('rate_limit_down', "VARCHAR(20) DEFAULT '2M'"),
+    ])
+
+
+def _usage_columns(conn):
+    _add_columns(conn, 'vouchers', [
+        ('bytes_up', "BIGINT NOT NULL DEFAULT 0"),
+        ('bytes_down', "BIGINT NOT NULL DEFAULT 0"),
+        ('data_limit_bytes', "BIGINT"),
+    ])
+
+
+def _income_columns(conn):
+    """Profile/price on vouchers, backfilled from profiles.json, and rebuilt income rollups."""
+    _add_columns(conn, 'vouchers', [
+        ('profile', "VARCHAR(64)"),
+        ('price', "FLOAT"),
+    ])
+
+    from .profiles import profile_registry
+
+    # Older vouchers don't know their profile; match on duration + speed first, then duration alone
+    for match_speed in (True, False):
+        for profile in profile_registry.all():
+            params = {'profile': profile.name, 'price': profile.price, 'duration': profile.duration,
+                      'up': profile.rate_up, 'down': profile.rate_down}
+            conn.execute(text(
+                "UPDATE vouchers SET profile = :profile, price = :price "
+                "WHERE price IS NULL AND is_developer = 0 AND duration = :duration"
+                + (" AND rate_limit_up = :up AND rate_limit_down = :down" if match_speed else "")
+            ), params)
+
+    from .income import REBUILD_STATEMENTS
+    for statement in REBUILD_STATEMENTS:
+        conn.execute(statement)
+
+
+def _voucher_indexes(conn):
+    """Indexes declared on the Voucher model (expiry, MAC + expiry, partial sweep/developer indexes)."""
+    from .models import Voucher
+    for index in Voucher.__table__.indexes:
+        index.create(conn, checkfirst=True)
+
+
+# (version, description, step) -- applied in order to databases below that version
+MIGRATIONS = [
+    (1, "legacy duration and is_developer columns", _legacy_voucher_columns),
+    (2, "bandwidth rate limit columns", _rate_limit_columns),
+    (3, "data usage columns", _usage_columns),
+    (4, "voucher profile/price and income rollups", _income_columns),
+    (5, "voucher lookup and expiry indexes", _voucher_indexes),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+
+def schema_version(engine):
+    with engine.connect() as conn:
+        return conn.exec_driver_sql("PRAGMA user_version").scalar()
+
+
+def migrate(engine):
+    """Create missing tables and apply pending migrations. Returns the list of versions applied."""
+    from . import models  # noqa: F401 -- register every model on db.metadata
+
+    db.metadata.create_all(engine)
+    applied = []
+    current = schema_version(engine)
+    for version, description, step in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            step(conn)
+            conn.exec_driver_sql(f"PRAGMA user_version = {version}")
+        applied.append(version)
+        print(f"[DB] Applied migration {version}: {description}")
+    return applied
@@ -0,0 +1,239 @@
+# app/mirror.py
+"""In-memory mirror of the router tables that request handlers read on every page load."""
+import os
+import threading
+import time
+
+from .cache import TTLCache
+from .utils import get_pooled_api, _row_id, _query, _router_read
+
+# Only the columns the app reads are requested from the router
+ACTIVE_PROPS = '.id,user,address,mac-address,uptime,bytes-in,bytes-out,session-time-left'
+BINDING_PROPS = '.id,mac-address,address,type,server,comment'
+QUEUE_PROPS = '.id,name,target,max-limit,comment,bytes,packets,rate'
+ARP_PROPS = 'address,mac-address'
+LEASE_PROPS = 'address,mac-address'
+
+
+class RouterSnapshot:
+    """One consistent read of hotspot/active, ip-binding, queue/simple, ARP and DHCP leases.
+
+    Rows are indexed once when the snapshot is built; snapshots are never
+    modified afterwards, so readers need no lock.
+    """
+    def __init__(self, active=(), bindings=(), queues=(), arp=(), leases=(), taken_at=None):
+        self.taken_at = taken_at if taken_at is not None else time.monotonic()
+        self.active = list(active)
+        self.bindings = list(bindings)
+        self.queues = list(queues)
+
+        self.active_by_ip = {}
+        self.active_by_mac = {}
+        for row in self.active:
+            if row.get('address'):
+                self.active_by_ip[row['address']] = row
+            if row.get('mac-address'):
+                self.active_by_mac[row['mac-address'].upper()] = row
+
+        self.binding_by_mac = {}
+        for row in self.bindings:
+            if row.get('mac-address'):
+                self.binding_by_mac[row['mac-address'].upper()] = row
+
+        self.queue_by_name = {row['name']: row for row in self.queues if row.get('name')}
+
+        self.arp_by_ip = {row['address']: row['mac-address'] for row in arp
+                          if row.get('address') and row.get('mac-address')}
+        self.lease_by_ip = {row['address']: row['mac-address'] for row in leases
+                            if row.get('address') and row.get('mac-address')}
+
+    @property
+    def age(self):
+        return time.monotonic() - self.taken_at
+
+    def mac_for_ip(self, ip_address):
+        """Active hotspot session first, then ARP and DHCP leases (devices not logged in yet)."""
+        session = self.active_by_ip.get(ip_address)
+        if session and session.get('mac-address'):
+            return session['mac-address']
+        # A phone that just joined has a lease before it shows up in ARP
+        return self.arp_by_ip.get(ip_address) or self.lease_by_ip.get(ip_address)
+
+    def binding(self, mac_address):
+        return self.binding_by_mac.get((mac_address or '').upper())
+
+    def queue(self, queue_name):
+        return self.queue_by_name.get(queue_name)
+
+
+class RouterMirror:
+    """Background refresher that keeps a RouterSnapshot current.
+
+    Every `interval` seconds the five tables are read over one pooled session
+    and swapped in as a new snapshot. Code that changes the router calls
+    mark_dirty() so the next refresh happens right away instead of waiting out
+    the interval. If the router is unreachable the last good snapshot is kept
+    and served until it is older than `stale_after`.
+    """
+    debounce = 0.5  # seconds to wait after mark_dirty() before re-reading
+
+    def __init__(self, interval=5, stale_after=60):
+        self.interval = interval
+        self.stale_after = stale_after
+        self._snapshot = None
+        self._dirty = threading.Event()
+        self._thread = None
+        self._stopped = False
+        self._failing = False
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self):
+        if not self.enabled or self._thread is not None:
+            return
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name='router-mirror', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._dirty.set()
+
+    def mark_dirty(self):
+        """Ask for a refresh as soon as possible (after the router was changed)."""
+        self._dirty.set()
+
+    def snapshot(self, max_age=None):
+        """Current snapshot, or None if there is none or it is older than max_age (default stale_after)."""
+        snap = self._snapshot
+        if snap is None:
+            return None
+        if snap.age > (self.stale_after if max_age is None else max_age):
+            return None
+        return snap
+
+    def fresh_snapshot(self):
+        """Snapshot no older than a couple of refresh intervals, for views that show live counters."""
+        return self.snapshot(max_age=self.interval * 2 + 1) if self.enabled else None
+
+    def refresh(self):
+        """Read all mirrored tables now. Returns True if a new snapshot was stored."""
+        api_pool = get_pooled_api()
+        if not api_pool:
+            self._note_failure("router unreachable")
+            return False
+        try:
+            api = api_pool.get_api()
+            active = api.get_resource('/ip/hotspot/active').call('print', {'.proplist': ACTIVE_PROPS})
+            bindings = api.get_resource('/ip/hotspot/ip-binding').call('print', {'.proplist': BINDING_PROPS})
+            queues = api.get_resource('/queue/simple').call('print', {'.proplist': QUEUE_PROPS})
+            arp = api.get_resource('/ip/arp').call('print', {'.proplist': ARP_PROPS})
+            leases = api.get_resource('/ip/dhcp-server/lease').call('print', {'.proplist': LEASE_PROPS})
+        except Exception as e:
+            self._note_failure(str(e))
+            return False
+        finally:
+            api_pool.release()
+
+        for row in bindings:
+            row.setdefault('.id', _row_id(row))
+        for row in queues:
+            row.setdefault('.id', _row_id(row))
+        self._snapshot = RouterSnapshot(active, bindings, queues, arp, leases)
+        if self._failing:
+            print("[MIRROR] Router reachable again, mirror refreshed")
+            self._failing = False
+        return True
+
+    def _note_failure(self, reason):
+        # Log once per outage, not on every refresh
+        if not self._failing:
+            print(f"[MIRROR] Refresh failed, serving last snapshot: {reason}")
+            self._failing = True
+
+    def _run(self):
+        while not self._stopped:
+            self._dirty.clear()
+            self.refresh()
+            if self._dirty.wait(self.interval) and not self._stopped:
+                # Coalesce a burst of router changes into one refresh
+                time.sleep(self.debounce)
+
+
+router_mirror = RouterMirror(
+    interval=float(os.environ.get('ROUTER_MIRROR_INTERVAL', 5)),
+    stale_after=float(os.environ.get('ROUTER_MIRROR_STALE_AFTER', 60)),
+)
+
+
+# IP -> MAC answers from live lookups. Misses are kept briefly too, so a page
+# reloading in a loop doesn't query the router every time.
+ip_macs = TTLCache('ip_macs', ttl=float(os.environ.get('MAC_CACHE_TTL', 30)), max_entries=4096)
+ip_macs_unknown = TTLCache('ip_macs_unknown', ttl=float(os.environ.get('MAC_NEGATIVE_TTL', 5)), max_entries=4096)
+
+
+def _read_mac(api, ip_address):
+    """MAC for an IP from the active sessions, ARP or DHCP leases, on one session."""
+    for path in ('/ip/hotspot/active', '/ip/arp', '/ip/dhcp-server/lease'):
+        for row in _query(api.get_resource(path), 'mac-address', {'address': ip_address}):
+            if row.get('mac-address'):
+                return row['mac-address']
+    return None
+
+
+def remember_mac(ip_address, mac_address):
+    """Record the MAC the hotspot login redirect gave for the requesting IP, replacing any miss.
+
+    Pass request.remote_addr, never a client-supplied IP: the cache is shared,
+    and a client may only speak for its own address.
+    """
+    if ip_address and mac_address:
+        ip_macs.set(ip_address, mac_address)
+        ip_macs_unknown.invalidate(ip_address)
+
+
+def forget_unknown_macs():
+    """Drop cached misses (a login or binding change may have made the IP known)."""
+    ip_macs_unknown.invalidate()
+
+
+def lookup_mac(ip_address, live=False):
+    """MAC for a client IP, or None.
+
+    Answers from the mirror snapshot when the IP is in it, then from the
+    IP -> MAC cache. Page loads stop there while the mirror is running, so
+    they never wait on the router. With live=True (the activation path,
+    which has to know the MAC), or when the mirror is not running, an IP
+    that is in neither is looked up on one pooled session. Concurrent
+    lookups for the same IP share that read, and a miss is remembered for
+    MAC_NEGATIVE_TTL seconds.
+    """
+    if not ip_address:
+        return None
+    snap = router_mirror.snapshot()
+    if snap is not None:
+        mac = snap.mac_for_ip(ip_address)
+        if mac:
+            return mac
+    mac = ip_macs.get(ip_address)
+    if mac is not None:
+        return mac
+    if not live and router_mirror.running:
+        return None
+    if ip_macs_unknown.get(ip_address) is not None:
+        return None
+
+    try:
+        mac = ip_macs.get_or_load(ip_address, lambda: _router_read(lambda api: _read_mac(api, ip_address)))
+    except Exception as e:
+        print(f"[MIRROR] MAC lookup for {ip_address} failed: {str(e)}")
+        return None
+    if mac is None:
+        ip_macs_unknown.set(ip_address, True)
+    return mac
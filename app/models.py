@@ -20,6 +20,15 @@ class Admin(UserMixin, db.Model):
 
 class Voucher(db.Model):
     __tablename__ = 'vouchers'
+    __table_args__ = (
+        # Portal lookups by device: WHERE user_mac_address = ? ORDER BY expires_at DESC
+        db.Index('ix_vouchers_mac_expires', 'user_mac_address', 'expires_at'),
+        # Expiry sweep and scheduler seeding only care about connected vouchers
+        db.Index('ix_vouchers_connected_expiry', 'expires_at',
+                 sqlite_where=db.text('user_mac_address IS NOT NULL')),
+        # The "... OR is_developer" branch of running-voucher queries
+        db.Index('ix_vouchers_developer', 'is_developer', sqlite_where=db.text('is_developer = 1')),
+    )
 
     id = db.Column(db.Integer, primary_key=True)
     code = db.Column(db.String(20), unique=True, nullable=False, index=True)
@@ -32,10 +41,19 @@ class Voucher(db.Model):
     
     # Activation details
     activated_at = db.Column(db.DateTime, nullable=True)
-    expires_at = db.Column(db.DateTime, nullable=True)
+    expires_at = db.Column(db.DateTime, nullable=True, index=True)
     user_mac_address = db.Column(db.String(17), nullable=True)
     is_developer = db.Column(db.Boolean, default=False)  # Developer code that never expires
 
+    # What was sold (copied from the profile at generation time so later price changes don't rewrite history)
+    profile = db.Column(db.String(64), nullable=True)
+    price = db.Column(db.Float, nullable=True)
+
+    # Data usage (accumulated by app/accounting.py from the user's queue counters)
+    bytes_up = db.Column(db.BigInteger, nullable=False, default=0)
+    bytes_down = db.Column(db.BigInteger, nullable=False, default=0)
+    data_limit_bytes = db.Column(db.BigInteger, nullable=True)  # None = no data cap
+
     @property
     def is_activated(self):
         return self.activated_at is not None
@@ -60,8 +78,73 @@ class Voucher(db.Model):
                 return int((expires_at - now).total_seconds())
         return 0
 
+    @property
+    def data_used(self):
+        return (self.bytes_up or 0) + (self.bytes_down or 0)
+
+    @property
+    def data_remaining(self):
+        """Bytes left before the data cap, or None for vouchers without one."""
+        if self.data_limit_bytes is None:
+            return None
+        return max(0, self.data_limit_bytes - self.data_used)
+
     def activate(self, mac_address):
         if not self.is_activated:
             self.activated_at = datetime.now(timezone.utc)
             self.expires_at = self.activated_at + timedelta(seconds=self.duration)
             self.user_mac_address = mac_address
+            if not self.is_developer:
+                from .sessions import expiry_scheduler
+                expiry_scheduler.schedule(self.id, self.expires_at)
+                from .income import record_sale
+                record_sale(self)
+
+class IncomeRollup(db.Model):
+    """Income per local day ('day', '2025-06-01') or month ('month', '2025-06'), updated on each activation."""
+    __tablename__ = 'income_rollups'
+    __table_args__ = (db.UniqueConstraint('period', 'bucket', name='uq_income_bucket'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    period = db.Column(db.String(5), nullable=False)
+    bucket = db.Column(db.String(10), nullable=False)
+    amount = db.Column(db.Float, nullable=False, default=0)
+    vouchers = db.Column(db.Integer, nullable=False, default=0)
+
+class ActivationJob(db.Model):
+    """Router authorization for an activated voucher, retried until it succeeds."""
+    __tablename__ = 'activation_jobs'
+
+    id = db.Column(db.Integer, primary_key=True)
+    voucher_code = db.Column(db.String(20), nullable=False, index=True)
+    mac_address = db.Column(db.String(17), nullable=False, index=True)
+    duration = db.Column(db.Integer, nullable=False)
+    rate_limit_up = db.Column(db.String(20), nullable=True)
+    rate_limit_down = db.Column(db.String(20), nullable=True)
+
+    status = db.Column(db.String(10), nullable=False, default='pending', index=True)  # pending, running, done, failed, cancelled, superseded
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    last_error = db.Column(db.String(255), nullable=True)
+    next_attempt_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    created_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc))
+    updated_at = db.Column(db.DateTime, default=lambda: datetime.now(timezone.utc), onupdate=lambda: datetime.now(timezone.utc))
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'attempts': self.attempts,
+            'error': self.last_error,
+            'mac': self.mac_address,
+        }
+
+class TrafficPoint(db.Model):
+    """Bytes moved in one time bucket for one series (WAN interface or user queue)."""
+    __tablename__ = 'traffic_history'
+    __table_args__ = (db.UniqueConstraint('series', 'resolution', 'bucket', name='uq_traffic_bucket'),)
+
+    id = db.Column(db.Integer, primary_key=True)
+    series = db.Column(db.String(64), nullable=False)   # e.g. 'wan:ether1', 'queue:pisonet-aa-bb-cc-dd-ee-ff'
+    resolution = db.Column(db.String(3), nullable=False)  # '1m', '1h' or '1d'
+    bucket = db.Column(db.Integer, nullable=False)  # Bucket start, unix seconds (UTC)
+    rx_bytes = db.Column(db.BigInteger, nullable=False, default=0)  # Download (towards the user / from the internet)
+    tx_bytes = db.Column(db.BigInteger, nullable=False, default=0)  # Upload
@@ -0,0 +1,226 @@
+# app/profiles.py
+"""Voucher profiles (plans) from profiles.json, parsed and validated once.
+
+The file is re-read only when its modification time or size changes, so
+request handlers can look profiles up on every call without touching disk
+beyond a stat(). Validity is parsed into seconds and rates into bits per
+second at load time; entries that don't parse are left out and logged.
+"""
+import json
+import os
+import re
+import threading
+
+from .utils import parse_data_size
+
+PROFILES_FILE = os.environ.get('PROFILES_FILE', 'profiles.json')
+
+DEFAULT_PROFILES = [
+    {"name": "1H", "price": 10, "validity": "1h", "users": "1", "rate_up": "1M", "rate_down": "2M"},
+    {"name": "3H", "price": 25, "validity": "3h", "users": "1", "rate_up": "2M", "rate_down": "4M"},
+]
+
+_VALIDITY_RE = re.compile(r'^\s*(\d+)\s*([mhd]?)\s*$', re.IGNORECASE)
+_VALIDITY_UNITS = {'': 60, 'm': 60, 'h': 3600, 'd': 86400}  # a bare number is minutes
+
+_RATE_RE = re.compile(r'^\s*([\d.]+)\s*([kKmMgG]?)\s*$')
+_RATE_UNITS = {'': 1, 'k': 1000, 'm': 1000000, 'g': 1000000000}
+
+
+class ProfileError(ValueError):
+    """A profile entry that can't be used (bad validity, rate, price, ...)."""
+
+
+def parse_validity(value):
+    """'30m' / '2h' / '1d' / '45' (minutes) -> seconds (None if unparseable or zero)."""
+    match = _VALIDITY_RE.match(str(value or ''))
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * _VALIDITY_UNITS[match.group(2).lower()]
+
+
+def parse_rate(value):
+    """'512K' / '2M' / '2000000' -> bits per second (None if unparseable)."""
+    match = _RATE_RE.match(str(value or ''))
+    if not match:
+        return None
+    return int(float(match.group(1)) * _RATE_UNITS[match.group(2).lower()])
+
+
+class Profile:
+    """A validated profiles.json entry. `raw` is the entry as stored in the file."""
+    __slots__ = ('name', 'price', 'validity', 'duration', 'users', 'rate_up', 'rate_down',
+                 'rate_up_bps', 'rate_down_bps', 'data_limit_bytes', 'raw')
+
+    def __init__(self, raw):
+        if not isinstance(raw, dict):
+            raise ProfileError("profile entry must be an object")
+        self.raw = raw
+        self.name = str(raw.get('name') or '').strip()
+        if not self.name:
+            raise ProfileError("name is required")
+
+        self.validity = str(raw.get('validity') or '').strip()
+        self.duration = parse_validity(self.validity)
+        if self.duration is None:
+            raise ProfileError(f"{self.name}: invalid validity '{self.validity}' (use e.g. 30m, 2h, 1d)")
+
+        try:
+            self.price = float(raw.get('price') or 0)
+        except (TypeError, ValueError):
+            raise ProfileError(f"{self.name}: price must be a number, got '{raw.get('price')}'")
+        if self.price < 0:
+            raise ProfileError(f"{self.name}: price can't be negative")
+
+        self.rate_up = str(raw.get('rate_up') or '1M').strip()
+        self.rate_down = str(raw.get('rate_down') or '2M').strip()
+        self.rate_up_bps = parse_rate(self.rate_up)
+        self.rate_down_bps = parse_rate(self.rate_down)
+        if not self.rate_up_bps or not self.rate_down_bps:
+            raise ProfileError(f"{self.name}: invalid rate limit '{self.rate_up}/{self.rate_down}' (use e.g. 512K, 2M)")
+
+        data_limit = raw.get('data_limit')
+        self.data_limit_bytes = parse_data_size(data_limit) if data_limit else None
+        if data_limit and not self.data_limit_bytes:
+            raise ProfileError(f"{self.name}: invalid data limit '{data_limit}' (use e.g. 500M, 1G)")
+
+        self.users = str(raw.get('users') or '1')
+
+    def voucher_fields(self):
+        """Keyword arguments for vouchers.create_vouchers()."""
+        return {
+            'duration': self.duration,
+            'rate_limit_up': self.rate_up,
+            'rate_limit_down': self.rate_down,
+            'profile': self.name,
+            'price': self.price,
+            'data_limit_bytes': self.data_limit_bytes,
+        }
+
+    def label(self):
+        return f"({self.name} - {self.validity} @ {self.rate_up}/{self.rate_down})"
+
+
+class ProfileRegistry:
+    """profiles.json, cached and reloaded when the file changes.
+
+    A file that can't be read or isn't valid JSON keeps the last good
+    profiles. Invalid entries are skipped; their messages are in `errors`.
+    """
+    def __init__(self, path=PROFILES_FILE):
+        self.path = path
+        self.errors = []
+        self._profiles = []
+        self._by_name = {}
+        self._signature = None
+        self._lock = threading.Lock()
+
+    def _stat(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return None
+        return (st.st_mtime_ns, st.st_size)
+
+    def _refresh(self):
+        signature = self._stat()
+        if signature == self._signature:
+            return
+        with self._lock:
+            if signature == self._signature:
+                return
+            if signature is None:
+                self._set([], [])
+                self._signature = None
+                return
+            try:
+                with open(self.path, 'r') as f:
+                    entries = json.load(f)
+                if not isinstance(entries, list):
+                    raise ValueError("expected a list of profiles")
+            except (OSError, ValueError) as e:
+                # Keep serving the last good profiles; retry when the file changes again
+                print(f"[PROFILES] Could not load {self.path}: {str(e)}")
+                self.errors = [f"{self.path}: {str(e)}"]
+                self._signature = signature
+                return
+
+            profiles, errors = [], []
+            seen = set()
+            for entry in entries:
+                try:
+                    profile = Profile(entry)
+                    if profile.name in seen:
+                        raise ProfileError(f"{profile.name}: duplicate profile name")
+                except ProfileError as e:
+                    errors.append(str(e))
+                    continue
+                seen.add(profile.name)
+                profiles.append(profile)
+            for error in errors:
+                print(f"[PROFILES] Skipping invalid profile: {error}")
+            self._set(profiles, errors)
+            self._signature = signature
+
+    def _set(self, profiles, errors):
+        self._profiles = profiles
+        self._by_name = {profile.name: profile for profile in profiles}
+        self.errors = errors
+
+    def all(self):
+        """Valid profiles in file order."""
+        self._refresh()
+        return list(self._profiles)
+
+    def get(self, name):
+        self._refresh()
+        return self._by_name.get(name)
+
+    def entries(self):
+        """Valid profiles as stored in the file (for the API, templates and the managers)."""
+        return [profile.raw for profile in self.all()]
+
+    def _read_raw(self):
+        """Every entry in the file as stored, valid or not ([] if there is no file). Raises ProfileError."""
+        try:
+            with open(self.path, 'r') as f:
+                entries = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            raise ProfileError(f"{self.path}: {str(e)}")
+        if not isinstance(entries, list):
+            raise ProfileError(f"{self.path}: expected a list of profiles")
+        return entries
+
+    def save(self, entries):
+        """Write the file as given (atomically). Entries are validated when the file is read."""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(entries, f, indent=4)
+        os.replace(tmp_path, self.path)
+        self._refresh()
+
+    def add(self, entry):
+        """Validate and append one profile. Returns it. Raises ProfileError.
+
+        The other entries are written back exactly as they are in the file,
+        including ones that don't validate, so fixing them by hand is still possible.
+        """
+        profile = Profile(entry)
+        entries = self._read_raw()
+        names = {str(e.get('name') or '').strip() for e in entries if isinstance(e, dict)}
+        if profile.name in names:
+            raise ProfileError(f"{profile.name}: duplicate profile name")
+        entry = dict(entry, name=profile.name, validity=profile.validity,
+                     price=int(profile.price) if profile.price == int(profile.price) else profile.price)
+        self.save(entries + [entry])
+        return self.get(profile.name)
+
+    def ensure_defaults(self):
+        """Write DEFAULT_PROFILES if the file is missing or empty (never over a file with errors)."""
+        if not self.all() and not self.errors:
+            self.save([dict(entry) for entry in DEFAULT_PROFILES])
+
+
+profile_registry = ProfileRegistry()
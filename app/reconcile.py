@@ -0,0 +1,211 @@
+# app/reconcile.py
+"""Bring the router's bindings and queues back in line with the vouchers table."""
+import os
+import threading
+from datetime import datetime, timezone
+
+from sqlalchemy import or_
+
+from . import db
+from .models import Voucher
+from .bandwidth import (
+    pcq_enabled, plan_tier_changes, read_entries, read_hosts, tier_builder, ENTRY_COMMENT_PREFIX,
+)
+from .profiles import parse_rate
+from .utils import (
+    get_pooled_api, _row_id, _queue_name, _remove_ids, _collect, _router_changed,
+    BINDING_COMMENT, QUEUE_COMMENT, UNLIMITED,
+)
+
+def _limits_match(max_limit, upload_speed, download_speed):
+    # RouterOS reports max-limit normalized (e.g. 1M/2M comes back as 1000000/2000000)
+    up, _, down = (max_limit or '').partition('/')
+    return parse_rate(up) == parse_rate(upload_speed) and parse_rate(down) == parse_rate(download_speed)
+
+
+def desired_state(now=None):
+    """{MAC (upper case): (mac, upload, download)} for every voucher that should have access."""
+    now = now or datetime.now(timezone.utc)
+    rows = db.session.query(
+        Voucher.user_mac_address, Voucher.rate_limit_up, Voucher.rate_limit_down, Voucher.expires_at
+    ).filter(
+        Voucher.activated_at != None,
+        Voucher.user_mac_address != None,
+        or_(Voucher.expires_at > now, Voucher.is_developer == True)
+    ).all()
+    # Sorted by expiry so the voucher that runs longest decides the speed. Sorting the
+    # few running rows here keeps SQLite on the expiry/developer indexes instead of a full ordered scan.
+    rows.sort(key=lambda row: row.expires_at)
+    return {mac.upper(): (mac, up or '1M', down or '2M') for mac, up, down, _ in rows}
+
+
+def plan_changes(desired, bindings, queues, name_prefix="pisonet", manage_queues=True):
+    """Diff desired access against router rows. Pure function; O(vouchers + rows).
+
+    bindings: /ip/hotspot/ip-binding rows; queues: /queue/simple rows.
+    Bindings are only removed when this app created them (our comment, or a
+    matching pisonet-* queue for bindings made before comments were added);
+    entries an admin added by hand are left alone. With manage_queues=False
+    (PCQ bandwidth mode) no queues are wanted and leftover pisonet-* queues
+    are removed. Vouchers whose limit was removed (UNLIMITED speeds) get a
+    binding but no queue.
+    """
+    queue_prefix = f"{name_prefix}-"
+    our_queues = {row.get('name'): row for row in queues if row.get('name', '').startswith(queue_prefix)}
+
+    bindings_by_mac = {}
+    for row in bindings:
+        mac = (row.get('mac-address') or '').upper()
+        if mac:
+            bindings_by_mac.setdefault(mac, []).append(row)
+
+    plan = {
+        'add_bindings': [], 'set_bindings': [], 'remove_bindings': [],
+        'add_queues': [], 'set_queues': [], 'remove_queues': [],
+    }
+
+    for key, (mac, upload_speed, download_speed) in desired.items():
+        rows = bindings_by_mac.get(key)
+        if not rows:
+            plan['add_bindings'].append(mac)
+        else:
+            if rows[0].get('type') != 'bypassed':
+                plan['set_bindings'].append(_row_id(rows[0]))
+            plan['remove_bindings'].extend(_row_id(row) for row in rows[1:])
+
+        if not manage_queues or UNLIMITED in (upload_speed, download_speed):
+            continue
+        queue = our_queues.get(_queue_name(mac, name_prefix))
+        if queue is None:
+            plan['add_queues'].append((mac, upload_speed, download_speed))
+        elif not _limits_match(queue.get('max-limit'), upload_speed, download_speed) \
+                or queue.get('comment') != QUEUE_COMMENT:
+            # Untagged queues (made before the comment existed) are tagged so filtered reads find them
+            plan['set_queues'].append((_row_id(queue), mac, upload_speed, download_speed))
+
+    desired_queue_names = {_queue_name(mac, name_prefix) for mac, up, down in desired.values()
+                           if UNLIMITED not in (up, down)} if manage_queues else set()
+    legacy_owned = {name[len(queue_prefix):].replace('-', ':').upper() for name in our_queues}
+    for key, rows in bindings_by_mac.items():
+        if key in desired:
+            continue
+        for row in rows:
+            if row.get('type') != 'bypassed':
+                continue
+            if row.get('comment') == BINDING_COMMENT or key in legacy_owned:
+                plan['remove_bindings'].append(_row_id(row))
+
+    plan['remove_queues'] = [_row_id(row) for name, row in our_queues.items() if name not in desired_queue_names]
+    return plan
+
+
+def reconcile_router(apply=True, name_prefix="pisonet"):
+    """Compare active vouchers with the router and fix the difference.
+
+    Reads the vouchers, ip-binding and simple queue tables once each, plans the
+    minimal set of add/set/remove operations, and applies them over one pooled
+    session: one remove per table, adds and sets pipelined. In PCQ bandwidth
+    mode the tier address lists are reconciled instead of per-user queues.
+
+    Args:
+        apply: False to only report what would change
+
+    Returns:
+        dict of operation counts (plus 'errors'), or None if the router is unreachable
+    """
+    desired = desired_state()
+
+    api_pool = get_pooled_api()
+    if not api_pool:
+        print("[RECONCILE] Router unreachable, skipping reconciliation")
+        return None
+
+    try:
+        api = api_pool.get_api()
+        ip_bindings = api.get_resource('/ip/hotspot/ip-binding')
+        simple_queue = api.get_resource('/queue/simple')
+        bindings = ip_bindings.call('print', {'.proplist': '.id,mac-address,type,comment'})
+        queues = simple_queue.call('print', {'.proplist': '.id,name,max-limit,comment'})
+
+        pcq = pcq_enabled()
+        plan = plan_changes(desired, bindings, queues, name_prefix, manage_queues=not pcq)
+        if pcq:
+            hosts = read_hosts(api)
+            plan.update(plan_tier_changes(desired, read_entries(api, name_prefix), hosts, name_prefix))
+        report = {op: len(items) for op, items in plan.items()}
+        report['errors'] = 0
+        if not apply or not any(items for op, items in plan.items() if op != 'no_address'):
+            return report
+
+        hotspot_server = os.getenv('MIKROTIK_HOTSPOT_SERVER', 'hotspot1')
+        report['errors'] += len(_remove_ids(ip_bindings, plan['remove_bindings']))
+        report['errors'] += len(_remove_ids(simple_queue, plan['remove_queues']))
+
+        promises = []
+        for mac in plan['add_bindings']:
+            promises.append((f"binding {mac}", ip_bindings.call_async('add', {
+                'mac-address': mac, 'type': 'bypassed', 'server': hotspot_server, 'comment': BINDING_COMMENT})))
+        for binding_id in plan['set_bindings']:
+            promises.append((f"binding {binding_id}", ip_bindings.call_async('set', {
+                'id': binding_id, 'type': 'bypassed', 'server': hotspot_server, 'comment': BINDING_COMMENT})))
+        for mac, upload_speed, download_speed in plan['add_queues']:
+            promises.append((f"queue {mac}", simple_queue.call_async('add', {
+                'name': _queue_name(mac, name_prefix), 'target': mac,
+                'max-limit': f"{upload_speed}/{download_speed}", 'comment': QUEUE_COMMENT})))
+        for queue_id, mac, upload_speed, download_speed in plan['set_queues']:
+            promises.append((f"queue {mac}", simple_queue.call_async('set', {
+                'id': queue_id, 'max-limit': f"{upload_speed}/{download_speed}", 'comment': QUEUE_COMMENT})))
+
+        if pcq:
+            # Tiers may have been removed by hand or lost in a router reset
+            tier_builder.forget()
+            tier_errors = tier_builder.ensure(api, {(up, down) for _, up, down in desired.values()})
+            address_list = api.get_resource('/ip/firewall/address-list')
+            report['errors'] += len(_remove_ids(address_list, plan['remove_entries']))
+            for mac, list_name, address in plan['add_entries']:
+                if tier_errors.get(list_name):
+                    report['errors'] += 1
+                    continue
+                promises.append((f"tier entry {mac}", address_list.call_async('add', {
+                    'list': list_name, 'address': address, 'comment': f"{ENTRY_COMMENT_PREFIX}{mac.upper()}"})))
+
+        for item, error in _collect(promises).items():
+            if error:
+                report['errors'] += 1
+                print(f"[RECONCILE] Failed to update {item}: {error}")
+
+        _router_changed()
+        return report
+    except Exception as e:
+        print(f"[RECONCILE] Error reconciling router state: {str(e)}")
+        return None
+    finally:
+        api_pool.release()
+
+
+def format_report(report):
+    if report is None:
+        return "router unreachable"
+    tiers = ''
+    if 'add_entries' in report:
+        tiers = (f"tier entries +{report['add_entries']} -{report['remove_entries']}"
+                 + (f" ({report['no_address']} waiting for an IP)" if report['no_address'] else "") + ", ")
+    return (f"bindings +{report['add_bindings']} ~{report['set_bindings']} -{report['remove_bindings']}, "
+            f"queues +{report['add_queues']} ~{report['set_queues']} -{report['remove_queues']}, "
+            f"{tiers}{report['errors']} error(s)")
+
+
+def reconcile_in_background(app):
+    """Run one reconciliation pass off the startup path."""
+    def _run():
+        with app.app_context():
+            try:
+                report = reconcile_router()
+                if report is not None:
+                    print(f"[RECONCILE] Startup reconciliation: {format_report(report)}")
+            finally:
+                db.session.remove()
+
+    thread = threading.Thread(target=_run, name='startup-reconcile', daemon=True)
+    thread.start()
+    return thread
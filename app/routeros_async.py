@@ -0,0 +1,423 @@
+# app/routeros_async.py
+"""Asyncio RouterOS API client.
+
+Speaks the API sentence/word protocol directly so several tagged commands can
+be in flight on one socket at once, and `listen` streams can run alongside
+ordinary commands. AsyncRouterService runs a client on a background event loop
+so Flask request threads and the GUI can use it without their own loop.
+"""
+import asyncio
+import atexit
+import binascii
+import hashlib
+import itertools
+import os
+import ssl
+import threading
+
+
+class RouterOsError(Exception):
+    """Base class for async RouterOS client errors."""
+
+
+class RouterOsConnectionError(RouterOsError):
+    """The connection failed, was closed, or the router sent !fatal."""
+
+
+class RouterOsTrap(RouterOsError):
+    """The router rejected a command (!trap)."""
+    def __init__(self, message, category=None):
+        super().__init__(message)
+        self.category = category
+
+
+# ============ WIRE FORMAT ============
+
+def encode_length(length):
+    if length < 0x80:
+        return bytes([length])
+    if length < 0x4000:
+        return (length | 0x8000).to_bytes(2, 'big')
+    if length < 0x200000:
+        return (length | 0xC00000).to_bytes(3, 'big')
+    if length < 0x10000000:
+        return (length | 0xE0000000).to_bytes(4, 'big')
+    return b'\xf0' + length.to_bytes(4, 'big')
+
+
+def encode_sentence(words):
+    """Encode a list of words as one API sentence (terminated by an empty word)."""
+    out = bytearray()
+    for word in words:
+        data = word.encode('utf-8')
+        out += encode_length(len(data))
+        out += data
+    out += b'\x00'
+    return bytes(out)
+
+
+async def read_length(reader):
+    first = (await reader.readexactly(1))[0]
+    if first < 0x80:
+        return first
+    if first < 0xC0:
+        extra, value = 1, first & 0x3F
+    elif first < 0xE0:
+        extra, value = 2, first & 0x1F
+    elif first < 0xF0:
+        extra, value = 3, first & 0x0F
+    elif first == 0xF0:
+        extra, value = 4, 0
+    else:
+        raise RouterOsConnectionError(f"Unexpected control byte 0x{first:02x}")
+    for byte in await reader.readexactly(extra):
+        value = (value << 8) | byte
+    return value
+
+
+async def read_sentence(reader):
+    words = []
+    while True:
+        length = await read_length(reader)
+        if length == 0:
+            return words
+        words.append((await reader.readexactly(length)).decode('utf-8', errors='replace'))
+
+
+def parse_sentence(words):
+    """('!re', {'name': 'ether1', ...}, tag) from a raw sentence."""
+    reply = words[0] if words else ''
+    attrs = {}
+    tag = None
+    for word in words[1:]:
+        if word.startswith('.tag='):
+            tag = word[5:]
+        elif word.startswith('='):
+            key, _, value = word[1:].partition('=')
+            attrs[key] = value
+    return reply, attrs, tag
+
+
+def command_words(command, args=None, queries=None, proplist=None):
+    words = [command]
+    for key, value in (args or {}).items():
+        words.append(f"={key}={'' if value is None else value}")
+    if proplist:
+        words.append(f"=.proplist={proplist if isinstance(proplist, str) else ','.join(proplist)}")
+    for key, value in (queries or {}).items():
+        words.append(f"?{key}={value}")
+    return words
+
+
+# ============ CLIENT ============
+
+class Reply(list):
+    """Rows (!re) of a finished command; `done` holds attributes of the !done sentence (e.g. ret)."""
+    def __init__(self, rows=(), done=None):
+        super().__init__(rows)
+        self.done = done or {}
+
+
+class ListenStream:
+    """Rows from a command that keeps replying (listen, follow, monitor-traffic without once).
+
+    Use as `async with client.listen(...) as stream: async for row in stream`.
+    Leaving the block sends /cancel for the stream's tag.
+    """
+    def __init__(self, client, tag, queue):
+        self._client = client
+        self.tag = tag
+        self._queue = queue
+        self._finished = False
+        self._cancelled = False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while not self._finished:
+            reply, attrs = await self._queue.get()
+            if reply == '!re':
+                return attrs
+            if reply == '!done':
+                self._finish()
+            elif reply == '!trap':
+                # category 2 = interrupted, the normal answer to /cancel
+                if self._cancelled and attrs.get('category') == '2':
+                    continue
+                self._finish()
+                raise RouterOsTrap(attrs.get('message', 'command failed'), attrs.get('category'))
+            elif reply == '!fatal':
+                self._finish()
+                raise RouterOsConnectionError(attrs.get('message', 'connection closed'))
+        raise StopAsyncIteration
+
+    async def cancel(self):
+        if self._finished or self._cancelled:
+            return
+        self._cancelled = True
+        if not self._client.closed:
+            await self._client.call('/cancel', {'tag': self.tag})
+
+    def _finish(self):
+        self._finished = True
+        self._client._pending.pop(self.tag, None)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        try:
+            await self.cancel()
+        except RouterOsError:
+            pass
+        self._finish()
+
+
+class AsyncRouterOsClient:
+    """One API connection that multiplexes tagged commands.
+
+    A reader task routes each reply sentence to the command that owns its
+    .tag, so callers can gather() many commands on the same socket.
+    """
+    def __init__(self, host, port=8728, username='admin', password='', use_ssl=False, ssl_verify=False, timeout=15):
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.use_ssl = use_ssl
+        self.ssl_verify = ssl_verify
+        self.timeout = timeout
+        self._reader = None
+        self._writer = None
+        self._reader_task = None
+        self._pending = {}
+        self._tags = itertools.count(1)
+        self._write_lock = None
+        self.closed = True
+
+    async def connect(self):
+        ssl_context = None
+        if self.use_ssl:
+            ssl_context = ssl.create_default_context()
+            if not self.ssl_verify:
+                # RouterOS API-SSL uses a self-signed certificate unless one was installed
+                ssl_context.check_hostname = False
+                ssl_context.verify_mode = ssl.CERT_NONE
+        try:
+            self._reader, self._writer = await asyncio.wait_for(
+                asyncio.open_connection(self.host, self.port, ssl=ssl_context), self.timeout)
+        except (OSError, asyncio.TimeoutError) as e:
+            raise RouterOsConnectionError(f"Cannot connect to {self.host}:{self.port}: {e}") from e
+        self.closed = False
+        self._write_lock = asyncio.Lock()
+        self._reader_task = asyncio.get_running_loop().create_task(self._read_loop())
+        try:
+            await self._login()
+        except BaseException:
+            await self.close()
+            raise
+        return self
+
+    async def _login(self):
+        reply = await self.call('/login', {'name': self.username, 'password': self.password})
+        challenge = reply.done.get('ret')
+        if challenge:
+            # Routers before 6.43 answer with an MD5 challenge instead of logging in
+            digest = hashlib.md5(b'\x00' + self.password.encode('utf-8') + binascii.unhexlify(challenge)).hexdigest()
+            await self.call('/login', {'name': self.username, 'response': '00' + digest})
+
+    async def close(self):
+        if self.closed and self._writer is None:
+            return
+        self.closed = True
+        if self._reader_task is not None:
+            self._reader_task.cancel()
+        if self._writer is not None:
+            self._writer.close()
+            try:
+                await self._writer.wait_closed()
+            except Exception:
+                pass
+            self._writer = None
+        self._fail_pending('connection closed')
+
+    async def __aenter__(self):
+        return await self.connect()
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def _open(self, command, args, queries, proplist):
+        if self.closed:
+            raise RouterOsConnectionError("Connection is closed")
+        tag = str(next(self._tags))
+        queue = asyncio.Queue()
+        self._pending[tag] = queue
+        words = command_words(command, args, queries, proplist)
+        words.append(f'.tag={tag}')
+        return tag, queue, encode_sentence(words)
+
+    async def _send(self, data):
+        async with self._write_lock:
+            self._writer.write(data)
+            await self._writer.drain()
+
+    async def call(self, command, args=None, queries=None, proplist=None, timeout=None):
+        """Run one command and return its rows as a Reply.
+
+        command: full API path such as '/ip/hotspot/active/print'
+        args: {'name': value} attribute words; queries: {'name': value} ?-filters
+        proplist: columns to return (string or iterable)
+        """
+        tag, queue, data = self._open(command, args, queries, proplist)
+        try:
+            await self._send(data)
+            return await asyncio.wait_for(self._collect(queue), timeout or self.timeout)
+        except asyncio.TimeoutError:
+            raise RouterOsError(f"{command} timed out")
+        finally:
+            self._pending.pop(tag, None)
+
+    async def _collect(self, queue):
+        rows = []
+        trap = None
+        while True:
+            reply, attrs = await queue.get()
+            if reply == '!re':
+                rows.append(attrs)
+            elif reply == '!trap':
+                trap = trap or RouterOsTrap(attrs.get('message', 'command failed'), attrs.get('category'))
+            elif reply == '!done':
+                if trap:
+                    raise trap
+                return Reply(rows, attrs)
+            elif reply == '!fatal':
+                raise RouterOsConnectionError(attrs.get('message', 'connection closed'))
+
+    def listen(self, command, args=None, queries=None, proplist=None):
+        """Start a streaming command; see ListenStream. The command is sent on first await."""
+        tag, queue, data = self._open(command, args, queries, proplist)
+        stream = ListenStream(self, tag, queue)
+        return _StartingStream(self, stream, data)
+
+    async def _read_loop(self):
+        try:
+            while True:
+                reply, attrs, tag = parse_sentence(await read_sentence(self._reader))
+                if reply == '!fatal':
+                    self._fail_pending(attrs.get('message') or 'router closed the session')
+                    break
+                queue = self._pending.get(tag)
+                if queue is not None:
+                    queue.put_nowait((reply, attrs))
+        except asyncio.CancelledError:
+            raise
+        except (asyncio.IncompleteReadError, OSError, RouterOsError) as e:
+            self._fail_pending(f"connection lost: {e}")
+        finally:
+            self.closed = True
+
+    def _fail_pending(self, message):
+        pending, self._pending = self._pending, {}
+        for queue in pending.values():
+            queue.put_nowait(('!fatal', {'message': message}))
+
+
+class _StartingStream:
+    """Awaitable/async-context wrapper that sends a listen command before handing out the stream."""
+    def __init__(self, client, stream, data):
+        self._client = client
+        self._stream = stream
+        self._data = data
+
+    async def _start(self):
+        await self._client._send(self._data)
+        return self._stream
+
+    def __await__(self):
+        return self._start().__await__()
+
+    async def __aenter__(self):
+        return await self._start()
+
+    async def __aexit__(self, *exc):
+        await self._stream.__aexit__(*exc)
+
+
+# ============ BACKGROUND SERVICE ============
+
+def client_from_env():
+    """AsyncRouterOsClient configured from the same MIKROTIK_* settings as the sync helpers."""
+    return AsyncRouterOsClient(
+        host=os.getenv('MIKROTIK_HOST', '192.168.88.1'),
+        port=int(os.getenv('MIKROTIK_PORT', 8728)),
+        username=(os.getenv('MIKROTIK_USERNAME', 'admin') or '').strip(),
+        password=(os.getenv('MIKROTIK_PASSWORD', '') or '').strip(),
+        use_ssl=os.getenv('MIKROTIK_USE_SSL', 'False').lower() == 'true',
+        ssl_verify=os.getenv('MIKROTIK_SSL_VERIFY', 'False').lower() == 'true',
+        timeout=int(os.getenv('MIKROTIK_TIMEOUT', os.getenv('ROUTEROS_SOCKET_TIMEOUT', 15))),
+    )
+
+
+class AsyncRouterService:
+    """Event loop thread that owns one long-lived AsyncRouterOsClient.
+
+    submit() takes a coroutine function of the client and returns a
+    concurrent.futures.Future, so synchronous code can fan work out to the
+    router without starting a thread per request. The client is reconnected
+    lazily after a connection error.
+    """
+    def __init__(self, factory=client_from_env):
+        self.factory = factory
+        self._loop = None
+        self._thread = None
+        self._client = None
+        self._connect_lock = None
+        self._start_lock = threading.Lock()
+
+    def _ensure_loop(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._loop = asyncio.new_event_loop()
+                self._thread = threading.Thread(target=self._loop.run_forever, name='routeros-async', daemon=True)
+                self._thread.start()
+                atexit.register(self.stop)
+        return self._loop
+
+    async def _get_client(self):
+        if self._connect_lock is None:
+            self._connect_lock = asyncio.Lock()
+        async with self._connect_lock:
+            if self._client is None or self._client.closed:
+                self._client = await self.factory().connect()
+            return self._client
+
+    async def _run(self, fn):
+        client = await self._get_client()
+        try:
+            return await fn(client)
+        except RouterOsConnectionError:
+            await client.close()
+            raise
+
+    def submit(self, fn):
+        """Schedule fn(client) on the service loop. Returns a concurrent.futures.Future."""
+        return asyncio.run_coroutine_threadsafe(self._run(fn), self._ensure_loop())
+
+    def run(self, fn, timeout=None):
+        """submit() and wait for the result."""
+        return self.submit(fn).result(timeout)
+
+    def stop(self):
+        if self._loop is None or not self._loop.is_running():
+            return
+        if self._client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._client.close(), self._loop).result(2)
+            except Exception:
+                pass
+        self._loop.call_soon_threadsafe(self._loop.stop)
+
+
+router_service = AsyncRouterService()
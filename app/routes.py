@@ -7,8 +7,7 @@ from .utils import (
     get_mikrotik_active_hotspot_users, 
     get_mikrotik_interface_traffic,
     get_income_stats,
-    mikrotik_allow_mac,
-    get_mac_from_active_session
+    mikrotik_allow_mac
 )
 from datetime import datetime, timezone
 import string
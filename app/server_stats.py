@@ -0,0 +1,174 @@
+# app/server_stats.py
+"""Server PC statistics, sampled in the background instead of on every page view."""
+import os
+import platform
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+
+
+def _read_file(path):
+    try:
+        with open(path, 'r') as f:
+            return f.read()
+    except OSError:
+        return None
+
+
+def read_static_facts():
+    """Facts that don't change while the server is running (read once)."""
+    import psutil
+
+    facts = {}
+    model = _read_file('/proc/device-tree/model')
+    facts['model'] = model.strip('\x00').strip() if model else "Unknown Device"
+
+    facts['cpu_model'] = "Unknown CPU"
+    cpuinfo = _read_file('/proc/cpuinfo')
+    if cpuinfo is not None:
+        facts['cpu_model'] = "ARM Processor"
+        for line in cpuinfo.split('\n'):
+            if line.startswith('Hardware'):
+                facts['cpu_model'] = line.split(':', 1)[1].strip()
+                break
+
+    facts['cpu_cores'] = psutil.cpu_count(logical=False)
+
+    facts['os'] = "Linux"
+    os_release = _read_file('/etc/os-release')
+    if os_release:
+        for line in os_release.split('\n'):
+            if line.startswith('PRETTY_NAME'):
+                facts['os'] = line.split('=', 1)[1].strip().strip('"')
+                break
+
+    # Same value `uname -r` prints, without spawning a process
+    facts['kernel'] = platform.release() or "Unknown"
+    facts['boot_time'] = psutil.boot_time()
+    return facts
+
+
+def _format_uptime(uptime_seconds):
+    days, remainder = divmod(int(uptime_seconds), 86400)
+    hours, remainder = divmod(remainder, 3600)
+    minutes, _ = divmod(remainder, 60)
+    if days > 0:
+        return f"{days}d {hours}h {minutes}m"
+    if hours > 0:
+        return f"{hours}h {minutes}m"
+    return f"{minutes}m"
+
+
+class ServerStatsSampler:
+    """Samples CPU, memory and temperature every `interval` seconds into a ring buffer.
+
+    Static facts (model, CPU, OS, kernel) are read once when the sampler
+    starts, and the temperature source is probed once: the thermal zone file
+    if it exists, otherwise vcgencmd if it is installed. Readers only look at
+    the buffer, so a page view never blocks on psutil or starts a process.
+    """
+    THERMAL_ZONE = '/sys/class/thermal/thermal_zone0/temp'
+
+    def __init__(self, interval=5, history=120):
+        self.interval = interval
+        self.samples = deque(maxlen=history)  # (timestamp, cpu %, used MB, free MB, total MB, temp °C or None)
+        self.facts = None
+        self._read_temperature = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._start_lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return self.interval > 0
+
+    def start(self):
+        with self._start_lock:
+            if self.facts is not None:
+                return
+            import psutil
+            self.facts = read_static_facts()
+            self._read_temperature = self._probe_temperature_source()
+            psutil.cpu_percent(interval=None)  # prime the counter; the first reading is meaningless
+            if not self.enabled:
+                # No background sampling; latest() samples on demand instead
+                return
+            self._thread = threading.Thread(target=self._run, name='server-stats', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _probe_temperature_source(self):
+        if _read_file(self.THERMAL_ZONE) is not None:
+            def from_thermal_zone():
+                return int(_read_file(self.THERMAL_ZONE).strip()) / 1000
+            return from_thermal_zone
+        if shutil.which('vcgencmd'):
+            def from_vcgencmd():
+                result = subprocess.run(['vcgencmd', 'measure_temp'], capture_output=True, text=True, timeout=2)
+                # Output: temp=48.2'C
+                return float(result.stdout.strip().split('=')[1].rstrip("'C"))
+            return from_vcgencmd
+        return None
+
+    def sample(self):
+        """Take one sample now (also called by the sampler thread)."""
+        import psutil
+
+        memory = psutil.virtual_memory()
+        temperature = None
+        if self._read_temperature is not None:
+            try:
+                temperature = self._read_temperature()
+            except Exception:
+                temperature = None
+        self.samples.append((
+            time.time(),
+            psutil.cpu_percent(interval=None),
+            int(memory.used / (1024 * 1024)),
+            int(memory.available / (1024 * 1024)),
+            int(memory.total / (1024 * 1024)),
+            temperature,
+        ))
+
+    def _run(self):
+        while not self._stopped.is_set():
+            try:
+                self.sample()
+            except Exception as e:
+                print(f"[ERROR] Server stats sample failed: {str(e)}")
+            self._stopped.wait(self.interval)
+
+    def latest(self):
+        """Static facts merged with the newest sample, in the get_server_stats() format."""
+        if self.facts is None:
+            self.start()
+        if not self.samples or not self.enabled:
+            self.sample()
+        _, cpu, used, free, total, temperature = self.samples[-1]
+        data = {key: value for key, value in self.facts.items() if key != 'boot_time'}
+        data.update({
+            'cpu_usage': cpu,
+            'total_memory': total,
+            'used_memory': used,
+            'free_memory': free,
+            'uptime': _format_uptime(time.time() - self.facts['boot_time']),
+            'temperature': f"{temperature:.1f}°C" if temperature is not None else "N/A",
+        })
+        return data
+
+    def history(self):
+        """Buffered samples as dicts, oldest first."""
+        return [
+            {'time': ts, 'cpu_usage': cpu, 'used_memory': used, 'free_memory': free, 'temperature': temperature}
+            for ts, cpu, used, free, _, temperature in list(self.samples)
+        ]
+
+
+server_sampler = ServerStatsSampler(
+    interval=float(os.environ.get('SERVER_STATS_INTERVAL', 5)),
+    history=int(os.environ.get('SERVER_STATS_HISTORY', 120)),
+)
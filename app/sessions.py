@@ -0,0 +1,360 @@
+# app/sessions.py
+"""Voucher session lifecycle: expiring sessions and taking access off the router."""
+import hashlib
+import heapq
+import json
+import threading
+import time
+from datetime import datetime, timezone
+
+from sqlalchemy import case, func, or_, tuple_
+
+from . import db
+from .cache import TTLCache
+from .events import status_events
+from .models import Voucher
+from .utils import mikrotik_revoke_macs
+
+
+# Status version (ETag) per voucher code, so /api/status can answer If-None-Match without a
+# query. Entries are dropped when a voucher changes in this process; the TTL bounds how long
+# a change made by the desktop managers (another process) can go unnoticed.
+status_versions = TTLCache('status_versions', ttl=60, max_entries=4096)
+
+
+def status_payload(voucher):
+    """What the customer's status page shows for a voucher (/api/status and its event stream).
+
+    expiry_time is absolute (UTC); remaining_seconds is only correct at the
+    moment it was computed, so clients count down from expiry_time.
+    """
+    expires_at = voucher.expires_at
+    if expires_at is not None and expires_at.tzinfo is None:
+        expires_at = expires_at.replace(tzinfo=timezone.utc)
+    payload = {
+        'active': voucher.remaining_seconds > 0,
+        'remaining_seconds': voucher.remaining_seconds,
+        'mac': voucher.user_mac_address,
+        'expiry_time': expires_at.isoformat() if expires_at else None,
+        'data_used': voucher.data_used,
+        'data_limit': voucher.data_limit_bytes,
+        'data_remaining': voucher.data_remaining
+    }
+    payload['version'] = status_version(payload)
+    return payload
+
+
+def status_version(payload):
+    """Version of a status payload: changes when the voucher does, not as its time runs down."""
+    stable = {key: value for key, value in payload.items() if key not in ('remaining_seconds', 'version')}
+    return hashlib.sha1(json.dumps(stable, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def forget_status(codes):
+    """Drop cached status versions (the vouchers changed)."""
+    for code in codes:
+        status_versions.invalidate(code)
+
+
+def status_updates(vouchers, reason=None):
+    """(code, payload) for each voucher, for publish_status().
+
+    Build them before committing: the commit expires the instances, and
+    reading them afterwards would cost one SELECT per voucher.
+    """
+    return [(voucher.code, dict(status_payload(voucher), reason=reason)) for voucher in vouchers]
+
+
+def publish_status(updates, event):
+    """Push status_updates() to the vouchers' open status pages. Call after committing."""
+    forget_status(code for code, _ in updates)
+    for code, payload in updates:
+        if status_events.has_subscribers(code):
+            status_events.publish(code, event, payload)
+
+
+def sweep_expired_vouchers(now=None):
+    """Disconnect every voucher whose time is up, in one batch.
+
+    Only rows with expires_at <= now are loaded. Their bindings and queues are
+    removed over a single router session and the database is committed once.
+    Returns (disconnected, pending): vouchers cut off, and expired vouchers
+    that could not be revoked on the router this time.
+    """
+    now = now or datetime.now(timezone.utc)
+
+    expired = Voucher.query.filter(
+        Voucher.expires_at <= now,
+        Voucher.user_mac_address != None,  # Only process if user_mac is still set
+        Voucher.is_developer == False
+    ).all()
+    if not expired:
+        return 0, 0
+
+    # A device that already started another voucher keeps its router access
+    macs = {v.user_mac_address for v in expired}
+    still_active = {
+        mac for (mac,) in db.session.query(Voucher.user_mac_address).filter(
+            Voucher.user_mac_address.in_(macs),
+            Voucher.activated_at != None,
+            or_(Voucher.expires_at > now, Voucher.is_developer == True)
+        )
+    }
+
+    results = mikrotik_revoke_macs(macs - still_active)
+
+    disconnected = 0
+    for voucher in expired:
+        mac_address = voucher.user_mac_address
+        if mac_address in still_active or results.get(mac_address):
+            # Clear user_mac to mark as disconnected (prevent reprocessing)
+            voucher.user_mac_address = None
+            expiry_scheduler.cancel(voucher.id)
+            disconnected += 1
+            print(f"[SCHEDULER] Disconnected expired voucher: {voucher.code} (MAC: {mac_address})")
+    updates = status_updates(expired, reason='time_up')
+    db.session.commit()
+    publish_status(updates, 'expired')
+
+    return disconnected, len(expired) - disconnected
+
+
+def revoke_vouchers(vouchers, reason='revoked'):
+    """Take router access away from many vouchers at once.
+
+    Bindings and queues for all their MACs are removed over one router session,
+    then every voucher whose MAC was revoked is cleared in a single commit.
+    Their status pages get a 'revoked' event with `reason`.
+    Returns (revoked, failed) lists of vouchers.
+    """
+    vouchers = [v for v in vouchers if v.user_mac_address]
+    if not vouchers:
+        return [], []
+
+    results = mikrotik_revoke_macs({v.user_mac_address for v in vouchers})
+
+    revoked, failed = [], []
+    for voucher in vouchers:
+        if results.get(voucher.user_mac_address):
+            voucher.user_mac_address = None
+            expiry_scheduler.cancel(voucher.id)
+            revoked.append(voucher)
+        else:
+            failed.append(voucher)
+    updates = status_updates(revoked, reason=reason)
+    ids = [voucher.id for voucher in vouchers]
+    db.session.commit()
+    # Callers read the returned vouchers; reload them in one SELECT instead of one each
+    Voucher.query.filter(Voucher.id.in_(ids)).all()
+    publish_status(updates, 'revoked')
+    return revoked, failed
+
+
+def revoke_all_vouchers(running_only=False):
+    """Revoke every connected voucher (e.g. on shutdown).
+
+    running_only: skip vouchers whose time already ran out; the expiry sweep
+    handles those.
+    """
+    query = Voucher.query.filter(
+        Voucher.activated_at != None,
+        Voucher.user_mac_address != None
+    )
+    if running_only:
+        query = query.filter(or_(Voucher.expires_at > datetime.now(timezone.utc), Voucher.is_developer == True))
+    return revoke_vouchers(query.all())
+
+
+def voucher_status_counts(now=None):
+    """{'unused', 'active', 'expired', 'total'} counted in one GROUP BY query."""
+    now = now or datetime.now(timezone.utc)
+    status = case(
+        (Voucher.activated_at == None, 'unused'),
+        (or_(Voucher.is_developer == True, Voucher.expires_at > now), 'active'),
+        else_='expired'
+    )
+    counts = {'unused': 0, 'active': 0, 'expired': 0}
+    for name, count in db.session.query(status, func.count(Voucher.id)).group_by(status):
+        counts[name] = count
+    counts['total'] = sum(counts.values())
+    return counts
+
+
+def running_sessions(after=None, limit=50, now=None):
+    """One page of running vouchers: developer sessions first, then the rest soonest to expire first.
+
+    Returns rows of (id, code, user_mac_address, activated_at, expires_at,
+    is_developer) without building ORM objects. Pass the last row of a page
+    as `after` to get the next one. Both parts are index range scans
+    (keyset on id, then on (expires_at, id)), so a page costs the same with
+    ten or a hundred thousand old vouchers in the table.
+    """
+    now = now or datetime.now(timezone.utc)
+    base = db.session.query(
+        Voucher.id, Voucher.code, Voucher.user_mac_address,
+        Voucher.activated_at, Voucher.expires_at, Voucher.is_developer
+    ).filter(Voucher.activated_at != None)
+
+    rows = []
+    if after is None or after.is_developer:
+        developers = base.filter(Voucher.is_developer == True)
+        if after is not None:
+            developers = developers.filter(Voucher.id > after.id)
+        rows = developers.order_by(Voucher.id).limit(limit).all()
+        if len(rows) == limit:
+            return rows
+        after = None
+
+    timed = base.filter(Voucher.is_developer == False, Voucher.expires_at > now)
+    if after is not None:
+        timed = timed.filter(tuple_(Voucher.expires_at, Voucher.id) > (after.expires_at, after.id))
+    return rows + timed.order_by(Voucher.expires_at, Voucher.id).limit(limit - len(rows)).all()
+
+
+def iter_running_sessions(page_size=200, now=None):
+    """Every running voucher row, fetched a page at a time."""
+    now = now or datetime.now(timezone.utc)
+    page = running_sessions(limit=page_size, now=now)
+    while page:
+        yield from page
+        if len(page) < page_size:
+            return
+        page = running_sessions(after=page[-1], limit=page_size, now=now)
+
+
+def remaining_seconds(expires_at, is_developer=False, now=None):
+    """Seconds left on a session row (same rules as Voucher.remaining_seconds)."""
+    if is_developer:
+        return 999999999
+    if expires_at is None:
+        return 0
+    now = now or datetime.now(timezone.utc)
+    return max(0, int(_as_utc_timestamp(expires_at) - now.timestamp()))
+
+
+def _as_utc_timestamp(value):
+    # SQLite hands datetimes back naive; they are stored in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+
+class ExpiryScheduler:
+    """Runs the expiry sweep exactly when the next voucher runs out.
+
+    Keeps a min-heap of (deadline, voucher_id) and sleeps until the earliest
+    one instead of polling. Rescheduling or cancelling a voucher just records
+    its new deadline; superseded heap entries are skipped when they surface.
+    With nothing scheduled the thread blocks without waking up at all.
+    """
+    retry_delay = 15  # seconds before retrying a sweep that left vouchers connected
+
+    def __init__(self):
+        self._heap = []
+        self._deadlines = {}
+        self._cond = threading.Condition()
+        self._thread = None
+        self._job = None
+        self._stopped = False
+
+    def start(self, job, deadlines=()):
+        """Start the scheduler thread.
+
+        job: zero-argument callable that runs the sweep and returns False if
+             some expired vouchers are still connected.
+        deadlines: iterable of (voucher_id, expires_at) to seed the heap with.
+        """
+        with self._cond:
+            self._job = job
+            for voucher_id, expires_at in deadlines:
+                self._push(voucher_id, expires_at)
+            if self._thread is None:
+                self._stopped = False
+                self._thread = threading.Thread(target=self._run, name='expiry-scheduler', daemon=True)
+                self._thread.start()
+            self._cond.notify()
+
+    def stop(self):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+
+    def schedule(self, voucher_id, expires_at):
+        """Add or move a voucher's deadline."""
+        if voucher_id is None or expires_at is None:
+            return
+        with self._cond:
+            earliest = self._heap[0][0] if self._heap else None
+            deadline = self._push(voucher_id, expires_at)
+            if earliest is None or deadline < earliest:
+                self._cond.notify()
+
+    def cancel(self, voucher_id):
+        """Forget a voucher's deadline (ended early, revoked, or already swept)."""
+        with self._cond:
+            self._deadlines.pop(voucher_id, None)
+
+    def next_deadline(self):
+        with self._cond:
+            self._drop_stale()
+            return self._heap[0][0] if self._heap else None
+
+    def _push(self, voucher_id, expires_at):
+        deadline = _as_utc_timestamp(expires_at)
+        self._deadlines[voucher_id] = deadline
+        heapq.heappush(self._heap, (deadline, voucher_id))
+        return deadline
+
+    def _drop_stale(self):
+        while self._heap and self._deadlines.get(self._heap[0][1]) != self._heap[0][0]:
+            heapq.heappop(self._heap)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    self._drop_stale()
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    delay = self._heap[0][0] - time.time()
+                    if delay <= 0:
+                        break
+                    self._cond.wait(delay)
+
+                # Everything due now is handled by a single sweep
+                now = time.time()
+                due = []
+                while self._heap and self._heap[0][0] <= now:
+                    deadline, voucher_id = heapq.heappop(self._heap)
+                    if self._deadlines.get(voucher_id) == deadline:
+                        del self._deadlines[voucher_id]
+                        due.append(voucher_id)
+                job = self._job
+
+            if not due:
+                continue
+            try:
+                complete = job()
+            except Exception as e:
+                print(f"[SCHEDULER] Expiry sweep failed: {str(e)}")
+                complete = False
+            if complete is False:
+                # Router unreachable or partial failure: try these again shortly
+                retry_at = datetime.fromtimestamp(time.time() + self.retry_delay, timezone.utc)
+                for voucher_id in due:
+                    self.schedule(voucher_id, retry_at)
+
+
+def pending_deadlines():
+    """(voucher_id, expires_at) for every connected voucher that will expire."""
+    return db.session.query(Voucher.id, Voucher.expires_at).filter(
+        Voucher.expires_at != None,
+        Voucher.user_mac_address != None,
+        Voucher.is_developer == False
+    ).all()
+
+
+expiry_scheduler = ExpiryScheduler()
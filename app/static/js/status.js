@@ -16,51 +16,127 @@ function formatTime(seconds) {
   return parts.join(' ');
 }
 
-// Poll API to update remaining seconds
+// Poll interval when the server has no stream slot free (or EventSource is missing).
+// Only STATUS_STREAM_LIMIT pages get pushed updates (3 with the default 8 server
+// threads); every other open status page refreshes at this rate.
+const STATUS_POLL_MS = 30000;
+
+// Messages for the reasons the server gives when it ends a session early
+const END_REASONS = {
+  data_limit: 'Your data allowance is used up. Please get a new voucher.',
+  revoked: 'Your internet access was ended by the staff.',
+  ended: 'Your session has ended.',
+  removed: 'This voucher no longer exists.'
+};
+
+// Count down locally; the server pushes the expiry once and then only changes
 function initializeStatusPage(code, isDeveloper) {
   const countdownEl = document.getElementById('countdown');
   const expiryEl = document.getElementById('expiry');
   let lastWarnedAt = 0;
   let sessionExpiredNotified = false;
+  let deadline = null;  // performance.now() when the time runs out (immune to a wrong phone clock)
+
+  function render() {
+    if (deadline === null) return;
+    const secs = Math.max(0, Math.ceil((deadline - performance.now()) / 1000));
+    countdownEl.textContent = formatTime(secs);
+
+    // Show warnings as time runs out
+    if (secs > 0) {
+      if (secs <= 60 && Date.now() - lastWarnedAt > 30000) {
+        notifyWarning('Time Running Out', `Only ${formatTime(secs)} left!`);
+        lastWarnedAt = Date.now();
+      }
 
+      // Update UI
+      countdownEl.classList.remove('text-red-600');
+      countdownEl.classList.add('text-green-600');
+      sessionExpiredNotified = false;
+    } else {
+      // Session expired
+      if (!sessionExpiredNotified) {
+        notifyError('Session Expired', 'Your internet access has ended. Please get a new voucher.');
+        sessionExpiredNotified = true;
+      }
+      countdownEl.classList.remove('text-green-600');
+      countdownEl.classList.add('text-red-600');
+    }
+  }
+
+  function applyStatus(data) {
+    // Access taken away early: the time left on the voucher no longer counts
+    const remaining = END_REASONS[data.reason] ? 0 : (data.remaining_seconds || 0);
+    deadline = performance.now() + remaining * 1000;
+    if (data.expiry_time) expiryEl.textContent = 'Expires: ' + new Date(data.expiry_time).toLocaleString();
+    if (END_REASONS[data.reason] && !sessionExpiredNotified) {
+      notifyError('Session Ended', END_REASONS[data.reason]);
+      sessionExpiredNotified = true;
+    }
+    render();
+  }
+
+  // The body may be a cached copy (revalidated with a 304), so the time left is worked out
+  // from the absolute expiry and the server's clock (Date header), not remaining_seconds
   function fetchStatus() {
-    // Skip polling for developer codes
-    if (isDeveloper) return;
-    
-    fetch(`/api/status/${code}`)
-      .then(r => r.json())
-      .then(data => {
-        const secs = data.remaining_seconds || 0;
-        countdownEl.textContent = formatTime(secs);
-        if (data.expiry_time) expiryEl.textContent = 'Expires: ' + new Date(data.expiry_time).toLocaleString();
-        
-        // Show warnings as time runs out
-        if (secs > 0) {
-          if (secs <= 60 && Date.now() - lastWarnedAt > 30000) {
-            notifyWarning('Time Running Out', `Only ${formatTime(secs)} left!`);
-            lastWarnedAt = Date.now();
-          }
-          
-          // Update UI
-          countdownEl.classList.remove('text-red-600');
-          countdownEl.classList.add('text-green-600');
-          sessionExpiredNotified = false;
-        } else {
-          // Session expired
-          if (!sessionExpiredNotified) {
-            notifyError('Session Expired', 'Your internet access has ended. Please get a new voucher.');
-            sessionExpiredNotified = true;
+    fetch(`/api/status/${code}`, { cache: 'no-cache' })
+      .then(r => {
+        const serverNow = Date.parse(r.headers.get('Date')) || Date.now();
+        return r.json().then(data => {
+          if (data.expiry_time) {
+            data.remaining_seconds = Math.max(0, Math.round((Date.parse(data.expiry_time) - serverNow) / 1000));
           }
-          countdownEl.classList.remove('text-green-600');
-          countdownEl.classList.add('text-red-600');
-        }
+          applyStatus(data);
+        });
       })
       .catch(err => console.error('status fetch error', err));
   }
 
-  // Start polling every 2 seconds (only for non-developer codes)
-  if (!isDeveloper) {
+  function startPolling() {
     fetchStatus();
-    setInterval(fetchStatus, 2000);
+    setInterval(fetchStatus, STATUS_POLL_MS);
   }
+
+  // Developer codes don't expire, nothing to follow
+  if (!isDeveloper) {
+    setInterval(render, 1000);
+    if ('EventSource' in window) {
+      const source = new EventSource(`/api/status/${code}/events`);
+      ['status', 'activated', 'expired', 'revoked', 'ended', 'updated', 'removed'].forEach(name => {
+        source.addEventListener(name, e => applyStatus(JSON.parse(e.data)));
+      });
+      // CLOSED means the server refused the stream (no free slot); a dropped stream reconnects by itself
+      source.onerror = () => {
+        if (source.readyState === EventSource.CLOSED) startPolling();
+      };
+    } else {
+      startPolling();
+    }
+  }
+
+  watchActivation(code);
+}
+
+// Follow the queued router authorization until it completes or gives up
+function watchActivation(code) {
+  let notifiedRetry = false;
+
+  function check() {
+    fetch(`/api/activation/${code}`, { cache: 'no-store' })
+      .then(r => r.json())
+      .then(job => {
+        if (job.status === 'pending' || job.status === 'running') {
+          if (job.attempts > 1 && !notifiedRetry) {
+            notifyWarning('Still Connecting', 'The router is slow to respond, retrying...');
+            notifiedRetry = true;
+          }
+          setTimeout(check, 1000);
+        } else if (job.status === 'failed') {
+          notifyError('Connection Problem', 'Your time is saved but the router did not respond. Please ask the staff for help.');
+        }
+      })
+      .catch(() => setTimeout(check, 3000));
+  }
+
+  check();
 }
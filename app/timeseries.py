@@ -0,0 +1,300 @@
+# app/timeseries.py
+"""Bandwidth history for the WAN interface and every simple queue.
+
+Byte counters are sampled every TRAFFIC_SAMPLE_INTERVAL seconds (10 by
+default). Recent raw samples live in fixed-size in-memory rings; finished minutes are written
+to the traffic_history table and rolled up into hourly and daily buckets in
+the same statement, so no separate downsampling pass is needed.
+"""
+import os
+import threading
+import time
+from array import array
+
+from sqlalchemy import text
+
+from . import db
+from .utils import get_pooled_api, _split_pair, counter_delta, to_int
+
+# Bucket size in seconds for each stored resolution
+RESOLUTIONS = {'1m': 60, '1h': 3600, '1d': 86400}
+
+# How long each resolution is kept in the database (seconds)
+RETENTION = {'1m': 2 * 86400, '1h': 90 * 86400, '1d': 5 * 365 * 86400}
+
+_UPSERT = text(
+    "INSERT INTO traffic_history (series, resolution, bucket, rx_bytes, tx_bytes) "
+    "VALUES (:series, :resolution, :bucket, :rx, :tx) "
+    "ON CONFLICT (series, resolution, bucket) DO UPDATE SET "
+    "rx_bytes = rx_bytes + excluded.rx_bytes, tx_bytes = tx_bytes + excluded.tx_bytes"
+)
+
+
+class RingSeries:
+    """Fixed number of (timestamp, rx, tx) samples; the oldest is overwritten."""
+    __slots__ = ('times', 'rx', 'tx', 'pos', 'count')
+
+    def __init__(self, capacity):
+        self.times = array('d', bytes(8 * capacity))
+        self.rx = array('Q', bytes(8 * capacity))
+        self.tx = array('Q', bytes(8 * capacity))
+        self.pos = 0
+        self.count = 0
+
+    def append(self, timestamp, rx, tx):
+        self.times[self.pos] = timestamp
+        self.rx[self.pos] = rx
+        self.tx[self.pos] = tx
+        self.pos = (self.pos + 1) % len(self.times)
+        self.count = min(self.count + 1, len(self.times))
+
+    @property
+    def last_time(self):
+        return self.times[self.pos - 1] if self.count else 0
+
+    def points(self, since=0, until=None):
+        capacity = len(self.times)
+        start = (self.pos - self.count) % capacity
+        out = []
+        for i in range(self.count):
+            j = (start + i) % capacity
+            if self.times[j] >= since and (until is None or self.times[j] <= until):
+                out.append((self.times[j], self.rx[j], self.tx[j]))
+        return out
+
+
+class TrafficStore:
+    """Counter deltas in memory at sample resolution, rolled up to 1m/1h/1d in SQLite.
+
+    Memory is bounded by ring_size samples per live series; series that stop
+    reporting (queue removed) are dropped once their ring has aged out.
+    """
+    prune_every = 3600
+
+    def __init__(self, step=10, ring_size=360):
+        self.step = step
+        self.ring_size = ring_size
+        self._rings = {}
+        self._counters = {}
+        self._minutes = {}  # (series, minute start) -> [rx, tx] not yet in the database
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stopped = threading.Event()
+        self._last_prune = 0
+
+    @property
+    def enabled(self):
+        return self.step > 0
+
+    # ============ RECORDING ============
+
+    def record(self, counters, now=None):
+        """Feed cumulative byte counters {series: (rx_total, tx_total)} read at `now`."""
+        now = now or time.time()
+        minute = int(now // 60 * 60)
+        with self._lock:
+            for series, (rx_total, tx_total) in counters.items():
+                previous = self._counters.get(series)
+                self._counters[series] = (rx_total, tx_total)
+                if previous is None:
+                    continue
+                rx, tx = counter_delta(previous[0], rx_total), counter_delta(previous[1], tx_total)
+                ring = self._rings.get(series)
+                if ring is None:
+                    ring = self._rings[series] = RingSeries(self.ring_size)
+                ring.append(now, rx, tx)
+                pending = self._minutes.setdefault((series, minute), [0, 0])
+                pending[0] += rx
+                pending[1] += tx
+
+            horizon = now - self.ring_size * self.step
+            for series in [s for s, ring in self._rings.items() if ring.last_time < horizon]:
+                del self._rings[series]
+            for series in [s for s in self._counters if s not in counters and s not in self._rings]:
+                del self._counters[series]
+
+    def flush(self, now=None):
+        """Write finished minutes to the database, adding them to their 1m/1h/1d buckets."""
+        current_minute = int((now or time.time()) // 60 * 60)
+        with self._lock:
+            closed = {key: value for key, value in self._minutes.items() if key[1] < current_minute}
+            for key in closed:
+                del self._minutes[key]
+        if not closed:
+            return 0
+
+        # Several minutes land in the same hour/day; add them up before writing
+        buckets = {}
+        for (series, minute), (rx, tx) in closed.items():
+            for resolution, size in RESOLUTIONS.items():
+                total = buckets.setdefault((series, resolution, minute - minute % size), [0, 0])
+                total[0] += rx
+                total[1] += tx
+        rows = [{'series': series, 'resolution': resolution, 'bucket': bucket, 'rx': rx, 'tx': tx}
+                for (series, resolution, bucket), (rx, tx) in buckets.items()]
+        try:
+            db.session.execute(_UPSERT, rows)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"[TRAFFIC] Failed to write traffic history, will retry: {str(e)}")
+            with self._lock:
+                for key, (rx, tx) in closed.items():
+                    pending = self._minutes.setdefault(key, [0, 0])
+                    pending[0] += rx
+                    pending[1] += tx
+            return 0
+        return len(closed)
+
+    def prune(self, now=None):
+        """Delete buckets older than their resolution's retention."""
+        now = int(now or time.time())
+        deleted = 0
+        for resolution, keep in RETENTION.items():
+            deleted += db.session.execute(
+                text("DELETE FROM traffic_history WHERE resolution = :resolution AND bucket < :cutoff"),
+                {'resolution': resolution, 'cutoff': now - keep}).rowcount or 0
+        db.session.commit()
+        self._last_prune = now
+        return deleted
+
+    # ============ QUERIES ============
+
+    def query(self, series, resolution='1m', since=None, until=None):
+        """Points for one series, oldest first.
+
+        resolution is 'raw' (in-memory samples, one per step) or one of
+        RESOLUTIONS. Each point is {'t', 'rx_bytes', 'tx_bytes', 'rx_bps', 'tx_bps'}
+        with t the bucket start in unix seconds.
+        """
+        until = until or time.time()
+        if resolution == 'raw':
+            since = since or until - self.ring_size * self.step
+            with self._lock:
+                ring = self._rings.get(series)
+                samples = ring.points(since, until) if ring else []
+            return [self._point(int(t), rx, tx, self.step) for t, rx, tx in samples]
+
+        size = RESOLUTIONS[resolution]
+        since = since or until - 360 * size
+        totals = {}
+        rows = db.session.execute(
+            text("SELECT bucket, rx_bytes, tx_bytes FROM traffic_history "
+                 "WHERE series = :series AND resolution = :resolution AND bucket >= :since AND bucket <= :until "
+                 "ORDER BY bucket"),
+            {'series': series, 'resolution': resolution,
+             'since': int(since - since % size), 'until': int(until)})
+        for bucket, rx, tx in rows:
+            totals[bucket] = [rx, tx]
+        # The current minute is still in memory
+        with self._lock:
+            for (name, minute), (rx, tx) in self._minutes.items():
+                if name == series and since - size < minute <= until:
+                    total = totals.setdefault(minute - minute % size, [0, 0])
+                    total[0] += rx
+                    total[1] += tx
+        return [self._point(bucket, rx, tx, size) for bucket, (rx, tx) in sorted(totals.items())]
+
+    def top_series(self, since, until=None, limit=10, prefix='queue:'):
+        """Series that moved the most bytes between since and until: [(series, rx, tx)], largest first."""
+        until = until or time.time()
+        resolution = '1m' if since >= time.time() - RETENTION['1m'] else '1h'
+        rows = db.session.execute(
+            text("SELECT series, SUM(rx_bytes), SUM(tx_bytes) FROM traffic_history "
+                 "WHERE resolution = :resolution AND series LIKE :prefix AND bucket >= :since AND bucket <= :until "
+                 "GROUP BY series"),
+            {'resolution': resolution, 'prefix': f"{prefix}%", 'since': int(since), 'until': int(until)})
+        totals = {series: [rx or 0, tx or 0] for series, rx, tx in rows}
+        with self._lock:
+            for (series, minute), (rx, tx) in self._minutes.items():
+                if series.startswith(prefix) and since <= minute <= until:
+                    total = totals.setdefault(series, [0, 0])
+                    total[0] += rx
+                    total[1] += tx
+        ranked = sorted(totals.items(), key=lambda item: item[1][0] + item[1][1], reverse=True)
+        return [(series, rx, tx) for series, (rx, tx) in ranked[:limit]]
+
+    def series_names(self):
+        with self._lock:
+            names = set(self._rings)
+        names.update(row[0] for row in db.session.execute(text("SELECT DISTINCT series FROM traffic_history")))
+        return sorted(names)
+
+    @staticmethod
+    def _point(t, rx, tx, seconds):
+        return {'t': t, 'rx_bytes': rx, 'tx_bytes': tx,
+                'rx_bps': int(rx * 8 / seconds), 'tx_bps': int(tx * 8 / seconds)}
+
+    # ============ SAMPLER ============
+
+    def start(self, app):
+        if not self.enabled or self._thread is not None:
+            return
+        self._app = app
+        self._thread = threading.Thread(target=self._run, name='traffic-history', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+        if self._thread is not None:
+            # Keep the minutes collected so far
+            with self._app.app_context():
+                self.flush(now=time.time() + 60)
+
+    def _run(self):
+        while not self._stopped.wait(self.step - time.time() % self.step):
+            try:
+                now = time.time()
+                self.record(read_counters(), now)
+                with self._app.app_context():
+                    self.flush(now)
+                    if now - self._last_prune >= self.prune_every:
+                        self.prune(now)
+            except Exception as e:
+                print(f"[TRAFFIC] Sampling failed: {str(e)}")
+
+
+def read_counters(interface_name=None):
+    """Cumulative byte counters for the WAN interface and every simple queue (or PCQ user).
+
+    Returns {series: (rx_bytes, tx_bytes)}; rx is download, tx is upload.
+    Queue counters come from the router mirror when it is fresh, so a sample
+    usually costs a single /interface print.
+    """
+    from .bandwidth import pcq_enabled, counter_rows
+    from .mirror import router_mirror
+
+    interface_name = interface_name or os.getenv('MIKROTIK_WAN_INTERFACE', 'ether1')
+    api_pool = get_pooled_api()
+    if not api_pool:
+        return {}
+    counters = {}
+    try:
+        api = api_pool.get_api()
+        for row in api.get_resource('/interface').call(
+                'print', {'.proplist': 'name,rx-byte,tx-byte'}, {'name': interface_name}):
+            counters[f"wan:{row.get('name')}"] = (to_int(row.get('rx-byte')), to_int(row.get('tx-byte')))
+
+        if pcq_enabled():
+            # No per-user simple queues; hotspot host counters in the same shape
+            queues = counter_rows(api)
+        else:
+            snap = router_mirror.fresh_snapshot()
+            queues = snap.queues if snap is not None else \
+                api.get_resource('/queue/simple').call('print', {'.proplist': 'name,bytes'})
+        for row in queues:
+            if row.get('name'):
+                # Simple queue counters are upload/download from the target's side
+                upload, download = _split_pair(row, 'bytes')
+                counters[f"queue:{row['name']}"] = (to_int(download), to_int(upload))
+    except Exception as e:
+        print(f"[TRAFFIC] Error reading counters: {str(e)}")
+    finally:
+        api_pool.release()
+    return counters
+
+
+traffic_store = TrafficStore(
+    step=int(os.environ.get('TRAFFIC_SAMPLE_INTERVAL', 10)),
+    ring_size=int(os.environ.get('TRAFFIC_RING_SIZE', 360)),
+)
@@ -0,0 +1,130 @@
+# app/traffic_feed.py
+"""Live per-user traffic for the admin bandwidth page.
+
+One poller thread reads the active users and their queue counters on a
+single pooled session every TRAFFIC_STREAM_INTERVAL seconds, turns the byte
+counter deltas into per-MAC rates and publishes the table to every open
+admin stream. It runs only while someone is watching, so router load is one
+read per interval however many tabs are open. Each read also refreshes the
+active-user and user-traffic caches, so other pages served meanwhile don't
+query the router again.
+"""
+import os
+import threading
+import time
+
+from .events import traffic_events
+from .utils import counter_delta, to_int
+
+TOPIC = 'users'
+
+
+def format_user_traffic(users):
+    """Active users with traffic (get_mikrotik_active_users_with_traffic rows) as sent to the page."""
+    from .utils import format_bytes
+
+    return [{
+        'user': user.get('user', 'Unknown'),
+        'mac': user.get('mac', ''),
+        'uptime': user.get('uptime', '0s'),
+        'bytes_in': user.get('bytes_in', 0),
+        'bytes_out': user.get('bytes_out', 0),
+        'bytes_in_formatted': format_bytes(user.get('bytes_in', 0)),
+        'bytes_out_formatted': format_bytes(user.get('bytes_out', 0)),
+        'queue_bytes_in': user.get('queue_bytes_in', 0),
+        'queue_bytes_out': user.get('queue_bytes_out', 0),
+        'queue_bytes_in_formatted': format_bytes(user.get('queue_bytes_in', 0)),
+        'queue_bytes_out_formatted': format_bytes(user.get('queue_bytes_out', 0)),
+        'rate_in': user.get('rate_in', '0'),
+        'rate_out': user.get('rate_out', '0'),
+        'max_limit': user.get('max_limit', 'Unlimited')
+    } for user in users]
+
+
+class TrafficFeed:
+    """Shared poller behind the admin traffic streams (see the module docstring)."""
+    def __init__(self, hub, interval=1.0):
+        self.hub = hub
+        self.interval = interval
+        self.latest = None  # (monotonic time, rows) of the last publish
+        self._last = {}  # (MAC, counter) -> (monotonic time, bytes in, bytes out)
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def subscribe(self, app):
+        """A Subscription to the feed (None when the stream limit is reached); starts the poller."""
+        subscription = self.hub.subscribe(TOPIC)
+        if subscription is None:
+            return None
+        with self._lock:
+            if self._thread is None:
+                self._app = app
+                self._thread = threading.Thread(target=self._run, name='traffic-feed', daemon=True)
+                self._thread.start()
+        return subscription
+
+    def snapshot(self):
+        """The last published rows if they are still current, else None."""
+        latest = self.latest
+        if latest is None or time.monotonic() - latest[0] > max(2 * self.interval, 5):
+            return None
+        return latest[1]
+
+    def rates(self, users, now=None):
+        """Add bps_in / bps_out to each formatted row from the counters' change since the last read."""
+        now = time.monotonic() if now is None else now
+        seen = {}
+        for user in users:
+            # Queue counters when the user has a queue, else the hotspot session's
+            prefix = 'queue_' if user['queue_bytes_in'] or user['queue_bytes_out'] else ''
+            key = (user['mac'].upper(), prefix)
+            bytes_in, bytes_out = to_int(user[f"{prefix}bytes_in"]), to_int(user[f"{prefix}bytes_out"])
+            seen[key] = (now, bytes_in, bytes_out)
+
+            previous = self._last.get(key)
+            elapsed = now - previous[0] if previous else 0
+            if elapsed > 0:
+                user['bps_in'] = int(counter_delta(previous[1], bytes_in) * 8 / elapsed)
+                user['bps_out'] = int(counter_delta(previous[2], bytes_out) * 8 / elapsed)
+            else:
+                # First sight of this user: the router's own average until the next read
+                user['bps_in'] = to_int(user['rate_in'])
+                user['bps_out'] = to_int(user['rate_out'])
+        self._last = seen
+        return users
+
+    def poll(self):
+        """One read and publish. Returns the rows, or None if the router couldn't be read."""
+        from .utils import read_active_users_with_traffic
+
+        try:
+            users = read_active_users_with_traffic()
+        except Exception as e:
+            print(f"[TRAFFIC] Live feed read failed: {str(e)}")
+            users = None
+        if users is None:
+            self.latest = None
+            self.hub.publish(TOPIC, 'offline', {'error': 'Cannot connect to MikroTik API'})
+            return None
+        rows = self.rates(format_user_traffic(users))
+        self.latest = (time.monotonic(), rows)
+        self.hub.publish(TOPIC, 'traffic', {'users': rows})
+        return rows
+
+    def _run(self):
+        print("[TRAFFIC] Live feed started")
+        while True:
+            with self._lock:
+                if not self.hub.has_subscribers(TOPIC):
+                    # Subscribers check under the same lock, so none can be left without a poller
+                    self._thread = None
+                    self._last = {}
+                    print("[TRAFFIC] Live feed stopped (no viewers)")
+                    return
+            started = time.monotonic()
+            with self._app.app_context():
+                self.poll()
+            time.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+
+traffic_feed = TrafficFeed(traffic_events, interval=float(os.environ.get('TRAFFIC_STREAM_INTERVAL', 1)))
@@ -1,8 +1,10 @@
 # app/utils.py
 import os
+import re
 import time
+import atexit
 import threading
-from functools import wraps
+from .cache import TTLCache
 
 # Try to import routeros_api, but make it optional
 try:
@@ -12,6 +14,11 @@ except ImportError:
     ROUTEROS_AVAILABLE = False
     print("[WARNING] routeros_api not available. MikroTik API will be mocked.")
 
+# Comments that mark router entries created by this app (see app/reconcile.py)
+BINDING_COMMENT = 'PisoNet access'
+QUEUE_COMMENT = 'PisoNet bandwidth control'
+UNLIMITED = 'unlimited'  # voucher rate_limit_up/down after an admin removed the user's limit
+
 # ============ CACHING & PERFORMANCE ============
 
 def _debug(msg: str):
@@ -21,69 +28,235 @@ def _debug(msg: str):
             print(msg)
     except Exception:
         pass
-class CachedValue:
-    """Simple TTL cache."""
-    def __init__(self, ttl_seconds=5):
-        self.ttl = ttl_seconds
-        self.data = None
-        self.timestamp = 0
-    
-    def get(self):
-        """Return cached value if not expired, else None."""
-        if time.time() - self.timestamp < self.ttl:
-            return self.data
-        return None
-    
-    def set(self, value):
-        """Store value with current timestamp."""
-        self.data = value
-        self.timestamp = time.time()
-
-# Global cache for API calls (TTL = 5 seconds)
-_cache_system_stats = CachedValue(ttl_seconds=5)
-_cache_active_users = CachedValue(ttl_seconds=5)
-_cache_health = CachedValue(ttl_seconds=10)
-_cache_traffic = {}  # Per-interface cache
-
-def cache_result(cache_obj, ttl=5):
-    """Decorator to cache function results with TTL."""
-    cache_obj.ttl = ttl
-    def decorator(func):
-        @wraps(func)
-        def wrapper(*args, **kwargs):
-            cached = cache_obj.get()
-            if cached is not None:
-                return cached
-            result = func(*args, **kwargs)
-            cache_obj.set(result)
-            return result
-        return wrapper
-    return decorator
+
+# Router reads shared by every request thread: one load per key at a time,
+# stale values served briefly while they refresh (see app/cache.py)
+_cache_system_stats = TTLCache('system_stats', ttl=5, stale_ttl=25, max_entries=1)
+_cache_active_users = TTLCache('active_users', ttl=5, stale_ttl=10, max_entries=1)
+_cache_health = TTLCache('health', ttl=10, stale_ttl=50, max_entries=1)
+_cache_traffic = TTLCache('interface_traffic', ttl=2, stale_ttl=3, max_entries=16)  # per interface
+_cache_user_traffic = TTLCache('user_traffic', ttl=2, stale_ttl=3, max_entries=256)  # per MAC, None = all
 
 # ============ GLOBAL CONNECTION POOL (REUSE) ============
-_api_pool_instance = None
-_pool_lock = threading.Lock()
 
-def get_pooled_api():
-    """Get or create a reusable API connection pool."""
-    global _api_pool_instance
-    if _api_pool_instance is not None:
+class _PooledConnection:
+    """One authenticated RouterOS session owned by the pool."""
+    def __init__(self, api_pool):
+        self.api_pool = api_pool
+        self.created_at = time.monotonic()
+        self.last_used = self.created_at
+
+    @property
+    def is_connected(self):
+        # routeros_api flips `connected` off when it sees a socket/fatal error
+        return bool(getattr(self.api_pool, 'connected', False))
+
+    def close(self):
         try:
-            # Test if connection is still alive
-            api = _api_pool_instance.get_api()
-            api.get_resource('/system/identity').get()
-            return _api_pool_instance
+            self.api_pool.disconnect()
+        except Exception:
+            pass
+
+
+class PooledApi:
+    """Lease on a pooled connection.
+
+    Exposes the same get_api() as RouterOsApiPool so helpers can take either,
+    but release() hands the session back to the pool instead of closing it.
+    """
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+        self._released = False
+
+    def get_api(self):
+        return self._conn.api_pool.get_api()
+
+    def release(self, discard=False):
+        """Return the session to the pool (or drop it if discard=True). Idempotent."""
+        if self._released:
+            return
+        self._released = True
+        self._pool.release(self._conn, discard=discard)
+
+    def close(self):
+        """Close the session and drop it from the pool, e.g. after a reboot. Idempotent."""
+        self._conn.close()
+        self.release(discard=True)
+
+
+class MikrotikConnectionPool:
+    """Bounded, thread-safe pool of authenticated RouterOS API sessions.
+
+    - At most `max_size` sessions exist at once; extra callers wait up to
+      `acquire_timeout` seconds for a checkin.
+    - Sessions idle longer than `health_check_after` are pinged before reuse.
+    - Sessions older than `max_lifetime` are closed and replaced.
+    - routeros_api connections are not safe for concurrent use, so each session
+      is checked out by one thread at a time. A thread that already holds a
+      session gets the same one back for nested calls instead of a second one.
+    """
+    def __init__(self, factory, max_size=3, acquire_timeout=10, health_check_after=30,
+                 max_lifetime=600, connect_cooldown=5):
+        self.factory = factory
+        self.max_size = max(1, int(max_size))
+        self.acquire_timeout = acquire_timeout
+        self.health_check_after = health_check_after
+        self.max_lifetime = max_lifetime
+        self.connect_cooldown = connect_cooldown
+        self._idle = []          # LIFO stack so the warmest session is reused first
+        self._size = 0           # idle + checked out
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        self._connect_failed_until = 0
+
+    def acquire(self):
+        """Check out a session. Returns a PooledApi lease, or None if the router is unreachable."""
+        held = getattr(self._local, 'conn', None)
+        if held is not None:
+            self._local.depth += 1
+            return PooledApi(self, held)
+
+        deadline = time.monotonic() + self.acquire_timeout
+        while True:
+            conn = None
+            create = False
+            with self._cond:
+                while conn is None and not create:
+                    if self._idle:
+                        conn = self._idle.pop()
+                    elif self._size < self.max_size:
+                        if time.monotonic() < self._connect_failed_until:
+                            # Router was unreachable a moment ago; don't stack up connect timeouts
+                            return None
+                        self._size += 1
+                        create = True
+                    else:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            print("[MIKROTIK] Connection pool exhausted, giving up waiting for a free session")
+                            return None
+                        self._cond.wait(remaining)
+
+            if create:
+                conn = self._connect()
+                if conn is None:
+                    return None
+            elif not self._is_usable(conn):
+                self._discard(conn)
+                continue
+
+            self._local.conn = conn
+            self._local.depth = 1
+            return PooledApi(self, conn)
+
+    def release(self, conn, discard=False):
+        """Check a session back in. Broken, expired or discarded sessions are closed."""
+        if getattr(self._local, 'conn', None) is conn:
+            self._local.depth -= 1
+            if self._local.depth > 0:
+                return
+            self._local.conn = None
+
+        now = time.monotonic()
+        if discard or not conn.is_connected or now - conn.created_at > self.max_lifetime:
+            self._discard(conn)
+            return
+        conn.last_used = now
+        with self._cond:
+            self._idle.append(conn)
+            self._cond.notify()
+
+    def clear(self):
+        """Close every idle session, e.g. after the router was rebooted."""
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            conn.close()
+
+    def stats(self):
+        with self._cond:
+            return {'size': self._size, 'idle': len(self._idle), 'max_size': self.max_size}
+
+    def _connect(self):
+        api_pool = None
+        try:
+            api_pool = self.factory()
         except Exception as e:
-            _debug(f"[DEBUG] Pooled connection failed, reconnecting: {str(e)[:100]}")
-            _api_pool_instance = None
-    
-    # Create new connection
-    return get_mikrotik_api()
+            print(f"[MIKROTIK] Connection error: {str(e)}")
+        if api_pool is None:
+            with self._cond:
+                self._size -= 1
+                self._connect_failed_until = time.monotonic() + self.connect_cooldown
+                self._cond.notify()
+            return None
+        return _PooledConnection(api_pool)
+
+    def _is_usable(self, conn):
+        now = time.monotonic()
+        if not conn.is_connected or now - conn.created_at > self.max_lifetime:
+            return False
+        if now - conn.last_used > self.health_check_after:
+            try:
+                conn.api_pool.get_api().get_resource('/system/identity').get()
+            except Exception as e:
+                _debug(f"[DEBUG] Pooled connection failed health check, reconnecting: {str(e)[:100]}")
+                return False
+        return True
+
+    def _discard(self, conn):
+        conn.close()
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+
+_connection_pool = None
+_pool_lock = threading.Lock()
+
+def get_connection_pool():
+    """Return the process-wide RouterOS connection pool, creating it on first use."""
+    global _connection_pool
+    if _connection_pool is None:
+        with _pool_lock:
+            if _connection_pool is None:
+                _connection_pool = MikrotikConnectionPool(
+                    get_mikrotik_api,
+                    max_size=int(os.getenv('MIKROTIK_POOL_SIZE', 3)),
+                    acquire_timeout=float(os.getenv('MIKROTIK_POOL_TIMEOUT', 10)),
+                    health_check_after=float(os.getenv('MIKROTIK_POOL_IDLE_CHECK', 30)),
+                    max_lifetime=float(os.getenv('MIKROTIK_POOL_MAX_LIFETIME', 600)),
+                )
+                atexit.register(_connection_pool.clear)
+    return _connection_pool
+
+def get_pooled_api():
+    """Check out a session from the shared connection pool.
+    Returns a PooledApi lease (call release() when done), or None if the router is unreachable.
+    """
+    if not ROUTEROS_AVAILABLE:
+        return None
+    return get_connection_pool().acquire()
+
+def _router_read(fetch):
+    """fetch(api) on a pooled session (this thread's own if it holds one).
+    Returns None when the router can't be reached; errors from fetch propagate.
+    """
+    api_pool = get_pooled_api()
+    if not api_pool:
+        return None
+    try:
+        return fetch(api_pool.get_api())
+    finally:
+        api_pool.release()
 
 def get_mikrotik_api():
     """Connect to MikroTik RouterOS API.
     Prefers Flask app config if available; falls back to environment variables.
-    Includes timeout and connection pooling for better performance.
+    Returns a connected, logged-in RouterOsApiPool. Most callers should use
+    get_pooled_api() instead, which reuses these connections.
     """
     if not ROUTEROS_AVAILABLE:
         return None
@@ -95,6 +268,7 @@ def get_mikrotik_api():
         password = None
         port = None
         use_ssl = None
+        ssl_verify = None
         socket_timeout = 15  # Default socket timeout (seconds)
 
         try:
@@ -106,6 +280,7 @@ def get_mikrotik_api():
                 password = cfg.get('MIKROTIK_PASSWORD')
                 port = cfg.get('MIKROTIK_PORT')
                 use_ssl = cfg.get('MIKROTIK_USE_SSL')
+                ssl_verify = cfg.get('MIKROTIK_SSL_VERIFY')
         except Exception:
             # Not in a Flask context; will use env vars
             pass
@@ -118,6 +293,8 @@ def get_mikrotik_api():
         use_ssl = bool(use_ssl) if use_ssl is not None else (os.getenv('MIKROTIK_USE_SSL', 'False').lower() == 'true')
         # Support legacy env var name MIKROTIK_TIMEOUT; map to socket timeout
         socket_timeout = int(os.getenv('MIKROTIK_TIMEOUT', os.getenv('ROUTEROS_SOCKET_TIMEOUT', 15)))
+        # RouterOS API-SSL uses a self-signed certificate unless one was installed
+        ssl_verify = bool(ssl_verify) if ssl_verify is not None else (os.getenv('MIKROTIK_SSL_VERIFY', 'False').lower() == 'true')
 
         # Strip accidental whitespace from credentials
         username = (username or '').strip()
@@ -150,6 +327,9 @@ def get_mikrotik_api():
                     "port": attempt_port,
                     "use_ssl": attempt_ssl,
                 }
+                if attempt_ssl:
+                    kwargs_base["ssl_verify"] = ssl_verify
+                    kwargs_base["ssl_verify_hostname"] = ssl_verify
                 if plaintext:
                     kwargs_base["plaintext_login"] = True
                 # Prefer socket_timeout for broader compatibility
@@ -158,6 +338,9 @@ def get_mikrotik_api():
                 except TypeError:
                     # Fallback: try without socket_timeout if unsupported
                     api = RouterOsApiPool(host, **kwargs_base)
+                    api.socket_timeout = socket_timeout
+                # RouterOsApiPool connects lazily; log in now so a failed method falls through
+                api.get_api()
                 _debug(f"[DEBUG] OK Connected successfully using: {attempt_name}")
                 return api
             except Exception as e:
@@ -169,11 +352,30 @@ def get_mikrotik_api():
         print(f"[MIKROTIK] Connection error: {str(e)}")
         return None
 
+def _system_stats_from_rows(resources, routerboard):
+    """System stats dict from /system/resource and /system/routerboard rows (None if empty)."""
+    if not resources:
+        return None
+    res = resources[0]
+    # Try to get router model name
+    model = "MikroTik Router"
+    if routerboard:
+        model = routerboard[0].get('model', 'RouterBOARD')
+    
+    return {
+        "cpu_load": res.get('cpu-load', 0),
+        "free_memory": int(res.get('free-memory', 0)),
+        "total_memory": int(res.get('total-memory', 0)),
+        "uptime": res.get('uptime', '0s'),
+        "board_name": model,
+        "version": res.get('version', 'Unknown')
+    }
+
 def get_mikrotik_system_stats(api_pool=None):
     """
     Fetch system resource usage from MikroTik (CACHED, 5s TTL).
     Args:
-        api_pool: Optional existing MikroTik API connection to reuse
+        api_pool: Optional pooled session this thread holds (the pool hands it back to the read)
     Returns: dict with cpu, memory, uptime, etc.
     Fallback: Returns mock data if connection fails.
     """
@@ -186,56 +388,21 @@ def get_mikrotik_system_stats(api_pool=None):
         "version": "Unknown"
     }
 
-    # Check cache first
-    cached = _cache_system_stats.get()
-    if cached is not None:
-        _debug("[DEBUG] System stats cache hit (5s TTL)")
-        return cached
-
-    # Use provided connection or create new one
-    connection_provided = api_pool is not None
-    if not connection_provided:
-        api_pool = get_pooled_api()  # Use pooled connection
-    
-    if not api_pool:
-        return mock_data
+    def fetch(api):
+        return _system_stats_from_rows(api.get_resource('/system/resource').get(),
+                                       api.get_resource('/system/routerboard').get()) or None
 
     try:
-        api = api_pool.get_api()
-        resources = api.get_resource('/system/resource').get()
-        routerboard = api.get_resource('/system/routerboard').get()
-        
-        if resources:
-            res = resources[0]
-            # Try to get router model name
-            model = "MikroTik Router"
-            if routerboard:
-                model = routerboard[0].get('model', 'RouterBOARD')
-            
-            result = {
-                "cpu_load": res.get('cpu-load', 0),
-                "free_memory": int(res.get('free-memory', 0)),
-                "total_memory": int(res.get('total-memory', 0)),
-                "uptime": res.get('uptime', '0s'),
-                "board_name": model,
-                "version": res.get('version', 'Unknown')
-            }
-            _cache_system_stats.set(result)  # Cache result
+        result = _cache_system_stats.get_or_load(None, lambda: _router_read(fetch))
+        if result:
             return result
     except Exception as e:
         print(f"[MIKROTIK] Error fetching system stats: {e}")
-    finally:
-        # Only disconnect if we created the connection
-        if not connection_provided:
-            try:
-                api_pool.disconnect()
-            except: pass
-        
     return mock_data
 
 def mikrotik_allow_mac(mac_address, duration_seconds):
     """Authorize a MAC for hotspot: use IP binding with bypassed type for immediate access."""
-    api_pool = get_mikrotik_api()
+    api_pool = get_pooled_api()
     if not api_pool:
         print(f"[MIKROTIK] Failed to connect - BLOCKING MAC {mac_address}")
         raise Exception("Cannot connect to MikroTik router. Authorization failed.")
@@ -254,25 +421,27 @@ def mikrotik_allow_mac(mac_address, duration_seconds):
             if binding and isinstance(binding, list) and binding:
                 binding_id = binding[0].get('id') or binding[0].get('.id')
                 if binding_id:
-                    ip_bindings.set(id=binding_id, **{'type': 'bypassed', 'server': hotspot_server})
+                    ip_bindings.set(id=binding_id, **{'type': 'bypassed', 'server': hotspot_server, 'comment': BINDING_COMMENT})
                     print(f"[MIKROTIK] Updated binding for MAC {mac_address} to bypassed")
                 else:
                     print(f"[MIKROTIK] Warning: binding record missing id: {binding[0]}")
                     raise Exception("Binding record missing ID")
             else:
-                ip_bindings.add(**{'mac-address': mac_address, 'type': 'bypassed', 'server': hotspot_server})
+                ip_bindings.add(**{'mac-address': mac_address, 'type': 'bypassed', 'server': hotspot_server,
+                                    'comment': BINDING_COMMENT})
                 print(f"[MIKROTIK] Added bypassed binding for MAC {mac_address}")
         except Exception as e:
             print(f"[MIKROTIK] Error setting up IP binding: {str(e)}")
             raise Exception(f"Failed to set up IP binding: {str(e)}")
 
+        _router_changed()
         return True
     except Exception as e:
         print(f"[MIKROTIK] Error allowing MAC {mac_address}: {str(e)}")
         raise  # Re-raise the exception instead of returning True
     finally:
         try:
-            api_pool.disconnect()
+            api_pool.release()
         except Exception:
             pass
 
@@ -280,7 +449,7 @@ def mikrotik_revoke_mac(mac_address):
     """Revoke access for a MAC address by removing IP binding.
     Returns True if binding was found and removed, or if MAC not in RouterOS (already gone).
     """
-    api_pool = get_mikrotik_api()
+    api_pool = get_pooled_api()
     if not api_pool:
         print(f"[MIKROTIK] Failed to connect - cannot revoke MAC {mac_address}")
         return False
@@ -297,6 +466,7 @@ def mikrotik_revoke_mac(mac_address):
                 if binding_id:
                     ip_bindings.remove(id=binding_id)
                     print(f"[MIKROTIK] Revoked access for MAC {mac_address}")
+                    _router_changed()
                     return True
             # Binding not found in RouterOS - it was already removed or never existed
             # This is OK, just log and return True (consider it revoked)
@@ -310,181 +480,287 @@ def mikrotik_revoke_mac(mac_address):
         return False
     finally:
         try:
-            api_pool.disconnect()
+            api_pool.release()
         except Exception:
             pass
 
-def get_mac_from_active_session(client_ip):
-    """Get MAC address from MikroTik active hotspot sessions by client IP."""
-    api_pool = get_mikrotik_api()
-    if not api_pool:
-        return None
-    
+def _row_id(row):
+    """RouterOS item id as returned by routeros_api ('id' or '.id')."""
+    return row.get('id') or row.get('.id')
+
+def _query(resource, proplist=None, where=None):
+    """`print` filtered on the router: only matching rows and the listed columns are sent back.
+
+    proplist: property names (comma-separated string or iterable) for `.proplist`
+    where: {property: value} exact matches, sent as `?property=value` queries
+    """
+    args = {}
+    if proplist:
+        args['.proplist'] = proplist if isinstance(proplist, str) else ','.join(proplist)
+    return resource.call('print', args, where or {})
+
+def _queue_name(mac_address, name_prefix="pisonet"):
+    return f"{name_prefix}-{mac_address.replace(':', '-')}"
+
+def _remove_ids(resource, ids):
+    """Remove many items in one command; fall back to one-by-one so each id gets its own result.
+    Returns the set of ids that failed to be removed.
+    """
+    if not ids:
+        return set()
     try:
-        api = api_pool.get_api()
-        active = api.get_resource('/ip/hotspot/active')
-        sessions = active.get(**{'address': client_ip})
-        
-        if sessions and isinstance(sessions, list) and len(sessions) > 0:
-            mac = sessions[0].get('mac-address')
-            print(f"[MIKROTIK] Found active session for IP {client_ip}: MAC {mac}")
-            return mac
+        resource.remove(id=','.join(ids))
+        return set()
     except Exception as e:
-        print(f"[MIKROTIK] Error looking up active session for IP {client_ip}: {str(e)}")
-    finally:
+        _debug(f"[DEBUG] Batch remove failed, retrying individually: {str(e)[:100]}")
+    failed = set()
+    for item_id in ids:
         try:
-            api_pool.disconnect()
-        except Exception:
-            pass
-    
-    return None
+            resource.remove(id=item_id)
+        except Exception as e:
+            print(f"[MIKROTIK] Error removing {item_id}: {str(e)}")
+            failed.add(item_id)
+    return failed
+
+def _router_changed():
+    """Tell the router mirror and the read caches that their copy of the tables is out of date."""
+    from .mirror import router_mirror, forget_unknown_macs
+    router_mirror.mark_dirty()
+    forget_unknown_macs()
+    _cache_active_users.invalidate()
+    _cache_user_traffic.invalidate()
+
+def _mirror_snapshot():
+    """Recent router mirror snapshot for read-only views, or None to query the router live."""
+    from .mirror import router_mirror
+    return router_mirror.fresh_snapshot()
+
+def _collect(promises):
+    """Wait for pipelined commands. Returns {key: error message or None}."""
+    errors = {}
+    for key, promise in promises:
+        try:
+            promise.get()
+            errors.setdefault(key, None)
+        except Exception as e:
+            errors[key] = str(e)
+    return errors
 
-def get_mac_from_arp(ip_address):
-    """
-    Get MAC address from MikroTik ARP table by IP address.
+def mikrotik_bulk_apply(allow=None, revoke=(), name_prefix="pisonet"):
+    """Authorize and/or revoke many MACs over a single pooled session.
+
+    Args:
+        allow: {mac: (upload_speed, download_speed)} - give each MAC a bypassed
+               IP binding and a simple queue, or its PCQ tier with
+               BANDWIDTH_MODE=pcq (existing entries are updated)
+        revoke: iterable of MACs whose bindings and queues/tier entries are removed
+        name_prefix: Prefix for queue names
+
+    The binding and queue tables are read once. Removals go out as one command
+    per table; adds and updates are pipelined and their replies collected
+    afterwards, so the cost no longer grows with one round trip per user.
+
+    Returns:
+        dict: {'allowed': {mac: bool}, 'revoked': {mac: bool}}. A revoked MAC
+        counts as True when its binding is gone or was never on the router.
     """
-    api_pool = get_mikrotik_api()
+    allow = {mac: speeds for mac, speeds in (allow or {}).items() if mac}
+    revoke = {mac for mac in revoke if mac} - set(allow)
+    results = {'allowed': {mac: False for mac in allow}, 'revoked': {mac: False for mac in revoke}}
+    if not allow and not revoke:
+        return results
+
+    api_pool = get_pooled_api()
     if not api_pool:
-        # Fallback for development/testing when no router is connected
-        print(f"[MIKROTIK] Connection unavailable, cannot resolve ARP for {ip_address}")
-        return None
+        print(f"[MIKROTIK] Failed to connect - cannot apply {len(allow)} allow / {len(revoke)} revoke change(s)")
+        return results
 
+    from .bandwidth import pcq_enabled, apply_tiers
+
+    hotspot_server = os.getenv('MIKROTIK_HOTSPOT_SERVER', 'hotspot1')
     try:
         api = api_pool.get_api()
-        # Look up in ARP table
-        arp_entries = api.get_resource('/ip/arp').get(**{'address': ip_address})
-        
-        if arp_entries and isinstance(arp_entries, list) and len(arp_entries) > 0:
-            mac = arp_entries[0].get('mac-address')
-            print(f"[MIKROTIK] Found ARP entry for IP {ip_address}: MAC {mac}")
-            return mac
-        
-        print(f"[MIKROTIK] No ARP entry found for IP {ip_address}")
+        ip_bindings = api.get_resource('/ip/hotspot/ip-binding')
+        simple_queue = api.get_resource('/queue/simple')
+
+        wanted = {mac.upper(): mac for mac in set(allow) | revoke}
+        binding_ids = {}
+        for row in ip_bindings.call('print', {'.proplist': '.id,mac-address'}):
+            mac = wanted.get((row.get('mac-address') or '').upper())
+            if mac:
+                binding_ids.setdefault(mac, []).append(_row_id(row))
+
+        # In PCQ mode bandwidth is an address-list tier per MAC instead of a simple queue
+        pcq = pcq_enabled()
+        queue_names = {_queue_name(mac, name_prefix): mac for mac in wanted.values()}
+        queue_ids = {}
+        for row in simple_queue.call('print', {'.proplist': '.id,name'}) if not pcq else ():
+            mac = queue_names.get(row.get('name', ''))
+            if mac:
+                queue_ids.setdefault(mac, []).append(_row_id(row))
+
+        # Revoke: one remove per table
+        revoke_bindings = [i for mac in revoke for i in binding_ids.get(mac, [])]
+        failed = _remove_ids(ip_bindings, revoke_bindings)
+        # Queue removal failures are logged but don't block revoking access
+        revoke_queues = [i for mac in revoke for i in queue_ids.get(mac, [])]
+        _remove_ids(simple_queue, revoke_queues)
+        for mac in revoke:
+            results['revoked'][mac] = not failed.intersection(binding_ids.get(mac, []))
+
+        # Allow: send every add/set first, then read the replies
+        binding_promises = []
+        queue_promises = []
+        for mac, (upload_speed, download_speed) in allow.items():
+            ids = binding_ids.get(mac)
+            if ids:
+                binding_promises.append((mac, ip_bindings.call_async('set', {
+                    'id': ids[0], 'type': 'bypassed', 'server': hotspot_server, 'comment': BINDING_COMMENT})))
+            else:
+                binding_promises.append((mac, ip_bindings.call_async('add', {
+                    'mac-address': mac, 'type': 'bypassed', 'server': hotspot_server, 'comment': BINDING_COMMENT})))
+
+            if pcq:
+                continue
+            max_limit = f"{upload_speed}/{download_speed}"
+            ids = queue_ids.get(mac)
+            if ids:
+                queue_promises.append((mac, simple_queue.call_async('set', {
+                    'id': ids[0], 'max-limit': max_limit, 'target': mac, 'comment': QUEUE_COMMENT})))
+            else:
+                queue_promises.append((mac, simple_queue.call_async('add', {
+                    'name': _queue_name(mac, name_prefix), 'target': mac,
+                    'max-limit': max_limit, 'comment': QUEUE_COMMENT})))
+
+        binding_errors = _collect(binding_promises)
+        queue_errors = _collect(queue_promises)
+        if pcq:
+            queue_errors = apply_tiers(api, allow=allow, revoke=revoke, name_prefix=name_prefix)
+        for mac in allow:
+            error = binding_errors.get(mac) or queue_errors.get(mac)
+            if error:
+                print(f"[MIKROTIK] Error authorizing MAC {mac}: {error}")
+            results['allowed'][mac] = error is None
+
+        if allow or revoke_bindings or revoke_queues:
+            _router_changed()
+
+        print(f"[MIKROTIK] Bulk apply: allowed {sum(results['allowed'].values())}/{len(allow)}, "
+              f"revoked {sum(results['revoked'].values())}/{len(revoke)} MAC(s)")
+        return results
     except Exception as e:
-        print(f"[MIKROTIK] Error looking up ARP for IP {ip_address}: {str(e)}")
+        print(f"[MIKROTIK] Error applying bulk changes: {str(e)}")
+        return results
     finally:
-        try:
-            api_pool.disconnect()
-        except Exception:
-            pass
-            
-    return None
+        api_pool.release()
+
+def mikrotik_revoke_macs(mac_addresses, name_prefix="pisonet"):
+    """Revoke many MACs at once: remove their IP bindings and bandwidth queues.
+
+    Returns:
+        dict: {mac: bool} - True if revoked or not present on the router
+    """
+    return mikrotik_bulk_apply(revoke=mac_addresses, name_prefix=name_prefix)['revoked']
+
+# Columns _active_user_row() reads
+ACTIVE_USER_PROPS = 'user,mac-address,uptime,bytes-in,bytes-out,session-time-left'
+ACTIVE_PAGE_SIZE = 20
+
+def paginate(rows, offset=0, limit=ACTIVE_PAGE_SIZE):
+    """One page of a list plus its total: {'items', 'total', 'offset', 'limit'}."""
+    offset = max(0, int(offset))
+    limit = max(1, int(limit))
+    return {'items': rows[offset:offset + limit], 'total': len(rows), 'offset': offset, 'limit': limit}
+
+def _active_user_row(session):
+    return {
+        "user": session.get('user', 'Unknown'),
+        "mac": session.get('mac-address', ''),
+        "uptime": session.get('uptime', '0s'),
+        "bytes_in": int(session.get('bytes-in', 0)),
+        "bytes_out": int(session.get('bytes-out', 0)),
+        "time_left": session.get('session-time-left', 'Unknown')
+    }
+
+def _fetch_active_users(api):
+    """Active hotspot sessions as _active_user_row() dicts, read on `api`."""
+    return [_active_user_row(session)
+            for session in _query(api.get_resource('/ip/hotspot/active'), ACTIVE_USER_PROPS)]
 
 def get_mikrotik_active_hotspot_users(api_pool=None):
     """
-    Fetch active hotspot users from MikroTik (CACHED, 5s TTL).
+    Fetch all active hotspot users from MikroTik (CACHED, 5s TTL).
     Args:
-        api_pool: Optional existing MikroTik API connection to reuse
-    Returns: list of dicts.
+        api_pool: Optional pooled session this thread holds (the pool hands it back to the read)
+    Returns: list of dicts (use paginate() to show them a page at a time).
     Fallback: Returns mock data if connection fails.
     """
     mock_data = []
 
-    # Check cache first
-    cached = _cache_active_users.get()
-    if cached is not None:
-        _debug("[DEBUG] Active users cache hit (5s TTL)")
-        return cached
-
-    # Use provided connection or create new one
-    connection_provided = api_pool is not None
-    if not connection_provided:
-        api_pool = get_pooled_api()  # Use pooled connection
-    
-    if not api_pool:
-        return mock_data
+    # The router mirror answers without a round trip when it is current
+    if api_pool is None:
+        snapshot = _mirror_snapshot()
+        if snapshot is not None:
+            return [_active_user_row(session) for session in snapshot.active]
 
     try:
-        api = api_pool.get_api()
-        active = api.get_resource('/ip/hotspot/active').get()
-        users_list = []
-        
-        for idx, session in enumerate(active):
-            if idx >= 10: break # Limit to 10
-            users_list.append({
-                "user": session.get('user', 'Unknown'),
-                "mac": session.get('mac-address', ''),
-                "uptime": session.get('uptime', '0s'),
-                "bytes_in": int(session.get('bytes-in', 0)),
-                "bytes_out": int(session.get('bytes-out', 0)),
-                "time_left": session.get('session-time-left', 'Unknown')
-            })
-        _cache_active_users.set(users_list)  # Cache result
-        return users_list
+        result = _cache_active_users.get_or_load(None, lambda: _router_read(_fetch_active_users))
+        if result is not None:
+            return result
     except Exception as e:
         print(f"[MIKROTIK] Error fetching active users: {e}")
-    finally:
-        # Only disconnect if we created the connection
-        if not connection_provided:
-            try:
-                api_pool.disconnect()
-            except: pass
-        
     return mock_data
 
 def get_income_stats():
     """
-    Mock function to get income statistics.
+    Income statistics from the sales rollups (see app/income.py).
     Returns: dict with daily and monthly data
     """
+    from .income import get_income_stats as income_from_rollups
+
+    try:
+        return income_from_rollups()
+    except Exception as e:
+        print(f"[ERROR] Failed to get income stats: {str(e)}")
+        return {
+            "earned_today": 0, "sales_today": 0, "weekly": 0, "earned_month": 0,
+            "earned_year": 0, "average_daily": 0, "daily": [], "monthly": [],
+            "labels_daily": [], "labels_monthly": []
+        }
+
+def _health_from_rows(health_res):
+    """Temperature/voltage dict from /system/health rows (None if empty)."""
+    if not health_res:
+        return None
+    first = health_res[0]
+    # RouterOS uses either 'temperature' or 'board-temperature'
+    temp = first.get('temperature') or first.get('board-temperature')
+    voltage = first.get('voltage') or first.get('board-voltage')
     return {
-        "earned_today": 900,
-        "earned_month": 22000,
-        "earned_year": 91500,
-        "average_daily": 657,
-        "daily": [500, 600, 450, 700, 800, 650, 900], # Last 7 days
-        "monthly": [15000, 18000, 16500, 20000, 22000], # Last 5 months
-        "labels_daily": ["Mon", "Tue", "Wed", "Thu", "Fri", "Sat", "Sun"],
-        "labels_monthly": ["Jan", "Feb", "Mar", "Apr", "May"]
+        "temperature": temp,
+        "voltage": voltage,
     }
 
 def get_mikrotik_health(api_pool=None):
     """Fetch system health (temperature/voltage, CACHED, 10s TTL). Returns dict with optional temperature."""
     mock = {"temperature": None, "voltage": None}
 
-    # Check cache first
-    cached = _cache_health.get()
-    if cached is not None:
-        _debug("[DEBUG] Health cache hit (10s TTL)")
-        return cached
-
-    connection_provided = api_pool is not None
-    if not connection_provided:
-        api_pool = get_pooled_api()  # Use pooled connection
-    if not api_pool:
-        return mock
+    def fetch(api):
+        return _health_from_rows(api.get_resource('/system/health').get()) or None
 
     try:
-        api = api_pool.get_api()
-        health_res = api.get_resource('/system/health').get()
-        if health_res:
-            first = health_res[0]
-            # RouterOS uses either 'temperature' or 'board-temperature'
-            temp = first.get('temperature') or first.get('board-temperature')
-            voltage = first.get('voltage') or first.get('board-voltage')
-            result = {
-                "temperature": temp,
-                "voltage": voltage,
-            }
-            _cache_health.set(result)  # Cache result
+        result = _cache_health.get_or_load(None, lambda: _router_read(fetch))
+        if result:
             return result
     except Exception as e:
         print(f"[MIKROTIK] Error fetching health: {e}")
-    finally:
-        if not connection_provided:
-            try:
-                api_pool.disconnect()
-            except:  # noqa: E722
-                pass
-
     return mock
 
 
 def get_server_stats():
-    """Get server PC statistics from actual system data (Raspberry Pi or Linux)."""
-    import subprocess
-    import psutil
-    
+    """Get server PC statistics (Raspberry Pi or Linux) from the background sampler.
+    See app/server_stats.py; nothing here blocks or spawns a process.
+    """
     # Mock data fallback
     mock_data = {
         "model": "Raspberry Pi 4 Model B",
@@ -501,111 +777,28 @@ def get_server_stats():
     }
     
     try:
-        data = {}
-        
-        # Get Raspberry Pi Model
-        try:
-            with open('/proc/device-tree/model', 'r') as f:
-                data['model'] = f.read().strip('\x00')
-        except:
-            data['model'] = "Unknown Device"
-        
-        # Get CPU Model from /proc/cpuinfo
-        try:
-            with open('/proc/cpuinfo', 'r') as f:
-                cpuinfo = f.read()
-                # Extract hardware info
-                for line in cpuinfo.split('\n'):
-                    if line.startswith('Hardware'):
-                        data['cpu_model'] = line.split(':', 1)[1].strip()
-                        break
-                else:
-                    data['cpu_model'] = "ARM Processor"
-        except:
-            data['cpu_model'] = "Unknown CPU"
-        
-        # Get CPU cores count
-        data['cpu_cores'] = psutil.cpu_count(logical=False)
-        
-        # Get CPU usage percentage
-        data['cpu_usage'] = psutil.cpu_percent(interval=0.1)
-        
-        # Get Memory info (in MB)
-        memory = psutil.virtual_memory()
-        data['total_memory'] = int(memory.total / (1024 * 1024))
-        data['used_memory'] = int(memory.used / (1024 * 1024))
-        data['free_memory'] = int(memory.available / (1024 * 1024))
-        
-        # Get Uptime
-        try:
-            with open('/proc/uptime', 'r') as f:
-                uptime_seconds = int(float(f.read().split()[0]))
-                days, remainder = divmod(uptime_seconds, 86400)
-                hours, remainder = divmod(remainder, 3600)
-                minutes, _ = divmod(remainder, 60)
-                
-                if days > 0:
-                    data['uptime'] = f"{days}d {hours}h {minutes}m"
-                elif hours > 0:
-                    data['uptime'] = f"{hours}h {minutes}m"
-                else:
-                    data['uptime'] = f"{minutes}m"
-        except:
-            data['uptime'] = "0m"
-        
-        # Get CPU Temperature (Raspberry Pi specific)
-        data['temperature'] = "N/A"
-        try:
-            # Try Raspberry Pi thermal zone
-            with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-                temp_millidegrees = int(f.read().strip())
-                temp_celsius = temp_millidegrees / 1000
-                data['temperature'] = f"{temp_celsius:.1f}°C"
-        except:
-            try:
-                # Alternative: Try vcgencmd (if available on RPi)
-                result = subprocess.run(['vcgencmd', 'measure_temp'], 
-                                      capture_output=True, text=True, timeout=2)
-                if result.returncode == 0:
-                    # Output: temp=48.2'C
-                    temp_str = result.stdout.strip().split('=')[1]
-                    data['temperature'] = temp_str
-            except:
-                pass
-        
-        # Get OS Info
-        try:
-            with open('/etc/os-release', 'r') as f:
-                os_info = f.read()
-                for line in os_info.split('\n'):
-                    if line.startswith('PRETTY_NAME'):
-                        data['os'] = line.split('=', 1)[1].strip().strip('"')
-                        break
-                else:
-                    data['os'] = "Linux"
-        except:
-            data['os'] = "Linux"
-        
-        # Get Kernel version
-        try:
-            result = subprocess.run(['uname', '-r'], 
-                                  capture_output=True, text=True, timeout=2)
-            data['kernel'] = result.stdout.strip()
-        except:
-            data['kernel'] = "Unknown"
-        
-        return data
-    
+        from .server_stats import server_sampler
+        return server_sampler.latest()
     except Exception as e:
         print(f"[ERROR] Failed to get server stats: {str(e)}")
         return mock_data
 
+def _traffic_from_rows(traffic):
+    """rx/tx bits per second from monitor-traffic rows (None if empty)."""
+    if not traffic:
+        return None
+    t = traffic[0]
+    return {
+        "rx_bps": int(t.get('rx-bits-per-second', 0)),
+        "tx_bps": int(t.get('tx-bits-per-second', 0))
+    }
+
 def get_mikrotik_interface_traffic(interface_name=None, api_pool=None):
     """
-    Get current traffic on an interface.
+    Get current traffic on an interface (CACHED per interface, 2s TTL).
     Args:
         interface_name: Optional interface name (default from env var)
-        api_pool: Optional existing MikroTik API connection to reuse
+        api_pool: Optional pooled session this thread holds (the pool hands it back to the read)
     Fallback: Returns random mock data if connection fails.
     """
     import random
@@ -617,43 +810,25 @@ def get_mikrotik_interface_traffic(interface_name=None, api_pool=None):
     if not interface_name:
         interface_name = os.getenv('MIKROTIK_WAN_INTERFACE', 'ether1')
 
-    # Use provided connection or create new one
-    connection_provided = api_pool is not None
-    if not connection_provided:
-        api_pool = get_mikrotik_api()
-    
-    if not api_pool:
-        return mock_data
-
-    try:
-        api = api_pool.get_api()
+    def fetch(api):
         # Using monitor-traffic command
         # Syntax: /interface monitor-traffic [find name=ether1] once
-        traffic = api.get_resource('/interface').call('monitor-traffic', {
+        return _traffic_from_rows(api.get_resource('/interface').call('monitor-traffic', {
             'interface': interface_name,
             'once': 'true'
-        })
-        
-        if traffic:
-            t = traffic[0]
-            return {
-                "rx_bps": int(t.get('rx-bits-per-second', 0)),
-                "tx_bps": int(t.get('tx-bits-per-second', 0))
-            }
+        }))
+
+    try:
+        result = _cache_traffic.get_or_load(interface_name, lambda: _router_read(fetch))
+        if result:
+            return result
     except Exception as e:
         print(f"[MIKROTIK] Error fetching traffic for {interface_name}: {e}")
-    finally:
-        # Only disconnect if we created the connection
-        if not connection_provided:
-            try:
-                api_pool.disconnect()
-            except: pass
-        
     return mock_data
 
 def mikrotik_kick_mac(mac_address):
     """Remove an active hotspot session for a MAC."""
-    api_pool = get_mikrotik_api()
+    api_pool = get_pooled_api()
     if not api_pool:
         return False
 
@@ -666,43 +841,35 @@ def mikrotik_kick_mac(mac_address):
             active.remove(id=session['.id'])
 
         print(f"[MIKROTIK] Kicked MAC {mac_address}")
+        _router_changed()
         return True
     except Exception as e:
         print(f"[MIKROTIK] Error kicking MAC {mac_address}: {str(e)}")
         return False
     finally:
         try:
-            api_pool.disconnect()
+            api_pool.release()
         except Exception:
             pass
 
-def get_mac_from_arp(ip_address):
-    """Get MAC address from MikroTik ARP table by IP address."""
-    api_pool = get_mikrotik_api()
-    if not api_pool:
-        return None
-    
-    try:
-        api = api_pool.get_api()
-        arp = api.get_resource('/ip/arp')
-        entries = arp.get(**{'address': ip_address})
-        
-        if entries and isinstance(entries, list) and len(entries) > 0:
-            mac = entries[0].get('mac-address')
-            print(f"[MIKROTIK] Found ARP entry for IP {ip_address}: MAC {mac}")
-            return mac
-    except Exception as e:
-        print(f"[MIKROTIK] Error looking up ARP for IP {ip_address}: {str(e)}")
-    finally:
-        try:
-            api_pool.disconnect()
-        except Exception:
-            pass
-    
-    return None
 # ============ ASYNC WRAPPERS FOR BACKGROUND FETCHING ============
+# These run on the shared asyncio RouterOS client (app/routeros_async.py)
+# instead of starting a thread per call.
+
+def _submit_to_router(fetch, parse, callback):
+    """Run fetch(client) on the async router service and pass parse(rows) to callback."""
+    from .routeros_async import router_service
+
+    def _done(future):
+        try:
+            callback(parse(future.result()), error=None)
+        except Exception as e:
+            callback(None, error=str(e))
+
+    router_service.submit(fetch).add_done_callback(_done)
+
 def fetch_system_stats_async(callback):
-    """Fetch system stats in background thread, call callback with result.
+    """Fetch system stats without blocking the caller, call callback with result.
     Prevents GUI blocking.
     
     Usage:
@@ -714,54 +881,47 @@ def fetch_system_stats_async(callback):
         
         fetch_system_stats_async(handle_stats)
     """
-    def _fetch():
-        try:
-            stats = get_mikrotik_system_stats()
-            callback(stats, error=None)
-        except Exception as e:
-            callback(None, error=str(e))
-    
-    thread = threading.Thread(target=_fetch, daemon=True)
-    thread.start()
+    import asyncio
+
+    async def _fetch(client):
+        return await asyncio.gather(client.call('/system/resource/print'),
+                                    client.call('/system/routerboard/print'))
+
+    _submit_to_router(_fetch, lambda rows: _system_stats_from_rows(*rows), callback)
 
 def fetch_active_users_async(callback):
-    """Fetch active hotspot users in background thread, call callback with result."""
-    def _fetch():
-        try:
-            users = get_mikrotik_active_hotspot_users()
-            callback(users, error=None)
-        except Exception as e:
-            callback(None, error=str(e))
-    
-    thread = threading.Thread(target=_fetch, daemon=True)
-    thread.start()
+    """Fetch active hotspot users without blocking the caller, call callback with result."""
+    async def _fetch(client):
+        return await client.call('/ip/hotspot/active/print', proplist=ACTIVE_USER_PROPS)
+
+    _submit_to_router(_fetch, lambda rows: [_active_user_row(session) for session in rows], callback)
 
 def fetch_health_async(callback):
-    """Fetch router health in background thread, call callback with result."""
-    def _fetch():
-        try:
-            health = get_mikrotik_health()
-            callback(health, error=None)
-        except Exception as e:
-            callback(None, error=str(e))
-    
-    thread = threading.Thread(target=_fetch, daemon=True)
-    thread.start()
+    """Fetch router health without blocking the caller, call callback with result."""
+    async def _fetch(client):
+        return await client.call('/system/health/print')
+
+    _submit_to_router(_fetch, _health_from_rows, callback)
 
 def fetch_traffic_async(interface, callback):
-    """Fetch interface traffic in background thread, call callback with result."""
-    def _fetch():
-        try:
-            traffic = get_mikrotik_interface_traffic(interface)
-            callback(traffic, error=None)
-        except Exception as e:
-            callback(None, error=str(e))
-    
-    thread = threading.Thread(target=_fetch, daemon=True)
-    thread.start()
+    """Fetch interface traffic without blocking the caller, call callback with result."""
+    interface = interface or os.getenv('MIKROTIK_WAN_INTERFACE', 'ether1')
+
+    async def _fetch(client):
+        return await client.call('/interface/monitor-traffic', {'interface': interface, 'once': ''})
+
+    _submit_to_router(_fetch, _traffic_from_rows, callback)
 
 # ============ SYSTEM CONTROL COMMANDS ============
 
+def _close_session(api_pool):
+    """Close a pooled lease or a plain RouterOsApiPool for good."""
+    if isinstance(api_pool, PooledApi):
+        api_pool.close()
+    else:
+        api_pool.disconnect()
+
+
 def restart_mikrotik(api_pool=None):
     """Restart the MikroTik RouterOS system via API.
     
@@ -771,10 +931,13 @@ def restart_mikrotik(api_pool=None):
     if not ROUTEROS_AVAILABLE:
         return {'success': False, 'message': 'MikroTik API not available'}
     
+    if api_pool is None:
+        api_pool = get_pooled_api()
+    if not api_pool:
+        return {'success': False, 'message': 'Cannot connect to MikroTik API'}
+
     try:
-        api = api_pool.get_api() if api_pool else get_mikrotik_api()
-        if not api:
-            return {'success': False, 'message': 'Cannot connect to MikroTik API'}
+        api = api_pool.get_api()
         
         # Call the reboot command
         api.get_resource('/system/reboot').call('reboot', {})
@@ -786,6 +949,11 @@ def restart_mikrotik(api_pool=None):
         print(f"[MIKROTIK] {error_msg}")
         _debug(f"[DEBUG] {error_msg}")
         return {'success': False, 'message': error_msg}
+    finally:
+        # The router drops every API session when it goes down; close ours (the caller's
+        # too, so releasing it later can't put a dead socket back in the pool)
+        _close_session(api_pool)
+        get_connection_pool().clear()
 
 def stop_mikrotik(api_pool=None):
     """Stop/Power off the MikroTik RouterOS system via API.
@@ -796,10 +964,13 @@ def stop_mikrotik(api_pool=None):
     if not ROUTEROS_AVAILABLE:
         return {'success': False, 'message': 'MikroTik API not available'}
     
+    if api_pool is None:
+        api_pool = get_pooled_api()
+    if not api_pool:
+        return {'success': False, 'message': 'Cannot connect to MikroTik API'}
+
     try:
-        api = api_pool.get_api() if api_pool else get_mikrotik_api()
-        if not api:
-            return {'success': False, 'message': 'Cannot connect to MikroTik API'}
+        api = api_pool.get_api()
         
         # Call the shutdown command
         api.get_resource('/system/shutdown').call('shutdown', {})
@@ -811,6 +982,11 @@ def stop_mikrotik(api_pool=None):
         print(f"[MIKROTIK] {error_msg}")
         _debug(f"[DEBUG] {error_msg}")
         return {'success': False, 'message': error_msg}
+    finally:
+        # The router drops every API session when it goes down; close ours (the caller's
+        # too, so releasing it later can't put a dead socket back in the pool)
+        _close_session(api_pool)
+        get_connection_pool().clear()
 
 # ============ BANDWIDTH CONTROL & TRAFFIC TRACKING ============
 
@@ -826,8 +1002,16 @@ def mikrotik_add_queue(mac_address, upload_speed="1M", download_speed="2M", name
     
     Returns:
         bool: True if successful, False otherwise
+
+    Speeds of UNLIMITED remove the user's limit instead.
     """
-    api_pool = get_mikrotik_api()
+    from .bandwidth import pcq_enabled, assign_tier
+    if UNLIMITED in (upload_speed, download_speed):
+        return mikrotik_remove_queue(mac_address, name_prefix)
+    if pcq_enabled():
+        return assign_tier(mac_address, upload_speed, download_speed, name_prefix)
+
+    api_pool = get_pooled_api()
     if not api_pool:
         print(f"[MIKROTIK] Failed to connect - cannot add queue for MAC {mac_address}")
         return False
@@ -845,7 +1029,8 @@ def mikrotik_add_queue(mac_address, upload_speed="1M", download_speed="2M", name
             queue_id = existing[0].get('id') or existing[0].get('.id')
             simple_queue.set(id=queue_id, **{
                 'max-limit': f"{upload_speed}/{download_speed}",
-                'target': mac_address
+                'target': mac_address,
+                'comment': QUEUE_COMMENT
             })
             print(f"[MIKROTIK] Updated queue for MAC {mac_address}: {upload_speed}/{download_speed}")
         else:
@@ -854,17 +1039,18 @@ def mikrotik_add_queue(mac_address, upload_speed="1M", download_speed="2M", name
                 'name': queue_name,
                 'target': mac_address,
                 'max-limit': f"{upload_speed}/{download_speed}",
-                'comment': 'PisoNet bandwidth control'
+                'comment': QUEUE_COMMENT
             })
             print(f"[MIKROTIK] Added queue for MAC {mac_address}: {upload_speed}/{download_speed}")
         
+        _router_changed()
         return True
     except Exception as e:
         print(f"[MIKROTIK] Error adding queue for MAC {mac_address}: {str(e)}")
         return False
     finally:
         try:
-            api_pool.disconnect()
+            api_pool.release()
         except Exception:
             pass
 
@@ -879,7 +1065,11 @@ def mikrotik_remove_queue(mac_address, name_prefix="pisonet"):
     Returns:
         bool: True if successful or not found, False otherwise
     """
-    api_pool = get_mikrotik_api()
+    from .bandwidth import pcq_enabled, remove_from_tiers
+    if pcq_enabled():
+        return remove_from_tiers(mac_address, name_prefix)
+
+    api_pool = get_pooled_api()
     if not api_pool:
         print(f"[MIKROTIK] Failed to connect - cannot remove queue for MAC {mac_address}")
         return False
@@ -896,6 +1086,7 @@ def mikrotik_remove_queue(mac_address, name_prefix="pisonet"):
             queue_id = existing[0].get('id') or existing[0].get('.id')
             simple_queue.remove(id=queue_id)
             print(f"[MIKROTIK] Removed queue for MAC {mac_address}")
+            _router_changed()
         else:
             print(f"[MIKROTIK] Queue not found for MAC {mac_address} (already removed)")
         
@@ -905,13 +1096,75 @@ def mikrotik_remove_queue(mac_address, name_prefix="pisonet"):
         return False
     finally:
         try:
-            api_pool.disconnect()
+            api_pool.release()
         except Exception:
             pass
 
+def _split_pair(row, key):
+    """Split a simple queue "upload/download" counter (e.g. bytes=120/4500) into two strings.
+    Falls back to separate key-in/key-out fields when the pair is absent.
+    """
+    pair = row.get(key)
+    if pair and '/' in pair:
+        first, _, second = pair.partition('/')
+        return first, second
+    return row.get(f'{key}-in', '0'), row.get(f'{key}-out', '0')
+
+def to_int(value):
+    """A router counter field as an int (0 when missing or not a number)."""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return 0
+
+def counter_delta(previous, current):
+    """Bytes counted since the previous reading of a counter."""
+    # A counter that went down was reset (router reboot, queue re-created)
+    return current - previous if current >= previous else current
+
+# Columns _queue_stats() reads
+TRAFFIC_PROPS = 'name,bytes,packets,rate,max-limit'
+
+def _queue_stats(q, mac_address, name=None):
+    """Traffic dict for one simple queue row."""
+    bytes_in, bytes_out = _split_pair(q, 'bytes')
+    packets_in, packets_out = _split_pair(q, 'packets')
+    rate_in, rate_out = _split_pair(q, 'rate')
+    stats = {'mac': mac_address}
+    if name is not None:
+        stats['name'] = name
+    stats.update({
+        'bytes_in': int(bytes_in or 0),
+        'bytes_out': int(bytes_out or 0),
+        'packets_in': int(packets_in or 0),
+        'packets_out': int(packets_out or 0),
+        'rate_in': rate_in or '0',
+        'rate_out': rate_out or '0',
+        'max_limit': q.get('max-limit', 'N/A')
+    })
+    return stats
+
+def _fetch_user_traffic(api, mac_address=None, name_prefix="pisonet"):
+    """Traffic stats for one user or all PisoNet users, read on `api`."""
+    from .bandwidth import pcq_enabled, user_traffic
+
+    if pcq_enabled():
+        return user_traffic(api, mac_address, name_prefix)
+    simple_queue = api.get_resource('/queue/simple')
+    queue_prefix = f"{name_prefix}-"
+
+    if mac_address:
+        # Get specific user stats
+        queues = _query(simple_queue, TRAFFIC_PROPS, {'name': _queue_name(mac_address, name_prefix)})
+        return _queue_stats(queues[0], mac_address) if queues else {}
+    # Get all PisoNet user stats; the comment filter leaves other services' queues on the router
+    queues = _query(simple_queue, TRAFFIC_PROPS, {'comment': QUEUE_COMMENT})
+    return [_queue_stats(q, q['name'][len(queue_prefix):].replace('-', ':'), q['name'])
+            for q in queues if q.get('name', '').startswith(queue_prefix)]
+
 def mikrotik_get_user_traffic(mac_address=None, name_prefix="pisonet"):
     """
-    Get traffic statistics for a specific user or all PisoNet users.
+    Get traffic statistics for a specific user or all PisoNet users (CACHED per MAC, 2s TTL).
     
     Args:
         mac_address: Optional MAC address to get stats for specific user
@@ -920,59 +1173,27 @@ def mikrotik_get_user_traffic(mac_address=None, name_prefix="pisonet"):
     Returns:
         dict or list: Traffic stats for user(s)
     """
-    api_pool = get_mikrotik_api()
-    if not api_pool:
-        return {} if mac_address else []
+    from .bandwidth import pcq_enabled
+    queue_prefix = f"{name_prefix}-"
 
-    try:
-        api = api_pool.get_api()
-        simple_queue = api.get_resource('/queue/simple')
-        
+    # Serve from the router mirror when it is current (simple queues only)
+    snapshot = _mirror_snapshot() if not pcq_enabled() else None
+    if snapshot is not None:
         if mac_address:
-            # Get specific user stats
-            queue_name = f"{name_prefix}-{mac_address.replace(':', '-')}"
-            queues = simple_queue.get(name=queue_name)
-            if queues and len(queues) > 0:
-                q = queues[0]
-                return {
-                    'mac': mac_address,
-                    'bytes_in': int(q.get('bytes-in', 0)),
-                    'bytes_out': int(q.get('bytes-out', 0)),
-                    'packets_in': int(q.get('packets-in', 0)),
-                    'packets_out': int(q.get('packets-out', 0)),
-                    'rate_in': q.get('rate-in', '0'),
-                    'rate_out': q.get('rate-out', '0'),
-                    'max_limit': q.get('max-limit', 'N/A')
-                }
-            return {}
-        else:
-            # Get all PisoNet user stats
-            all_queues = simple_queue.get()
-            stats = []
-            for q in all_queues:
-                name = q.get('name', '')
-                if name.startswith(name_prefix):
-                    mac = name.replace(f"{name_prefix}-", "").replace('-', ':')
-                    stats.append({
-                        'mac': mac,
-                        'name': name,
-                        'bytes_in': int(q.get('bytes-in', 0)),
-                        'bytes_out': int(q.get('bytes-out', 0)),
-                        'packets_in': int(q.get('packets-in', 0)),
-                        'packets_out': int(q.get('packets-out', 0)),
-                        'rate_in': q.get('rate-in', '0'),
-                        'rate_out': q.get('rate-out', '0'),
-                        'max_limit': q.get('max-limit', 'N/A')
-                    })
-            return stats
+            q = snapshot.queue(_queue_name(mac_address, name_prefix))
+            return _queue_stats(q, mac_address) if q else {}
+        return [_queue_stats(q, q['name'][len(queue_prefix):].replace('-', ':'), q['name'])
+                for q in snapshot.queues if q.get('name', '').startswith(queue_prefix)]
+
+    key = (mac_address.upper() if mac_address else None, name_prefix)
+    try:
+        result = _cache_user_traffic.get_or_load(
+            key, lambda: _router_read(lambda api: _fetch_user_traffic(api, mac_address, name_prefix)))
+        if result is not None:
+            return result
     except Exception as e:
         print(f"[MIKROTIK] Error fetching traffic stats: {str(e)}")
-        return {} if mac_address else []
-    finally:
-        try:
-            api_pool.disconnect()
-        except Exception:
-            pass
+    return {} if mac_address else []
 
 def get_mikrotik_active_users_with_traffic(api_pool=None):
     """
@@ -982,13 +1203,43 @@ def get_mikrotik_active_users_with_traffic(api_pool=None):
     Returns:
         list: Active users with traffic stats
     """
-    # Get active hotspot users
-    users = get_mikrotik_active_hotspot_users(api_pool)
-    
-    # Get traffic stats from queues
-    traffic_stats = mikrotik_get_user_traffic()
+    connection_provided = api_pool is not None
+    if not connection_provided and _mirror_snapshot() is None:
+        # Only hold a session when the mirror can't answer both lookups
+        api_pool = get_pooled_api()
+
+    try:
+        # Get active hotspot users
+        # Copies: the rows are shared with the cache and get traffic fields added below
+        users = [dict(user) for user in get_mikrotik_active_hotspot_users(api_pool)]
+
+        # Get traffic stats from queues (reuses this thread's pooled session)
+        traffic_stats = mikrotik_get_user_traffic()
+    finally:
+        if not connection_provided and api_pool:
+            api_pool.release()
+    return merge_user_traffic(users, traffic_stats)
+
+def read_active_users_with_traffic():
+    """Like get_mikrotik_active_users_with_traffic(), but always read from the router.
+
+    Both tables are read on one pooled session and the results refresh the
+    active-user and user-traffic caches, so pages served meanwhile don't query
+    the router again. Returns None when the router can't be reached.
+    """
+    def fetch(api):
+        users = _fetch_active_users(api)
+        traffic = _fetch_user_traffic(api)
+        _cache_active_users.set(None, users)
+        _cache_user_traffic.set((None, 'pisonet'), traffic)
+        return merge_user_traffic([dict(user) for user in users], traffic)
+
+    return _router_read(fetch)
+
+def merge_user_traffic(users, traffic_stats):
+    """Add queue traffic fields (queue_bytes_*, rate_*, max_limit) to each active user row, in place."""
     traffic_by_mac = {stat['mac']: stat for stat in traffic_stats}
-    
+
     # Merge data
     for user in users:
         mac = user.get('mac', '')
@@ -1019,4 +1270,22 @@ def format_bytes(bytes_value):
             bytes_value /= 1024.0
         return f"{bytes_value:.2f} PB"
     except:
-        return "0 B"
\ No newline at end of file
+        return "0 B"
+
+_SIZE_RE = re.compile(r'^\s*([\d.]+)\s*([kKmMgGtT]?)[bB]?\s*$')
+_SIZE_UNITS = {'': 1, 'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3, 't': 1024 ** 4}
+
+def parse_data_size(value):
+    """'500M' / '1.5G' / '1048576' -> bytes (None for empty or unparseable values)."""
+    match = _SIZE_RE.match(str(value or ''))
+    if not match:
+        return None
+    return int(float(match.group(1)) * _SIZE_UNITS[match.group(2).lower()])
+
+def format_data_size(num_bytes):
+    """Bytes -> '500M' / '1.5G' (the inverse of parse_data_size)."""
+    for unit in ('T', 'G', 'M', 'K'):
+        size = _SIZE_UNITS[unit.lower()]
+        if num_bytes >= size:
+            return f"{round(num_bytes / size, 2):g}{unit}"
+    return str(num_bytes)
@@ -0,0 +1,242 @@
+# app/vouchers.py
+"""Bulk voucher generation with collision-free codes, and streaming export for printing."""
+import csv
+import io
+import secrets
+import string
+from datetime import datetime, time, timedelta, timezone
+
+from markupsafe import escape
+from sqlalchemy import or_
+from sqlalchemy.exc import IntegrityError
+
+from . import db
+from .utils import format_data_size
+from .models import Voucher
+
+CODE_ALPHABET = string.ascii_uppercase + string.digits
+CODE_LENGTH = 6
+MAX_BATCH = 10000
+
+# Codes checked per "SELECT code ... WHERE code IN (...)" (stays under SQLite's bound parameter limit)
+_LOOKUP_CHUNK = 500
+# Redraw rounds before giving up (each round only redraws the codes that collided)
+_MAX_ROUNDS = 10
+
+
+def random_code(length=CODE_LENGTH):
+    return ''.join(secrets.choice(CODE_ALPHABET) for _ in range(length))
+
+
+def _taken(codes):
+    """The subset of `codes` already in the vouchers table."""
+    codes = list(codes)
+    taken = set()
+    for i in range(0, len(codes), _LOOKUP_CHUNK):
+        chunk = codes[i:i + _LOOKUP_CHUNK]
+        taken.update(row[0] for row in db.session.query(Voucher.code).filter(Voucher.code.in_(chunk)))
+    return taken
+
+
+def allocate_codes(count, length=CODE_LENGTH):
+    """`count` new codes that are unique within the batch and not in the database.
+
+    Draws the whole batch at once, checks it with a few chunked IN queries and
+    redraws only the codes that collided (rare: 36^6 is ~2 billion codes).
+    """
+    codes = set()
+    for _ in range(_MAX_ROUNDS):
+        wanted = count - len(codes)
+        fresh = set()
+        for _ in range(wanted * 4):
+            code = random_code(length)
+            if code not in codes:
+                fresh.add(code)
+                if len(fresh) == wanted:
+                    break
+        codes |= fresh - _taken(fresh)
+        if len(codes) == count:
+            return list(codes)
+    raise RuntimeError(f"Could not find {count} unused {length}-character codes; the code space is nearly used up")
+
+
+def create_vouchers(count, duration, rate_limit_up='1M', rate_limit_down='2M',
+                    profile=None, price=None, data_limit_bytes=None, attempts=3):
+    """Insert `count` vouchers with one executemany and commit. Returns their codes.
+
+    If another process inserts the same code between the check and the insert,
+    the unique index rejects the batch and it is redrawn (up to `attempts` times).
+    """
+    if count < 1 or count > MAX_BATCH:
+        raise ValueError(f"Quantity must be between 1 and {MAX_BATCH}")
+
+    for attempt in range(attempts):
+        codes = allocate_codes(count)
+        rows = [{
+            'code': code,
+            'duration': duration,
+            'rate_limit_up': rate_limit_up,
+            'rate_limit_down': rate_limit_down,
+            'profile': profile,
+            'price': price,
+            'data_limit_bytes': data_limit_bytes,
+        } for code in codes]
+        try:
+            db.session.execute(Voucher.__table__.insert(), rows)
+            db.session.commit()
+            return codes
+        except IntegrityError:
+            db.session.rollback()
+            if attempt == attempts - 1:
+                raise
+            print(f"[VOUCHERS] Code collision during insert, redrawing batch of {count}")
+
+
+# ============ EXPORT ============
+
+EXPORT_STATUSES = ('unused', 'active', 'expired')
+EXPORT_COLUMNS = ['code', 'profile', 'duration', 'price', 'rate_limit_up', 'rate_limit_down',
+                  'data_limit', 'created_at', 'status']
+
+# Rows fetched from the database per round trip while streaming
+_EXPORT_BATCH = 500
+
+
+def _local_day_start(day):
+    """Start of a local calendar day as a UTC datetime (created_at is stored in UTC)."""
+    return datetime.combine(day, time.min).astimezone(timezone.utc)
+
+
+def export_query(profile=None, since=None, until=None, status=None, now=None):
+    """Voucher rows to export, oldest first, as plain column tuples.
+
+    `since`/`until` are local dates (inclusive); `status` is one of
+    EXPORT_STATUSES, with the same meaning as on the dashboard.
+    """
+    now = now or datetime.now(timezone.utc)
+    query = db.session.query(
+        Voucher.id, Voucher.code, Voucher.profile, Voucher.duration, Voucher.price,
+        Voucher.rate_limit_up, Voucher.rate_limit_down, Voucher.data_limit_bytes,
+        Voucher.created_at, Voucher.activated_at, Voucher.expires_at, Voucher.is_developer
+    )
+    if profile:
+        query = query.filter(Voucher.profile == profile)
+    if since:
+        query = query.filter(Voucher.created_at >= _local_day_start(since))
+    if until:
+        query = query.filter(Voucher.created_at < _local_day_start(until + timedelta(days=1)))
+    if status == 'unused':
+        query = query.filter(Voucher.activated_at == None)
+    elif status == 'active':
+        query = query.filter(Voucher.activated_at != None,
+                             or_(Voucher.is_developer == True, Voucher.expires_at > now))
+    elif status == 'expired':
+        query = query.filter(Voucher.activated_at != None, Voucher.is_developer == False,
+                             Voucher.expires_at <= now)
+    elif status:
+        raise ValueError(f"Unknown status '{status}' (expected one of {', '.join(EXPORT_STATUSES)})")
+    return query.order_by(Voucher.id).execution_options(yield_per=_EXPORT_BATCH)
+
+
+def format_duration(seconds):
+    """3600 -> '1h', 5400 -> '1h 30m', 86400 -> '1d'."""
+    seconds = int(seconds or 0)
+    days, rest = divmod(seconds, 86400)
+    hours, rest = divmod(rest, 3600)
+    minutes = rest // 60
+    parts = [f"{value}{unit}" for value, unit in ((days, 'd'), (hours, 'h'), (minutes, 'm')) if value]
+    return ' '.join(parts) or f"{seconds}s"
+
+
+def _export_record(row, now):
+    if row.activated_at is None:
+        status = 'unused'
+    elif row.is_developer or (row.expires_at and row.expires_at.replace(tzinfo=timezone.utc) > now):
+        status = 'active'
+    else:
+        status = 'expired'
+    created = row.created_at.replace(tzinfo=timezone.utc).astimezone() if row.created_at else None
+    return {
+        'code': row.code,
+        'profile': row.profile or '',
+        'duration': format_duration(row.duration),
+        'price': '' if row.price is None else f"{row.price:g}",
+        'rate_limit_up': row.rate_limit_up or '',
+        'rate_limit_down': row.rate_limit_down or '',
+        'data_limit': format_data_size(row.data_limit_bytes) if row.data_limit_bytes else '',
+        'created_at': created.strftime('%Y-%m-%d %H:%M') if created else '',
+        'status': status,
+    }
+
+
+def iter_export_records(query, now=None):
+    """Export records (dicts keyed by EXPORT_COLUMNS), fetched from the database in batches."""
+    now = now or datetime.now(timezone.utc)
+    for row in query:
+        yield _export_record(row, now)
+
+
+def iter_csv(records, rows_per_chunk=100):
+    """CSV text in chunks of `rows_per_chunk` rows (header first), for a streaming response or a file."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_COLUMNS)
+
+    def flush():
+        chunk = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writeheader()
+    pending = 0
+    for record in records:
+        writer.writerow(record)
+        pending += 1
+        if pending == rows_per_chunk:
+            yield flush()
+            pending = 0
+    yield flush()
+
+
+_SHEET_STYLE = """
+body { font-family: Arial, sans-serif; margin: 0; }
+.sheet { display: grid; grid-template-columns: repeat(4, 1fr); gap: 6mm; padding: 8mm; page-break-after: always; }
+.card { border: 1px dashed #4b7178; border-radius: 4px; padding: 3mm; text-align: center; }
+.code { font-size: 18pt; font-weight: bold; letter-spacing: 2px; color: #0b343d; }
+.meta { font-size: 9pt; color: #444; }
+@media print { .sheet:last-child { page-break-after: auto; } }
+"""
+
+
+def _voucher_card(record):
+    meta = [record['duration']]
+    if record['price']:
+        meta.append(f"₱{record['price']}")
+    if record['data_limit']:
+        meta.append(record['data_limit'])
+    return (
+        '<div class="card">'
+        f'<div class="meta">{escape(record["profile"])}</div>'
+        f'<div class="code">{escape(record["code"])}</div>'
+        f'<div class="meta">{escape(" · ".join(meta))}</div>'
+        f'<div class="meta">{escape(record["rate_limit_down"])} down / {escape(record["rate_limit_up"])} up</div>'
+        '</div>'
+    )
+
+
+def iter_print_sheets(records, per_page=40, title="PisoNet Vouchers"):
+    """A printable HTML document (one page of `per_page` voucher cards at a time).
+
+    Open it in a browser and print, or "Save as PDF".
+    """
+    yield (f'<!DOCTYPE html><html><head><meta charset="utf-8"><title>{escape(title)}</title>'
+           f'<style>{_SHEET_STYLE}</style></head><body>')
+    page = []
+    for record in records:
+        page.append(_voucher_card(record))
+        if len(page) == per_page:
+            yield '<div class="sheet">' + ''.join(page) + '</div>'
+            page = []
+    if page:
+        yield '<div class="sheet">' + ''.join(page) + '</div>'
+    yield '</body></html>'
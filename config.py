@@ -25,4 +25,5 @@ class Config:
     MIKROTIK_USERNAME = os.environ.get('MIKROTIK_USERNAME') or 'admin'
     MIKROTIK_PASSWORD = os.environ.get('MIKROTIK_PASSWORD') or ''
     MIKROTIK_USE_SSL = os.environ.get('MIKROTIK_USE_SSL', 'False').lower() == 'true'
+    MIKROTIK_SSL_VERIFY = os.environ.get('MIKROTIK_SSL_VERIFY', 'False').lower() == 'true'
     MIKROTIK_WAN_INTERFACE = os.environ.get('MIKROTIK_WAN_INTERFACE') or 'ether1'
@@ -6,8 +6,6 @@ import webbrowser
 import sys
 import os
 import json
-import secrets
-import string
 import ctypes
 import queue
 from datetime import datetime, timedelta
@@ -26,6 +24,8 @@ except Exception:
 sys.path.append(os.getcwd())
 from app import create_app, db
 from app.models import Voucher, Admin
+from app.profiles import profile_registry, ProfileError
+from app.vouchers import create_vouchers
 
 class IORedirector(object):
     def __init__(self, queue, original_stream):
@@ -161,7 +161,6 @@ class PisonetManager(ctk.CTk):
         self.flask_thread = None
         self.server = None
         self.is_server_running = False
-        self.profiles_file = 'profiles.json'
         
         # Configure Colors
         self.sidebar_color = "#0b343d"
@@ -344,27 +343,9 @@ class PisonetManager(ctk.CTk):
         self.status_indicator.configure(text_color=color)
 
     def load_profiles(self):
-        self.profiles = []
-        if os.path.exists(self.profiles_file):
-            try:
-                with open(self.profiles_file, 'r') as f:
-                    self.profiles = json.load(f)
-            except: pass
-        
-        # If empty, add default
-        if not self.profiles:
-            self.profiles = [
-                {"name": "1H", "price": 10, "validity": "1h", "users": "1", "rate_up": "1M", "rate_down": "2M"},
-                {"name": "3H", "price": 25, "validity": "3h", "users": "1", "rate_up": "2M", "rate_down": "4M"}
-            ]
-            self.save_profiles()
-
-    def save_profiles(self):
-        try:
-            with open(self.profiles_file, 'w') as f:
-                json.dump(self.profiles, f, indent=4)
-        except Exception as e:
-            print(f"Error saving profiles: {e}")
+        profile_registry.ensure_defaults()
+        for error in profile_registry.errors:
+            print(f"Warning: {error}")
 
 
     def start_server(self):
@@ -477,24 +458,14 @@ class PisonetManager(ctk.CTk):
             # Revoke all active users
             print("[CLOSE] Revoking access for all active users...")
             try:
-                from app.utils import mikrotik_revoke_mac
+                from app.sessions import revoke_all_vouchers
                 with self.flask_app.app_context():
-                    from app.models import Voucher
-                    vouchers = Voucher.query.filter(
-                        Voucher.activated_at != None,
-                        Voucher.user_mac_address != None
-                    ).all()
-                    
-                    for v in vouchers:
-                        if v.user_mac_address:
-                            try:
-                                if mikrotik_revoke_mac(v.user_mac_address):
-                                    # Successfully revoked (or already gone), clear from DB
-                                    v.user_mac_address = None
-                                    db.session.commit()
-                                    print(f"[CLOSE] Cleared: {v.code}")
-                            except Exception as e:
-                                print(f"[CLOSE] Error revoking {v.code}: {e}")
+                    # One router session and one commit for everyone
+                    revoked, failed = revoke_all_vouchers()
+                    for v in revoked:
+                        print(f"[CLOSE] Cleared: {v.code}")
+                    for v in failed:
+                        print(f"[CLOSE] Error revoking {v.code}: router did not confirm removal")
             except Exception as e:
                 print(f"[CLOSE] Error during user revocation: {e}")
             
@@ -606,8 +577,8 @@ class GenerateView(ctk.CTkFrame):
         self.result_text.configure(state="disabled")
 
     def refresh(self):
-        # Update profiles dropdown
-        profiles = [p['name'] for p in self.controller.profiles]
+        # Update profiles dropdown (re-read if profiles.json changed)
+        profiles = [p.name for p in profile_registry.all()]
         self.cb_profiles.configure(values=profiles)
         if profiles: self.cb_profiles.set(profiles[0])
 
@@ -615,40 +586,19 @@ class GenerateView(ctk.CTkFrame):
         profile_name = self.profile_var.get()
         if not profile_name: return
         
-        # Find profile
-        profile = next((p for p in self.controller.profiles if p['name'] == profile_name), None)
-        if not profile: return
-        
-        # Parse validity from profile to seconds
-        try:
-            val_str = profile['validity'].lower().strip()
-            total_seconds = 0
-            if val_str.endswith('h'): total_seconds = int(val_str[:-1]) * 3600
-            elif val_str.endswith('d'): total_seconds = int(val_str[:-1]) * 86400
-            elif val_str.endswith('m'): total_seconds = int(val_str[:-1]) * 60
-            else: total_seconds = int(val_str) * 60 # Default mins
-        except:
-            CustomMessageBox("Error", "Invalid validity format in profile.", "error")
+        parsed = profile_registry.get(profile_name)
+        if parsed is None:
+            CustomMessageBox("Error", "Invalid profile: " + "; ".join(profile_registry.errors), "error")
             return
 
-        qty = int(self.qty_var.get())
-        codes = []
-        
-        with self.controller.flask_app.app_context():
-            for _ in range(qty):
-                code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-                while Voucher.query.filter_by(code=code).first():
-                    code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-                
-                v = Voucher(
-                    code=code, 
-                    duration=total_seconds,
-                    rate_limit_up=profile.get('rate_up', '1M'),
-                    rate_limit_down=profile.get('rate_down', '2M')
-                )
-                db.session.add(v)
-                codes.append(f"{code}  ({profile['name']} - {profile['validity']} @ {profile.get('rate_up', '1M')}/{profile.get('rate_down', '2M')})")
-            db.session.commit()
+        try:
+            qty = int(self.qty_var.get())
+            with self.controller.flask_app.app_context():
+                new_codes = create_vouchers(qty, **parsed.voucher_fields())
+        except ValueError as e:
+            CustomMessageBox("Error", str(e), "error")
+            return
+        codes = [f"{code}  {parsed.label()}" for code in new_codes]
 
         self.result_text.configure(state="normal")
         self.result_text.insert(tk.END, f"--- NEW BATCH ({datetime.now().strftime('%H:%M:%S')}) ---\n")
@@ -713,12 +663,11 @@ class HotspotView(ctk.CTkFrame):
     def load_users(self):
         for i in self.tree_users.get_children(): self.tree_users.delete(i)
         
+        from app.sessions import iter_running_sessions
         with self.controller.flask_app.app_context():
-            # Mock data logic combined with DB
-            vouchers = Voucher.query.filter(Voucher.activated_at != None).all()
-            for v in vouchers:
-                if v.remaining_seconds > 0:
-                    self.tree_users.insert("", "end", values=(v.code, v.user_mac_address, "Activated", "-"))
+            # Only running sessions, read in pages as plain rows
+            for v in iter_running_sessions():
+                self.tree_users.insert("", "end", values=(v.code, v.user_mac_address, "Activated", "-"))
 
     def revoke_all_users(self):
         """Revoke access for all active users with confirmation."""
@@ -738,24 +687,14 @@ class HotspotView(ctk.CTkFrame):
         print("[HOTSPOT] Revoking all active users...")
         revoked_count = 0
         try:
-            from app.utils import mikrotik_revoke_mac
+            from app.sessions import revoke_all_vouchers
             with self.controller.flask_app.app_context():
-                vouchers = Voucher.query.filter(
-                    Voucher.activated_at != None,
-                    Voucher.user_mac_address != None
-                ).all()
-                
-                for v in vouchers:
-                    if v.user_mac_address and v.remaining_seconds > 0:
-                        try:
-                            if mikrotik_revoke_mac(v.user_mac_address):
-                                # Successfully revoked (or already gone), clear from DB
-                                v.user_mac_address = None
-                                db.session.commit()
-                                revoked_count += 1
-                                print(f"[HOTSPOT] Cleared: {v.code}")
-                        except Exception as e:
-                            print(f"[HOTSPOT] Error revoking {v.code}: {e}")
+                revoked, failed = revoke_all_vouchers(running_only=True)
+                revoked_count = len(revoked)
+                for v in revoked:
+                    print(f"[HOTSPOT] Cleared: {v.code}")
+                for v in failed:
+                    print(f"[HOTSPOT] Error revoking {v.code}: router did not confirm removal")
         except Exception as e:
             print(f"[HOTSPOT] Error during revoke all: {e}")
         
@@ -796,8 +735,8 @@ class HotspotView(ctk.CTkFrame):
     def refresh(self):
         # Reload profiles list
         for i in self.tree_profiles.get_children(): self.tree_profiles.delete(i)
-        for p in self.controller.profiles:
-            self.tree_profiles.insert("", "end", values=(p['name'], p['price'], p['validity'], f"{p['rate_up']}/{p['rate_down']}"))
+        for p in profile_registry.all():
+            self.tree_profiles.insert("", "end", values=(p.name, p.raw.get('price', 0), p.validity, f"{p.rate_up}/{p.rate_down}"))
 
     def open_add_profile(self):
         # Modal Dialog styled like screenshot
@@ -837,16 +776,17 @@ class HotspotView(ctk.CTkFrame):
             try:
                 new_p = {
                     "name": e_name.get(),
-                    "shared_users": e_users.get(),
+                    "users": e_users.get(),
                     "rate_up": e_rate_up.get(),
                     "rate_down": e_rate_down.get(),
                     "validity": e_validity.get(),
                     "price": e_price.get()
                 }
-                self.controller.profiles.append(new_p)
-                self.controller.save_profiles()
+                profile_registry.add(new_p)
                 self.refresh()
                 top.destroy()
+            except ProfileError as e:
+                CustomMessageBox("Error", str(e), "error")
             except Exception as e:
                 CustomMessageBox("Error", f"Failed to save profile: {e}", "error")
                 print(e)
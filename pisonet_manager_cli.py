@@ -7,8 +7,6 @@ Same functionalities as the GUI version but with a command-line interface
 import os
 import sys
 import json
-import secrets
-import string
 import threading
 import time
 import subprocess
@@ -28,6 +26,8 @@ load_dotenv()
 sys.path.append(os.getcwd())
 from app import create_app, db
 from app.models import Voucher, Admin
+from app.profiles import profile_registry, ProfileError
+from app.vouchers import create_vouchers
 
 
 class PisonetManagerCLI:
@@ -39,8 +39,6 @@ class PisonetManagerCLI:
         self.is_server_running = False
         self.server_process = None
         self._server = None
-        self.profiles_file = 'profiles.json'
-        self.profiles = []
         self.log_buffer = io.StringIO()  # Buffer for server logs
         self.load_profiles()
 
@@ -88,31 +86,15 @@ class PisonetManagerCLI:
             logger.handlers = []
 
     def load_profiles(self):
-        """Load profiles from profiles.json"""
-        self.profiles = []
-        if os.path.exists(self.profiles_file):
-            try:
-                with open(self.profiles_file, 'r') as f:
-                    self.profiles = json.load(f)
-            except Exception as e:
-                print(f"Error loading profiles: {e}")
-        
-        # If empty, add default
-        if not self.profiles:
-            self.profiles = [
-                {"name": "1H", "price": 10, "validity": "1h", "users": "1", "rate_up": "1M", "rate_down": "2M"},
-                {"name": "3H", "price": 25, "validity": "3h", "users": "1", "rate_up": "2M", "rate_down": "4M"}
-            ]
-            self.save_profiles()
+        """Create profiles.json with the default profiles if needed and report invalid entries"""
+        profile_registry.ensure_defaults()
+        for error in profile_registry.errors:
+            print(f"Warning: {error}")
 
-    def save_profiles(self):
-        """Save profiles to profiles.json"""
-        try:
-            with open(self.profiles_file, 'w') as f:
-                json.dump(self.profiles, f, indent=4)
-            print("Profiles saved successfully")
-        except Exception as e:
-            print(f"Error saving profiles: {e}")
+    @property
+    def profiles(self):
+        """Valid profiles from profiles.json (re-read when the file changes)"""
+        return profile_registry.entries()
 
     def print_header(self, title):
         """Print a formatted header"""
@@ -250,25 +232,13 @@ class PisonetManagerCLI:
         try:
             # Revoke all active users
             print("Revoking access for all active users...")
-            from app.utils import mikrotik_revoke_mac
+            from app.sessions import revoke_all_vouchers
             with self.flask_app.app_context():
-                vouchers = Voucher.query.filter(
-                    Voucher.activated_at != None,
-                    Voucher.user_mac_address != None
-                ).all()
+                revoked, failed = revoke_all_vouchers()
+                for v in failed:
+                    print(f"Error revoking {v.code}: router did not confirm removal")
                 
-                revoked_count = 0
-                for v in vouchers:
-                    if v.user_mac_address:
-                        try:
-                            if mikrotik_revoke_mac(v.user_mac_address):
-                                v.user_mac_address = None
-                                db.session.commit()
-                                revoked_count += 1
-                        except Exception as e:
-                            print(f"Error revoking {v.code}: {e}")
-                
-                print(f"Revoked access for {revoked_count} user(s)")
+                print(f"Revoked access for {len(revoked)} user(s)")
         except Exception as e:
             print(f"Error during revocation: {e}")
         
@@ -323,7 +293,8 @@ class PisonetManagerCLI:
                 "Generate Single Voucher",
                 "Generate Batch Vouchers",
                 "View All Profiles",
-                "Create New Profile"
+                "Create New Profile",
+                "Export / Print Vouchers"
             ]
             self.print_menu("Generate Vouchers", options, zero_label="Back")
             
@@ -339,6 +310,8 @@ class PisonetManagerCLI:
                 self.view_all_profiles()
             elif choice == "4":
                 self.create_new_profile()
+            elif choice == "5":
+                self.export_vouchers()
 
     def view_all_profiles(self):
         """Display all available profiles"""
@@ -433,41 +406,72 @@ class PisonetManagerCLI:
     def generate_vouchers(self, qty, profile):
         """Generate vouchers in database"""
         try:
-            # Parse validity from profile to seconds
-            val_str = profile['validity'].lower().strip()
-            total_seconds = 0
-            if val_str.endswith('h'):
-                total_seconds = int(val_str[:-1]) * 3600
-            elif val_str.endswith('d'):
-                total_seconds = int(val_str[:-1]) * 86400
-            elif val_str.endswith('m'):
-                total_seconds = int(val_str[:-1]) * 60
-            else:
-                total_seconds = int(val_str) * 60
+            parsed = profile_registry.get(profile['name'])
+            if parsed is None:
+                print(f"Error: Profile '{profile['name']}' is invalid: {'; '.join(profile_registry.errors)}")
+                return []
             
-            codes = []
             with self.flask_app.app_context():
-                for _ in range(qty):
-                    code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-                    while Voucher.query.filter_by(code=code).first():
-                        code = ''.join(secrets.choice(string.ascii_uppercase + string.digits) for _ in range(6))
-                    
-                    v = Voucher(
-                        code=code, 
-                        duration=total_seconds,
-                        rate_limit_up=profile.get('rate_up', '1M'),
-                        rate_limit_down=profile.get('rate_down', '2M')
-                    )
-                    db.session.add(v)
-                    codes.append(f"{code}  ({profile['name']} - {profile['validity']} @ {profile.get('rate_up', '1M')}/{profile.get('rate_down', '2M')})")
-                
-                db.session.commit()
+                new_codes = create_vouchers(qty, **parsed.voucher_fields())
             
-            return codes
+            return [f"{code}  {parsed.label()}" for code in new_codes]
         except Exception as e:
             print(f"Error generating vouchers: {e}")
             return []
 
+    def export_vouchers(self):
+        """Export vouchers to a CSV file or printable HTML sheets"""
+        from datetime import date
+        from app.vouchers import export_query, iter_export_records, iter_csv, iter_print_sheets, EXPORT_STATUSES
+        
+        print("\n" + "-" * 60)
+        print("Export / Print Vouchers")
+        print("-" * 60)
+        
+        try:
+            profile = input("Profile name (blank for all): ").strip() or None
+            status = input(f"Status ({'/'.join(EXPORT_STATUSES)}, blank for all) [unused]: ").strip().lower() or 'unused'
+            if status == 'all':
+                status = None
+            since = input("Created from (YYYY-MM-DD, blank for any): ").strip()
+            until = input("Created until (YYYY-MM-DD, blank for any): ").strip()
+            export_format = input("Format (csv/html) [csv]: ").strip().lower() or 'csv'
+            if export_format not in ('csv', 'html'):
+                print("Error: Format must be csv or html.\n")
+                return
+            
+            default_path = os.path.join('exports', f"vouchers-{date.today().isoformat()}.{export_format}")
+            path = input(f"Output file [{default_path}]: ").strip() or default_path
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            
+            with self.flask_app.app_context():
+                query = export_query(
+                    profile=profile,
+                    since=date.fromisoformat(since) if since else None,
+                    until=date.fromisoformat(until) if until else None,
+                    status=status
+                )
+                count = 0
+                
+                def counted(records):
+                    nonlocal count
+                    for record in records:
+                        count += 1
+                        yield record
+                
+                records = counted(iter_export_records(query))
+                chunks = iter_csv(records) if export_format == 'csv' else iter_print_sheets(records)
+                with open(path, 'w', newline='', encoding='utf-8') as f:
+                    for chunk in chunks:
+                        f.write(chunk)
+            
+            print(f"\nExported {count} voucher(s) to {path}")
+            if export_format == 'html':
+                print("Open it in a browser and print (or Save as PDF).")
+            print()
+        except ValueError as e:
+            print(f"Error: {e}\n")
+
     def create_new_profile(self):
         """Create a new profile"""
         print("\n" + "-" * 60)
@@ -496,14 +500,15 @@ class PisonetManagerCLI:
                 "price": price,
                 "validity": validity,
                 "users": users,
-                "rate_up": rate_up,
-                "rate_down": rate_down
+                "rate_up": rate_up or "1M",
+                "rate_down": rate_down or "2M"
             }
             
-            self.profiles.append(new_profile)
-            self.save_profiles()
+            profile_registry.add(new_profile)
             
             print(f"\nProfile '{name}' created successfully!\n")
+        except ProfileError as e:
+            print(f"Error: {e}\n")
         except KeyboardInterrupt:
             print("\nCancelled.\n")
         except Exception as e:
@@ -521,7 +526,8 @@ class PisonetManagerCLI:
                 "Revoke User Access",
                 "Revoke All Users",
                 "View User Profiles",
-                "Add/Edit Profile"
+                "Add/Edit Profile",
+                "Reconcile Router State"
             ]
             self.print_menu("Hotspot Management", options, zero_label="Back")
             
@@ -539,30 +545,42 @@ class PisonetManagerCLI:
                 self.view_user_profiles()
             elif choice == "5":
                 self.show_generate_menu()
+            elif choice == "6":
+                self.reconcile_router_state()
 
-    def view_active_users(self):
-        """Display list of active users"""
+    def view_active_users(self, page_size=20):
+        """Display running sessions, one page at a time"""
+        from app.sessions import running_sessions, remaining_seconds
+        
         print("\n" + "-" * 60)
         print("Active Users")
         print("-" * 60)
         
         try:
             with self.flask_app.app_context():
-                vouchers = Voucher.query.filter(Voucher.activated_at != None).all()
+                page = running_sessions(limit=page_size)
                 
-                if not vouchers:
+                if not page:
                     print("No active users.")
                     print("-" * 60 + "\n")
                     return
 
-                print(f"{ 'Code':<12} {'MAC Address':<18} {'Activated':<20} {'Status':<10}")
+                print(f"{ 'Code':<12} {'MAC Address':<18} {'Activated':<20} {'Remaining':<10}")
                 print("-" * 60)
                 
-                for v in vouchers:
-                    status = "Active" if v.remaining_seconds > 0 else "Expired"
-                    mac = v.user_mac_address or "N/A"
-                    activated = v.activated_at.strftime("%Y-%m-%d %H:%M:%S") if v.activated_at else "N/A"
-                    print(f"{v.code:<12} {mac:<18} {activated:<20} {status:<10}")
+                while page:
+                    for v in page:
+                        mac = v.user_mac_address or "N/A"
+                        activated = v.activated_at.strftime("%Y-%m-%d %H:%M:%S") if v.activated_at else "N/A"
+                        remaining = "Developer" if v.is_developer else \
+                            f"{remaining_seconds(v.expires_at) // 60}m"
+                        print(f"{v.code:<12} {mac:<18} {activated:<20} {remaining:<10}")
+                    
+                    if len(page) < page_size:
+                        break
+                    if input("-- Enter for more, q to stop: ").strip().lower() == 'q':
+                        break
+                    page = running_sessions(after=page[-1], limit=page_size)
                 
                 print("-" * 60 + "\n")
         except Exception as e:
@@ -601,9 +619,11 @@ class PisonetManagerCLI:
                 
                 try:
                     from app.utils import mikrotik_revoke_mac
+                    from app.sessions import expiry_scheduler
                     if mikrotik_revoke_mac(voucher.user_mac_address):
                         voucher.user_mac_address = None
                         db.session.commit()
+                        expiry_scheduler.cancel(voucher.id)
                         print(f"Access revoked for {code}\n")
                     else:
                         print(f"Failed to revoke access.\n")
@@ -627,28 +647,45 @@ class PisonetManagerCLI:
         print("Revoking access for all users...")
         
         try:
-            from app.utils import mikrotik_revoke_mac
+            from app.sessions import revoke_all_vouchers
             with self.flask_app.app_context():
-                vouchers = Voucher.query.filter(
-                    Voucher.activated_at != None,
-                    Voucher.user_mac_address != None
-                ).all()
-                
-                revoked_count = 0
-                for v in vouchers:
-                    if v.user_mac_address and v.remaining_seconds > 0:
-                        try:
-                            if mikrotik_revoke_mac(v.user_mac_address):
-                                v.user_mac_address = None
-                                db.session.commit()
-                                revoked_count += 1
-                        except Exception as e:
-                            print(f"Error revoking {v.code}: {e}")
+                revoked, failed = revoke_all_vouchers(running_only=True)
+                for v in failed:
+                    print(f"Error revoking {v.code}: router did not confirm removal")
                 
-                print(f"Revoked access for {revoked_count} user(s)\n")
+                print(f"Revoked access for {len(revoked)} user(s)\n")
         except Exception as e:
             print(f"Error revoking all users: {e}\n")
 
+    def reconcile_router_state(self):
+        """Compare active vouchers with router bindings/queues and fix any drift"""
+        print("\n" + "-" * 60)
+        print("Reconcile Router State")
+        print("-" * 60)
+        
+        try:
+            from app.reconcile import reconcile_router, format_report
+            with self.flask_app.app_context():
+                preview = reconcile_router(apply=False)
+                if preview is None:
+                    print("Error: Cannot connect to MikroTik router.\n")
+                    return
+                
+                print(f"Changes needed: {format_report(preview)}")
+                if not any(preview[op] for op in preview if op != 'errors'):
+                    print("Router already matches the database.\n")
+                    return
+                
+                confirm = input("Apply these changes? (yes/no): ").strip().lower()
+                if confirm != "yes":
+                    print("Cancelled.\n")
+                    return
+                
+                report = reconcile_router()
+                print(f"Applied: {format_report(report)}\n")
+        except Exception as e:
+            print(f"Error reconciling router state: {e}\n")
+
     def view_user_profiles(self):
         """Display user profiles"""
         self.view_all_profiles()
@@ -1033,26 +1070,20 @@ class PisonetManagerCLI:
 
     def view_database_stats(self):
         """Display database statistics"""
+        from app.sessions import voucher_status_counts
+        
         print("\n" + "-" * 60)
         print("Database Statistics")
         print("-" * 60)
         
         try:
             with self.flask_app.app_context():
-                total = Voucher.query.count()
-                unused = Voucher.query.filter_by(activated_at=None).count()
-                active = Voucher.query.filter(Voucher.activated_at != None).count()
-                expired = 0
+                counts = voucher_status_counts()
                 
-                now = datetime.now()
-                for v in Voucher.query.filter(Voucher.activated_at != None).all():
-                    if v.remaining_seconds <= 0:
-                        expired += 1
-                
-                print(f"Total Vouchers: {total}")
-                print(f"Unused: {unused}")
-                print(f"Active: {active - expired}")
-                print(f"Expired: {expired}")
+                print(f"Total Vouchers: {counts['total']}")
+                print(f"Unused: {counts['unused']}")
+                print(f"Active: {counts['active']}")
+                print(f"Expired: {counts['expired']}")
                 print("-" * 60 + "\n")
         except Exception as e:
             print(f"Error: {e}\n")
@@ -1337,20 +1368,9 @@ class PisonetManagerCLI:
     def _revoke_all_users_silent(self):
         """Revoke all users without prompts; used for cleanup on exit/crash."""
         try:
-            from app.utils import mikrotik_revoke_mac
+            from app.sessions import revoke_all_vouchers
             with self.flask_app.app_context():
-                vouchers = Voucher.query.filter(
-                    Voucher.activated_at != None,
-                    Voucher.user_mac_address != None
-                ).all()
-                for v in vouchers:
-                    if v.user_mac_address:
-                        try:
-                            if mikrotik_revoke_mac(v.user_mac_address):
-                                v.user_mac_address = None
-                                db.session.commit()
-                        except Exception:
-                            pass
+                revoke_all_vouchers()
         except Exception:
             pass
 
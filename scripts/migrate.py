@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+"""
+Bring the database schema up to date (replaces the old one-off migration scripts).
+
+The app also does this on startup; run it by hand to migrate before deploying
+or to check which schema version a database is at.
+
+Usage: python scripts/migrate.py [path/to/pisonet.db] [--status]
+"""
+
+import sys
+import os
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import create_engine
+from app.migrations import migrate, schema_version, MIGRATIONS, LATEST_VERSION
+
+def main():
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    db_path = args[0] if args else os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'instance', 'pisonet.db')
+
+    if not os.path.exists(db_path):
+        print("Database not found at:", db_path)
+        return False
+
+    engine = create_engine(f"sqlite:///{db_path}")
+    current = schema_version(engine)
+    print(f"Schema version: {current} (latest {LATEST_VERSION})")
+
+    if '--status' in sys.argv:
+        for version, description, _ in MIGRATIONS:
+            print(f"  [{'x' if version <= current else ' '}] {version}: {description}")
+        return True
+
+    try:
+        applied = migrate(engine)
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+
+    if applied:
+        print(f"✅ Applied {len(applied)} migration(s), now at version {schema_version(engine)}")
+    else:
+        print("✅ No migration needed")
+    return True
+
+if __name__ == '__main__':
+    success = main()
+    sys.exit(0 if success else 1)
@@ -0,0 +1,153 @@
+"""
+Check that the hot voucher queries use indexes.
+
+Runs the portal, status polling, expiry and accounting code paths against a
+throwaway database, records every SQL statement they send, and runs
+EXPLAIN QUERY PLAN on each one. A query that scans a whole table fails the
+test, so a change that loses its index is caught before the 2-second status
+polling multiplies it. Batch paths also have a query budget, so per-row
+lazy loads (one SELECT per voucher) are caught too.
+
+Run: python -m pytest tests/
+"""
+
+import os
+import re
+import sys
+import tempfile
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Throwaway database, background workers off, router unreachable (fails fast)
+os.environ['DATABASE_URL'] = 'sqlite:///' + os.path.join(tempfile.mkdtemp(), 'plans.db')
+os.environ.update({
+    'MIKROTIK_HOST': '127.0.0.1', 'MIKROTIK_PORT': '9', 'MIKROTIK_TIMEOUT': '1',
+    'ROUTER_MIRROR_INTERVAL': '0', 'RECONCILE_ON_STARTUP': 'false',
+    'TRAFFIC_SAMPLE_INTERVAL': '0', 'USAGE_SAMPLE_INTERVAL': '0', 'ACTIVATION_WORKERS': '0',
+})
+
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import event
+
+from app import create_app, db
+from app.models import Voucher, ActivationJob
+
+# A plan step that reads a whole table (or walks a whole index) instead of searching it
+FULL_SCAN = re.compile(r'\bSCAN (vouchers|activation_jobs|income_rollups)\b')
+
+MAC = 'AA:BB:CC:00:01:00'
+
+
+def seed():
+    now = datetime.now(timezone.utc)
+    rows = []
+    for i in range(2000):
+        mac = f"AA:BB:CC:{i // 256:02X}:{i % 256:02X}:00"
+        if i % 4 == 0:
+            rows.append(dict(code=f"U{i:05d}", duration=3600, activated_at=None, expires_at=None,
+                             user_mac_address=None, is_developer=False))
+        elif i % 4 == 1:
+            rows.append(dict(code=f"R{i:05d}", duration=3600, activated_at=now, expires_at=now + timedelta(hours=1),
+                             user_mac_address=mac, is_developer=False))
+        else:
+            rows.append(dict(code=f"E{i:05d}", duration=3600, activated_at=now - timedelta(days=2),
+                             expires_at=now - timedelta(days=1), user_mac_address=mac if i % 4 == 2 else None,
+                             is_developer=False))
+    db.session.execute(Voucher.__table__.insert(), rows)
+    db.session.add(ActivationJob(voucher_code='R00001', mac_address=MAC, duration=3600))
+    db.session.commit()
+
+
+def _sweep():
+    from app.sessions import sweep_expired_vouchers
+    sweep_expired_vouchers()
+
+
+def _pending_deadlines():
+    from app.sessions import pending_deadlines
+    pending_deadlines()
+
+
+def _running_sessions():
+    from app.sessions import running_sessions
+    running_sessions()
+
+
+def _running_sessions_next():
+    from app.sessions import running_sessions
+    running_sessions(after=running_sessions(limit=5)[-1], limit=5)
+
+
+def _desired_state():
+    from app.reconcile import desired_state
+    desired_state()
+
+
+def _usage():
+    from app.accounting import UsageMeter
+    UsageMeter().apply({MAC: (1, 1)})
+
+
+def _claim():
+    from app.jobs import activation_queue
+    activation_queue._claim()
+
+
+# (name, run(client), most statements allowed or None); run in this order, the sweep changes rows
+SCENARIOS = [
+    ("portal index by MAC", lambda client: client.get(f'/?mac={MAC}'), None),
+    ("status page by MAC", lambda client: client.get(f'/status?mac={MAC}'), None),
+    ("status polling by code", lambda client: client.get('/api/status/R00001'), None),
+    ("status polling by MAC", lambda client: client.get(f'/api/status/{MAC}'), None),
+    ("activation progress", lambda client: client.get('/api/activation/R00001'), None),
+    ("expiry sweep", lambda client: _sweep(), 5),
+    ("expiry scheduler seed", lambda client: _pending_deadlines(), None),
+    ("running sessions page", lambda client: _running_sessions(), None),
+    ("running sessions next page", lambda client: _running_sessions_next(), None),
+    ("reconcile desired state", lambda client: _desired_state(), None),
+    ("usage accounting", lambda client: _usage(), 5),
+    ("activation job claim", lambda client: _claim(), None),
+]
+
+
+@pytest.fixture(scope='module')
+def app():
+    app = create_app()
+    with app.app_context():
+        seed()
+        yield app
+
+
+@pytest.fixture(scope='module')
+def captured(app):
+    statements = []
+
+    def capture(conn, cursor, statement, parameters, context, executemany):
+        if not executemany and statement.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE')):
+            statements.append((statement, parameters))
+
+    event.listen(db.engine, 'before_cursor_execute', capture)
+    yield statements
+    event.remove(db.engine, 'before_cursor_execute', capture)
+
+
+@pytest.mark.parametrize('name, run, budget', SCENARIOS, ids=[name for name, _, _ in SCENARIOS])
+def test_hot_query_uses_index(app, captured, name, run, budget):
+    captured.clear()
+    run(app.test_client())
+    db.session.rollback()
+    statements = list(captured)
+
+    bad = []
+    with db.engine.connect() as conn:
+        for statement, parameters in statements:
+            plan = [row[3] for row in conn.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters)]
+            if any(FULL_SCAN.search(step) for step in plan):
+                bad.append(" ".join(statement.split())[:160] + "\n  -> " + "\n  -> ".join(plan))
+
+    assert not bad, f"{name}: full table scan\n" + "\n".join(bad)
+    if budget is not None:
+        assert len(statements) <= budget, f"{name}: {len(statements)} queries (at most {budget} expected)"